@@ -0,0 +1,180 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import timeit
+
+from client import GameState, LobbyState, ProtocolDecoder, FRAME_MARK
+
+# synthetic server output, in the format of describeState / describeRoom in server.cpp
+
+def nicks(rng, count, length=None):
+    out = []
+    for i in range(count):
+        size = length or rng.randint(3, 16)
+        out.append((f"p{i}_" + "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(size)))[:size])
+    return out
+
+def game_text(rng, players, nick_length=None, spectators=3, turn=1234):
+    names = nicks(rng, players, nick_length)
+    lines = [f"Turn {turn}", f"Current player: {names[turn % players]}"]
+    for nick in names:
+        table = rng.randint(0, 20)
+        lines.append(f"Player {nick} has {rng.randint(0, 40)} cards in hand and {table} cards on the table.")
+        if table:
+            lines.append(f"Currently on top- color {rng.randint(0, 3)}, shape {rng.randint(0, 17)}")
+    lines.append(f"{spectators} spectators watching.")
+    return "\n".join(lines) + "\n"
+
+def room_lines(rng, room_id, players, nick_length=None, spectators=None):
+    lines = [f"Room {room_id}- players:"]
+    lines += nicks(rng, players, nick_length)
+    lines.append(f"{rng.randint(0, 5) if spectators is None else spectators} spectators")
+    lines.append(rng.choice(("Waiting to start the match.", "Match in progress.")))
+    return lines
+
+def lobby_text(rng, rooms, nick_length=None, players=None, spectators=None):
+    lines = ["Available rooms:"]
+    for room_id in range(rooms):
+        count = rng.randint(0, 8) if players is None else players
+        lines += room_lines(rng, room_id, count, nick_length, spectators)
+    lines.append("End of rooms.")
+    return "\n".join(lines) + "\n"
+
+# protocol 3 frames as built by encodeRoster / encodeSnapshot / encodeDelta,
+# without the FRAME_MARK byte, the way LineFramer returns them
+
+def frame(kind, payload):
+    return kind.encode() + len(payload).to_bytes(2, "big") + payload
+
+def seat(rng):
+    table = rng.randint(0, 20)
+    top = bytes((rng.randint(0, 3), rng.randint(0, 17))) if table else b"\xff\xff"
+    return bytes((rng.randint(0, 40), table)) + top
+
+def state_frames(rng, players, nick_length=None, deltas=50):
+    names = [n.encode() for n in nicks(rng, players, nick_length)]
+    roster = frame("R", bytes((players,)) + b"".join(bytes((len(n),)) + n for n in names))
+    snapshot = frame("S", (1).to_bytes(4, "big") + (0).to_bytes(4, "big") + bytes((0, players, 0, 3))
+                     + b"".join(seat(rng) for _ in range(players)))
+    items = [roster, snapshot]
+    for version in range(2, deltas + 2):
+        changed = rng.randint(1, 2)
+        payload = version.to_bytes(4, "big") + (version - 1).to_bytes(4, "big")
+        payload += bytes((version % players, 0, 3, changed))
+        for index in rng.sample(range(players), changed):
+            payload += bytes((index,)) + seat(rng)
+        items.append(frame("D", payload))
+    assert all(item[0] != FRAME_MARK for item in items)
+    return items
+
+def cases(rng, gui):
+    out = {}
+    for players in range(2, 9):
+        text = game_text(rng, players)
+        out[f"GameState.parse/p{players}"] = lambda text=text: GameState.parse(text)
+    text = game_text(rng, 8, nick_length=16, spectators=65535, turn=2 ** 31 - 1)
+    out["GameState.parse/p8_long"] = lambda text=text: GameState.parse(text)
+    for rooms in (10, 100, 1000, 10000):
+        text = lobby_text(rng, rooms)
+        out[f"LobbyState.parse/r{rooms}"] = lambda text=text: LobbyState.parse(text)
+    text = lobby_text(rng, 1000, nick_length=16, players=8, spectators=65535)
+    out["LobbyState.parse/r1000_long"] = lambda text=text: LobbyState.parse(text)
+    for players in (2, 8):
+        items = state_frames(rng, players, nick_length=16)
+        out[f"ProtocolDecoder.delta/p{players}x50"] = lambda items=items: ProtocolDecoder().feed(items)
+    if gui:
+        out.update(gui_cases(rng, gui))
+    return out
+
+def gui_cases(rng, app):
+    out = {}
+    room = {"id": 7, "players": nicks(rng, 8, 16), "spectators": 65535, "state": "Match in progress."}
+    out["_process_single_room/p8_long"] = lambda: app._process_single_room(room)
+
+    def in_game(lines):
+        app.in_room = True
+        app.leaving_room = False
+        app.game_started = True
+        app._handle_data(lines, "server")
+    for players in (2, 8):
+        lines = game_text(rng, players, nick_length=16).splitlines()
+        app.nickname = lines[1].split(": ", 1)[1]
+        out[f"_handle_data/game_p{players}"] = lambda lines=lines: in_game(lines)
+
+    def in_lobby(lines):
+        app.game_started = False
+        app._handle_data(lines, "server")
+    for rooms in (10, 1000):
+        lines = lobby_text(rng, rooms).splitlines()
+        out[f"_handle_data/lobby_r{rooms}"] = lambda lines=lines: in_lobby(lines)
+    return out
+
+def make_gui():
+    # TotemClientGUI cases need a working Tk; without a display they are skipped
+    try:
+        import tkinter as tk
+        import client
+        root = tk.Tk()
+    except Exception as e:
+        print(f"Skipping GUI cases: {e}")
+        return None
+    root.withdraw()
+    app = client.TotemClientGUI(root, "bench", 0)
+    app.log_model.widget_filter = lambda text, tag: False
+    return app
+
+def measure(fn, repeat):
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat, number)) / number
+    return {"us_per_call": round(best * 1e6, 3), "number": number}
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get("cases", {}).get(name)
+        if not old:
+            continue
+        change = (result["us_per_call"] / old["us_per_call"] - 1) * 100
+        result["change_pct"] = round(change, 1)
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the client parsers and handlers")
+    parser.add_argument("-k", "--filter", default="", help="only cases whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-gui", action="store_true", help="skip cases that need a Tk display")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed slowdown in percent")
+    args = parser.parse_args()
+    app = None if args.no_gui else make_gui()
+    results = {}
+    for name, fn in cases(random.Random(args.seed), app).items():
+        if args.filter not in name:
+            continue
+        results[name] = measure(fn, args.repeat)
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+    for name, result in results.items():
+        change = f" ({result['change_pct']:+.1f}%)" if "change_pct" in result else ""
+        flag = " REGRESSION" if name in regressions else ""
+        print(f"{name:<36} {result['us_per_call']:>12.3f} us{change}{flag}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"python": platform.python_version(), "seed": args.seed,
+                       "threshold_pct": args.threshold, "cases": results}, f, indent=2)
+    if regressions:
+        print(f"{len(regressions)} case(s) slower than the baseline by more than {args.threshold}%")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,994 +1,1977 @@
-import socket
-import threading
-import queue
-import tkinter as tk
-from tkinter import ttk, messagebox
-import sys
-import re
-
-CARD_COLORS = {
-    0: "#ff4d4d",
-    1: "#4dff4d",
-    2: "#4d4dff",
-    3: "#ffff4d",
-}
-
-class NetworkClient:
-    def __init__(self, host, port, on_receive, on_disconnect):
-        self.host = host
-        self.port = port
-        self.on_receive = on_receive
-        self.on_disconnect = on_disconnect
-        self.sock = None
-        self.running = False
-        self.recv_thread = None
-        self.connected = False
-
-    def connect(self):
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.settimeout(5)
-        try:
-            self.sock.connect((self.host, self.port))
-            self.running = True
-            self.connected = True
-            self.recv_thread = threading.Thread(target=self._receiver_loop, daemon=True)
-            self.recv_thread.start()
-            return True
-        except Exception as e:
-            messagebox.showerror("Connection Error", f"Cannot connect to server:\n{e}")
-            return False
-
-    def _receiver_loop(self):
-        buffer = ""
-        try:
-            while self.running:
-                try:
-                    data = self.sock.recv(4096)
-                    if not data:
-                        break
-                    text = data.decode("utf-8", errors="replace")
-                    buffer += text
-                    while '\n' in buffer:
-                        line_end = buffer.find('\n')
-                        line = buffer[:line_end].rstrip('\r')
-                        buffer = buffer[line_end + 1:]
-                        if line:
-                            self.on_receive(line, "server")
-                except socket.timeout:
-                    continue
-                except Exception:
-                    break
-        except:
-            pass
-        finally:
-            self.running = False
-            self.connected = False
-            self.on_disconnect()
-
-    def send_line(self, line: str):
-        if not line.endswith("\n"):
-            line += "\n"
-        try:
-            self.sock.sendall(line.encode("utf-8"))
-        except:
-            pass
-
-    def close(self):
-        self.running = False
-        self.connected = False
-        try:
-            self.sock.shutdown(socket.SHUT_RDWR)
-        except:
-            pass
-        try:
-            self.sock.close()
-        except:
-            pass
-
-class GameState:
-    def __init__(self):
-        self.turn = None
-        self.players = []
-        self.spectators = 0
-        self.current_player_nick = None
-
-    @staticmethod
-    def parse(text: str):
-        lines = [l.strip() for l in text.splitlines() if l.strip()]
-        if not lines:
-            return None
-        state = GameState()
-        state.players = []
-        current_player = None
-        for line in lines:
-            if line.startswith("Turn "):
-                try:
-                    state.turn = int(line.split()[1])
-                except:
-                    state.turn = None
-                continue
-            if line.startswith("Current player:"):
-                state.current_player_nick = line.split(":", 1)[1].strip()
-                continue
-            clean = line.strip()
-            if clean.startswith("Player "):
-                try:
-                    m = re.match(
-                        r"Player\s+(\S+)\s+has\s+(\d+)\s+cards in hand\s+and\s+(\d+)\s+cards on the table",
-                        clean
-                    )
-                    if not m:
-                        continue
-                    nick = m.group(1)
-                    hand = int(m.group(2))
-                    table = int(m.group(3))
-                    current_player = {
-                        "nick": nick,
-                        "hand": hand,
-                        "table": table,
-                        "color": None,
-                        "shape": None,
-                    }
-                    state.players.append(current_player)
-                except Exception:
-                    continue
-            elif clean.startswith("Currently on top-") and current_player:
-                try:
-                    m = re.search(r"color\s+(\d+),\s*shape\s+(\d+)", clean)
-                    if m:
-                        current_player["color"] = int(m.group(1))
-                        current_player["shape"] = int(m.group(2))
-                except:
-                    pass
-            elif "spectators watching" in clean:
-                try:
-                    state.spectators = int(clean.split()[0])
-                except:
-                    state.spectators = 0
-        return state
-
-class LobbyState:
-    def __init__(self):
-        self.rooms = []
-
-    @staticmethod
-    def parse(text: str):
-        lobby = LobbyState()
-        lobby.rooms = []
-        lines = text.splitlines()
-        current_room = None
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-            if line.startswith("Room ") and "players:" in line:
-                if current_room:
-                    lobby.rooms.append(current_room)
-                try:
-                    room_id = int(line.split()[1].split('-')[0])
-                    current_room = {
-                        "id": room_id,
-                        "players": [],
-                        "spectators": 0,
-                        "state": "",
-                    }
-                except:
-                    current_room = None
-                continue
-            if current_room is None:
-                continue
-            if line and not any(x in line for x in ["spectators", "Waiting", "Match"]):
-                current_room["players"].append(line)
-                continue
-            if "spectators" in line:
-                try:
-                    current_room["spectators"] = int(line.split()[0])
-                except:
-                    current_room["spectators"] = 0
-                continue
-            if "Waiting to start the match." in line:
-                current_room["state"] = "Waiting to start the match."
-                continue
-            elif "Match in progress." in line:
-                current_room["state"] = "Match in progress."
-                continue
-        if current_room:
-            lobby.rooms.append(current_room)
-        return lobby
-
-class TotemClientGUI:
-    def __init__(self, root, host, port):
-        self.root = root
-        self.host = host
-        self.port = port
-        self.net = None
-        self.msg_queue = queue.Queue()
-        self.nickname = None
-        self.nickname_set = False
-        self.in_room = False
-        self.current_room_id = None
-        self.leaving_room = False
-        self.is_spectator = False
-        self.spectator_refresh_timer = None
-        self.lobby_refresh_timer = None
-        self.game_started = False
-        self.game_buffer = ""
-        self.lobby_buffer = ""
-        self.in_lobby_response = False
-        self.last_game_data_received = False
-        self.current_lobby = LobbyState()
-        self.current_game = GameState()
-        self._build_ui()
-        self._schedule_poll()
-
-    def _build_ui(self):
-        self.root.title("Totem Client")
-        self.tabs = ttk.Notebook(self.root)
-        self.tabs.pack(fill=tk.BOTH, expand=True)
-        self.tab_connect = ttk.Frame(self.tabs)
-        self.tab_lobby = ttk.Frame(self.tabs)
-        self.tab_game = ttk.Frame(self.tabs)
-        self.tab_log = ttk.Frame(self.tabs)
-        self.tabs.add(self.tab_connect, text="Connection")
-        self.tabs.add(self.tab_lobby, text="Lobby")
-        self.tabs.add(self.tab_game, text="Game")
-        self.tabs.add(self.tab_log, text="Log")
-        self.tabs.tab(1, state="disabled")
-        self.tabs.tab(2, state="disabled")
-        self._build_connect_tab()
-        self._build_lobby_tab()
-        self._build_game_tab()
-        self._build_log_tab()
-
-    def _build_connect_tab(self):
-        f = self.tab_connect
-        ttk.Label(f, text=f"Connecting to {self.host}:{self.port}").pack(pady=10)
-        connect_frame = ttk.Frame(f)
-        connect_frame.pack(pady=10)
-        ttk.Button(connect_frame, text="Connect to Server", command=self.on_connect).pack(pady=5)
-        self.connection_status = ttk.Label(f, text="Not connected", foreground="red")
-        self.connection_status.pack(pady=5)
-        nick_frame = ttk.Frame(f)
-        nick_frame.pack(pady=10)
-        ttk.Label(nick_frame, text="Nickname:").pack(side=tk.LEFT)
-        self.nick_entry = ttk.Entry(nick_frame, width=20, state="disabled")
-        self.nick_entry.pack(side=tk.LEFT, padx=5)
-        self.nick_entry.insert(0, "Player")
-        self.set_nick_button = ttk.Button(nick_frame, text="Set Nickname", command=self.on_set_nick, state="disabled")
-        self.set_nick_button.pack(side=tk.LEFT, padx=5)
-
-    def _build_lobby_tab(self):
-        f = self.tab_lobby
-        top = ttk.Frame(f)
-        top.pack(fill=tk.X, pady=5)
-        ttk.Button(top, text="Refresh List", command=self.send_list).pack(side=tk.LEFT, padx=5)
-        ttk.Label(top, text="Room ID:").pack(side=tk.LEFT)
-        self.room_entry = ttk.Entry(top, width=8)
-        self.room_entry.pack(side=tk.LEFT, padx=5)
-        ttk.Button(top, text="Create", command=self.send_create).pack(side=tk.LEFT, padx=5)
-        ttk.Button(top, text="Leave", command=self.send_leave).pack(side=tk.LEFT, padx=5)
-        self.start_lobby_button = ttk.Button(top, text="Start Game", command=self.send_start, state=tk.DISABLED)
-        self.start_lobby_button.pack(side=tk.LEFT, padx=5)
-        columns = ("id", "players", "spectators", "state")
-        self.lobby_tree = ttk.Treeview(f, columns=columns, show="headings", height=15)
-        self.lobby_tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
-        for col in columns:
-            self.lobby_tree.heading(col, text=col.capitalize())
-        self.lobby_tree.column("id", width=80)
-        self.lobby_tree.column("players", width=200)
-        self.lobby_tree.column("spectators", width=80)
-        self.lobby_tree.column("state", width=200)
-        bottom = ttk.Frame(f)
-        bottom.pack(fill=tk.X, pady=5)
-        ttk.Button(bottom, text="Join", command=self.on_join).pack(side=tk.LEFT, padx=5)
-        ttk.Button(bottom, text="Spectate", command=self.on_spectate).pack(side=tk.LEFT, padx=5)
-
-    def _build_game_tab(self):
-        f = self.tab_game
-        columns = ("nick", "hand", "table", "card")
-        self.game_tree = ttk.Treeview(f, columns=columns, show="headings", height=10)
-        self.game_tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
-        for col in columns:
-            self.game_tree.heading(col, text=col.capitalize())
-        self.game_tree.column("nick", width=120)
-        self.game_tree.column("hand", width=80)
-        self.game_tree.column("table", width=80)
-        self.game_tree.column("card", width=100)
-        self.normal_player_frame = ttk.Frame(f)
-        status_frame = ttk.Frame(self.normal_player_frame)
-        status_frame.pack(fill=tk.X, pady=5)
-        self.status_label = ttk.Label(status_frame, text="Turn: -, Spectators: -")
-        self.status_label.pack(side=tk.LEFT, padx=10)
-        ttk.Label(status_frame, text="Turn #:").pack(side=tk.LEFT)
-        self.turn_entry = ttk.Entry(status_frame, width=6)
-        self.turn_entry.pack(side=tk.LEFT, padx=5)
-        ttk.Button(status_frame, text="Refresh", command=self.send_refresh).pack(side=tk.LEFT, padx=5)
-        cards_frame = ttk.Frame(self.normal_player_frame)
-        cards_frame.pack(fill=tk.X, pady=10)
-        left_frame = ttk.Frame(cards_frame)
-        left_frame.pack(side=tk.LEFT, padx=10)
-        self.left_cards = []
-        self.left_nicks = []
-        for r in range(2):
-            for c in range(2):
-                card_frame = ttk.Frame(left_frame)
-                card_frame.grid(row=r, column=c, padx=3, pady=3)
-                canvas = tk.Canvas(card_frame, width=60, height=80, bg="white")
-                canvas.pack()
-                label = ttk.Label(card_frame, text="", font=("Arial", 8))
-                label.pack()
-                self.left_cards.append(canvas)
-                self.left_nicks.append(label)
-        self.card_canvas = tk.Canvas(cards_frame, width=120, height=160, bg="white")
-        self.card_canvas.pack(side=tk.LEFT, padx=20)
-        right_frame = ttk.Frame(cards_frame)
-        right_frame.pack(side=tk.LEFT, padx=10)
-        self.right_cards = []
-        self.right_nicks = []
-        for r in range(2):
-            for c in range(2):
-                card_frame = ttk.Frame(right_frame)
-                card_frame.grid(row=r, column=c, padx=3, pady=3)
-                canvas = tk.Canvas(card_frame, width=60, height=80, bg="white")
-                canvas.pack()
-                label = ttk.Label(card_frame, text="", font=("Arial", 8))
-                label.pack()
-                self.right_cards.append(canvas)
-                self.right_nicks.append(label)
-        self.spectator_frame = ttk.Frame(f)
-        ttk.Label(self.spectator_frame, text="Spectator View - Top Cards:").pack(pady=5)
-        cards_container = ttk.Frame(self.spectator_frame)
-        cards_container.pack()
-        self.spectator_cards = []
-        self.spectator_labels = []
-        for r in range(2):
-            for c in range(4):
-                card_frame = ttk.Frame(cards_container)
-                card_frame.grid(row=r, column=c, padx=5, pady=5)
-                canvas = tk.Canvas(card_frame, width=50, height=70, bg="white")
-                canvas.pack()
-                label = ttk.Label(card_frame, text="", font=("Arial", 8))
-                label.pack()
-                self.spectator_cards.append(canvas)
-                self.spectator_labels.append(label)
-        self.bottom_frame = ttk.Frame(f)
-        self.bottom_frame.pack(fill=tk.X, pady=10)
-        self.draw_button = ttk.Button(self.bottom_frame, text="Draw", command=self.send_draw)
-        self.draw_button.pack(side=tk.LEFT, padx=5)
-        self.grab_button = ttk.Button(self.bottom_frame, text="Grab", command=self.send_grab)
-        self.grab_button.pack(side=tk.LEFT, padx=5)
-        self.leave_game_button = ttk.Button(self.bottom_frame, text="Leave", command=self.send_leave)
-        self.leave_game_button.pack(side=tk.LEFT, padx=5)
-        self._update_spectator_view()
-
-    def _build_log_tab(self):
-        f = self.tab_log
-        log_frame = ttk.Frame(f)
-        log_frame.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
-        self.log_text = tk.Text(log_frame, height=25, wrap=tk.WORD, state=tk.DISABLED)
-        self.log_text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        self.log_text.tag_config("client", foreground="#00aa00")
-        self.log_text.tag_config("server", foreground="#0066ff")
-        self.log_text.tag_config("error", foreground="#cc0000")
-        self.log_text.tag_config("system", foreground="#888888")
-        scrollbar = ttk.Scrollbar(log_frame, command=self.log_text.yview)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.log_text["yscrollcommand"] = scrollbar.set
-        cmd_frame = ttk.Frame(f)
-        cmd_frame.pack(side=tk.BOTTOM, fill=tk.X, pady=5)
-        ttk.Label(cmd_frame, text="Command:").pack(side=tk.LEFT, padx=5)
-        self.cmd_entry = ttk.Entry(cmd_frame)
-        self.cmd_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
-        self.cmd_entry.bind("<Return>", lambda e: self.send_manual_cmd())
-        self.send_cmd_button = ttk.Button(cmd_frame, text="Send", command=self.send_manual_cmd)
-        self.send_cmd_button.pack(side=tk.LEFT, padx=5)
-
-    def _draw_small_card(self, canvas, color, shape, nick=""):
-        canvas.delete("all")
-        if color is None:
-            canvas.create_rectangle(2, 2, 58, 78, fill="lightgray", outline="black")
-            canvas.create_text(30, 30, text="?", font=("Arial", 12))
-        else:
-            fill = CARD_COLORS.get(color, "white")
-            canvas.create_rectangle(5, 5, 55, 75, fill=fill, outline="black", width=2)
-            canvas.create_text(30, 30, text=str(shape), font=("Arial", 14, "bold"))
-        if nick:
-            canvas.create_text(30, 60, text=nick[:6], font=("Arial", 8))
-
-    def _draw_big_card(self, canvas, color, shape):
-        canvas.delete("all")
-        if color is None:
-            canvas.create_rectangle(5, 5, 115, 155, fill="lightgray", outline="black", width=2)
-            canvas.create_text(60, 80, text="?", font=("Arial", 48))
-            return
-        fill = CARD_COLORS.get(color, "white")
-        canvas.create_rectangle(10, 10, 110, 150, fill=fill, outline="black", width=3)
-        canvas.create_text(60, 80, text=str(shape), font=("Arial", 32, "bold"))
-
-    def _draw_spectator_card(self, canvas, color, shape, player_nick):
-        canvas.delete("all")
-        if color is None:
-            canvas.create_rectangle(2, 2, 48, 68, fill="lightgray", outline="black")
-            canvas.create_text(25, 25, text="?", font=("Arial", 10))
-        else:
-            fill = CARD_COLORS.get(color, "white")
-            canvas.create_rectangle(2, 2, 48, 68, fill=fill, outline="black", width=1)
-            canvas.create_text(25, 25, text=str(shape), font=("Arial", 10, "bold"))
-
-    def _clear_game_ui(self):
-        for item in self.game_tree.get_children():
-            self.game_tree.delete(item)
-        self.status_label.configure(text="Turn: -, Spectators: -")
-        self.turn_entry.delete(0, tk.END)
-        self.card_canvas.delete("all")
-        for canvas in self.left_cards + self.right_cards:
-            canvas.delete("all")
-        for label in self.left_nicks + self.right_nicks:
-            label.config(text="")
-        for canvas in self.spectator_cards:
-            canvas.delete("all")
-        for label in self.spectator_labels:
-            label.config(text="")
-
-    def _update_spectator_view(self):
-        if self.is_spectator:
-            self.normal_player_frame.pack_forget()
-            self.spectator_frame.pack(fill=tk.X, pady=10)
-            self.draw_button.pack_forget()
-            self.grab_button.pack_forget()
-            self.leave_game_button.pack(side=tk.LEFT, padx=5)
-        else:
-            self.normal_player_frame.pack(fill=tk.X, pady=5)
-            self.spectator_frame.pack_forget()
-            self.draw_button.pack(side=tk.LEFT, padx=5)
-            self.grab_button.pack(side=tk.LEFT, padx=5)
-            self.leave_game_button.pack(side=tk.LEFT, padx=5)
-
-    def _start_spectator_refresh(self):
-        if self.spectator_refresh_timer:
-            self.root.after_cancel(self.spectator_refresh_timer)
-        if self.is_spectator and self.in_room and self.net and self.net.connected:
-            self.net.send_line("refresh")
-            self.msg_queue.put((f"[CLIENT -> SERVER] refresh", "client"))
-            self.spectator_refresh_timer = self.root.after(1000, self._start_spectator_refresh)
-
-    def _stop_spectator_refresh(self):
-        if self.spectator_refresh_timer:
-            self.root.after_cancel(self.spectator_refresh_timer)
-            self.spectator_refresh_timer = None
-
-    def _start_lobby_refresh(self):
-        if self.lobby_refresh_timer:
-            self.root.after_cancel(self.lobby_refresh_timer)
-        if self.game_started:
-            self._stop_lobby_refresh()
-            return
-        if not self.is_spectator and self.in_room and self.net and self.net.connected:
-            self.net.send_line("list")
-            self.msg_queue.put((f"[CLIENT -> SERVER] list", "client"))
-            self.lobby_refresh_timer = self.root.after(5000, self._start_lobby_refresh)
-
-    def _stop_lobby_refresh(self):
-        if self.lobby_refresh_timer:
-            self.root.after_cancel(self.lobby_refresh_timer)
-            self.lobby_refresh_timer = None
-
-    def log(self, text, tag=None):
-        self.log_text.configure(state=tk.NORMAL)
-        if tag:
-            self.log_text.insert(tk.END, text + "\n", tag)
-        else:
-            self.log_text.insert(tk.END, text + "\n")
-        self.log_text.see(tk.END)
-        self.log_text.configure(state=tk.DISABLED)
-
-    def on_connect(self):
-        self.log(f"[SYSTEM] Connecting to {self.host}:{self.port}...", "system")
-        self.net = NetworkClient(
-            self.host,
-            self.port,
-            on_receive=lambda data, tag=None: self.msg_queue.put((data, tag)),
-            on_disconnect=self.on_disconnect,
-        )
-        if self.net.connect():
-            self.log("[SYSTEM] Connected to server", "system")
-            self.connection_status.configure(text="Connected", foreground="green")
-            self.nick_entry.configure(state="normal")
-            self.set_nick_button.configure(state="normal")
-            self.log("[SYSTEM] Choose and set your nickname", "system")
-
-    def on_set_nick(self):
-        if not self.net or not self.net.connected:
-            messagebox.showerror("Error", "First connect to the server")
-            return
-        nick = self.nick_entry.get().strip()
-        if len(nick) < 3:
-            messagebox.showerror("Error", "Nickname must be at least 3 characters long.")
-            return
-        if len(nick) > 16:
-            messagebox.showerror("Error", "Nickname cannot be longer than 16 characters.")
-            return
-        self.log(f"[SYSTEM] Trying to set nickname: {nick}", "system")
-        self.net.send_line(nick)
-        self.msg_queue.put((f"[CLIENT -> SERVER] {nick}", "client"))
-
-    def on_disconnect(self):
-        self.log("[SYSTEM] Disconnected from server.", "system")
-        self._stop_spectator_refresh()
-        self._stop_lobby_refresh()
-        self.connection_status.configure(text="Not connected", foreground="red")
-        self.nick_entry.configure(state="disabled")
-        self.set_nick_button.configure(state="disabled")
-        self.tabs.tab(1, state="disabled")
-        self.tabs.tab(2, state="disabled")
-        self.tabs.tab(0, state="normal")
-        self.tabs.select(0)
-        self.is_spectator = False
-        self.in_room = False
-        self.game_started = False
-
-    def send_manual_cmd(self):
-        cmd = self.cmd_entry.get().strip()
-        if cmd and self.net:
-            self.net.send_line(cmd)
-            self.msg_queue.put((f"[CLIENT -> SERVER] {cmd}", "client"))
-            self.cmd_entry.delete(0, tk.END)
-
-    def send_list(self):
-        if self.net and not self.game_started:
-            self.net.send_line("list")
-            self.msg_queue.put((f"[CLIENT -> SERVER] list", "client"))
-
-    def send_create(self):
-        rid = self.room_entry.get().strip()
-        if rid.isdigit() and self.net:
-            self.net.send_line(f"create {rid}")
-            self.msg_queue.put((f"[CLIENT -> SERVER] create {rid}", "client"))
-            self.root.after(1000, self.send_list)
-
-    def send_leave(self):
-        if self.net:
-            self._stop_spectator_refresh()
-            self._stop_lobby_refresh()
-            self.game_started = False
-            self.leaving_room = True
-            self.net.send_line("leave")
-            self.msg_queue.put((f"[CLIENT -> SERVER] leave", "client"))
-            self.current_room_id = None
-            self.in_room = False
-            self.is_spectator = False
-            self._clear_game_state()
-            self.tabs.tab(2, state="disabled")
-            self.tabs.tab(1, state="normal")
-            self.tabs.select(self.tab_lobby)
-            self.root.after(2000, lambda: setattr(self, 'leaving_room', False))
-            self.root.after(500, self.send_list)
-
-    def _clear_game_state(self):
-        self.game_buffer = ""
-        self._clear_game_ui()
-        self.current_game = GameState()
-        self.last_game_data_received = False
-
-    def send_start(self):
-        if self.net and not self.is_spectator:
-            self.net.send_line("start")
-            self.msg_queue.put((f"[CLIENT -> SERVER] start", "client"))
-            self._stop_lobby_refresh()
-            self.game_started = True
-
-    def send_refresh(self):
-        if self.net:
-            self.net.send_line("refresh")
-            self.msg_queue.put((f"[CLIENT -> SERVER] refresh", "client"))
-
-    def send_draw(self):
-        if self.net and not self.is_spectator:
-            t = self.turn_entry.get().strip()
-            if t.isdigit():
-                self.net.send_line(f"draw {t}")
-                self.msg_queue.put((f"[CLIENT -> SERVER] draw {t}", "client"))
-
-    def send_grab(self):
-        if self.net and not self.is_spectator:
-            t = self.turn_entry.get().strip()
-            if t.isdigit():
-                self.net.send_line(f"grab {t}")
-                self.msg_queue.put((f"[CLIENT -> SERVER] grab {t}", "client"))
-
-    def on_join(self):
-        sel = self.lobby_tree.selection()
-        if not sel:
-            messagebox.showwarning("No selection", "Select a room from the list")
-            return
-        rid = self.lobby_tree.item(sel[0], "values")[0]
-        if self.net:
-            self._stop_spectator_refresh()
-            self._stop_lobby_refresh()
-            self.game_started = False
-            self._clear_game_state()
-            self.net.send_line(f"join {rid}")
-            self.msg_queue.put((f"[CLIENT -> SERVER] join {rid}", "client"))
-            self.is_spectator = False
-            self.in_room = False
-            self._update_spectator_view()
-            self.root.after(1000, self.send_list)
-            self.root.after(6000, self._start_lobby_refresh)
-
-    def on_spectate(self):
-        sel = self.lobby_tree.selection()
-        if not sel:
-            messagebox.showwarning("No selection", "Select a room from the list")
-            return
-        rid = self.lobby_tree.item(sel[0], "values")[0]
-        if self.net:
-            self._stop_spectator_refresh()
-            self._stop_lobby_refresh()
-            self.game_started = False
-            self._clear_game_state()
-            self.net.send_line(f"spectate {rid}")
-            self.msg_queue.put((f"[CLIENT -> SERVER] spectate {rid}", "client"))
-            self.is_spectator = True
-            self.current_room_id = rid
-            self.in_room = True
-            self._update_spectator_view()
-            self.root.after(500, self._start_spectator_refresh)
-
-    def _return_to_lobby_after_game(self):
-        if self.net:
-            self.net.send_line("leave")
-            self.msg_queue.put((f"[CLIENT -> SERVER] leave", "client"))
-        self._stop_spectator_refresh()
-        self._stop_lobby_refresh()
-        self.game_started = False
-        self.tabs.tab(2, state="disabled")
-        self.tabs.tab(1, state="normal")
-        self.tabs.select(self.tab_lobby)
-        self.current_room_id = None
-        self.in_room = False
-        self.is_spectator = False
-        self._clear_game_state()
-        self.root.after(500, self.send_list)
-
-    def _schedule_poll(self):
-        self.root.after(50, self._poll)
-
-    def _poll(self):
-        try:
-            while True:
-                data, tag = self.msg_queue.get_nowait()
-                self._handle_data(data, tag)
-        except queue.Empty:
-            pass
-        self._schedule_poll()
-
-    def _handle_data(self, data, tag=None):
-        if tag:
-            self.log(data, tag)
-        else:
-            self.log(data, "server")
-        if self.leaving_room:
-            if "Currently not in a room" in data or "Not in a room" in data:
-                self.leaving_room = False
-                return
-            if "Turn " in data or "Current player:" in data or "Player " in data:
-                return
-        if not self.nickname_set and "Nickname set successfully" in data:
-            self.nickname_set = True
-            self.nickname = self.nick_entry.get().strip()
-            self.tabs.tab(0, state="disabled")
-            self.tabs.tab(1, state="normal")
-            self.tabs.select(self.tab_lobby)
-            self.log("[SYSTEM] Nickname set successfully, switching to lobby", "system")
-            self.root.after(1000, self.send_list)
-            return
-        if not self.nickname_set and "Nickname unavailable" in data:
-            messagebox.showerror("Nickname taken", "This nickname is already taken. Choose another.")
-            self.log("[SYSTEM] Nickname taken, choose another", "system")
-            return
-        if not self.nickname_set and "Nickname must be between" in data:
-            messagebox.showerror("Invalid nickname", "Nickname must be between 3 and 16 characters.")
-            self.log("[SYSTEM] Invalid nickname", "system")
-            return
-        if "Currently not in a room" in data or "Not in a room" in data:
-            self._stop_spectator_refresh()
-            self._stop_lobby_refresh()
-            self.game_started = False
-            self.current_room_id = None
-            self.in_room = False
-            self.is_spectator = False
-            self._clear_game_state()
-            self.tabs.tab(2, state="disabled")
-            self.tabs.tab(1, state="normal")
-            self.tabs.select(self.tab_lobby)
-            self.root.after(500, self.send_list)
-            return
-        if "Turn " in data and self.in_room:
-            self.last_game_data_received = True
-            if not self.in_lobby_response:
-                self.game_buffer = data + "\n"
-                if "spectators watching" in data:
-                    self.root.after(100, self._process_game_buffer)
-            return
-        if self.game_buffer and self.in_room and not self.in_lobby_response:
-            self.game_buffer += data + "\n"
-            end_indicators = [
-                "spectators watching",
-                "spectators\n",
-                "cards on the table",
-                "Match halted",
-                "All players left"
-            ]
-            if any(indicator in data for indicator in end_indicators):
-                self.root.after(100, self._process_game_buffer)
-            return
-        if "Match in progress." in data and self.in_room and self.last_game_data_received:
-            if "Room " in data and "players:" in data:
-                lines = data.split('\n')
-                for line in lines:
-                    line = line.strip()
-                    if line.startswith("Room ") and "players:" in line:
-                        try:
-                            room_id = int(line.split()[1].split('-')[0])
-                            if self.current_room_id and room_id == self.current_room_id:
-                                self.log("[SYSTEM] Game started, switching to game tab", "system")
-                                self.tabs.tab(2, state="normal")
-                                self.tabs.select(self.tab_game)
-                                self._update_spectator_view()
-                                self._stop_lobby_refresh()
-                                self.game_started = True
-                            return
-                        except:
-                            pass
-                return
-            self.log("[SYSTEM] Game started, switching to game tab", "system")
-            self.tabs.tab(2, state="normal")
-            self.tabs.select(self.tab_game)
-            self._update_spectator_view()
-            self._stop_lobby_refresh()
-            self.game_started = True
-            return
-        error_keywords = [
-            "permission", "Not in a room", "Invalid", "full", 
-            "doesn't exist", "less than 2 players", "Error",
-            "Already in a room", "Currently not in a room",
-            "Command too long", "Unrecognized command",
-            "Room already exists", "has already started"
-        ]
-        lines = data.split('\n')
-        for line in lines:
-            line = line.strip()
-            if any(keyword in line for keyword in error_keywords):
-                if "Available commands" not in line:
-                    self.log(f"[ERROR] {line}", "error")
-        if "You won the game!" in data:
-            if not self.is_spectator:
-                messagebox.showinfo("You won!", "Congratulations! You won the game!")
-            self._return_to_lobby_after_game()
-            return
-        if "You lost the game." in data:
-            if not self.is_spectator:
-                messagebox.showinfo("You lost", "Unfortunately, you lost the game.")
-            self._return_to_lobby_after_game()
-            return
-        if "Available rooms:" in data and not self.game_started:
-            self.in_lobby_response = True
-            self.lobby_buffer = data + "\n"
-            self.last_game_data_received = False
-            return
-        if self.in_lobby_response:
-            self.lobby_buffer += data + "\n"
-            if ("Waiting to start the match." in data or 
-                "Match in progress." in data or
-                "spectators\n" in data or
-                "spectators watching" in data):
-                self.root.after(100, self._process_lobby_buffer)
-            return
-        if "Room " in data and "players:" in data and not self.game_buffer and self.in_room:
-            self._process_single_room(data)
-            return
-
-    def _process_lobby_buffer(self):
-        if not self.lobby_buffer:
-            return
-        try:
-            lobby = LobbyState.parse(self.lobby_buffer)
-            if lobby and lobby.rooms:
-                self.current_lobby = lobby
-                for item in self.lobby_tree.get_children():
-                    self.lobby_tree.delete(item)
-                for room in lobby.rooms:
-                    players_str = ", ".join(room["players"]) if room["players"] else "(empty)"
-                    self.lobby_tree.insert("", tk.END, values=(
-                        room["id"],
-                        players_str,
-                        room["spectators"],
-                        room["state"],
-                    ))
-                self.current_room_id = None
-                self.is_spectator = False
-                for room in lobby.rooms:
-                    if self.nickname in room["players"]:
-                        self.current_room_id = room["id"]
-                        self.in_room = True
-                        self.is_spectator = False
-                        break
-                self.start_lobby_button.configure(state=tk.DISABLED)
-                if self.current_room_id and not self.is_spectator:
-                    for room in lobby.rooms:
-                        if room["id"] == self.current_room_id:
-                            if room["players"] and room["players"][0] == self.nickname:
-                                if room["state"] == "Waiting to start the match.":
-                                    self.start_lobby_button.configure(state=tk.NORMAL)
-                            break
-                if not self.game_started and not self.is_spectator and self.in_room and not self.lobby_refresh_timer:
-                    self.root.after(1000, self._start_lobby_refresh)
-        except Exception as e:
-            self.log(f"[ERROR] Lobby parsing error: {e}", "error")
-        finally:
-            self.lobby_buffer = ""
-            self.in_lobby_response = False
-
-    def _process_game_buffer(self):
-        if not self.game_buffer:
-            return
-        try:
-            game = GameState.parse(self.game_buffer)
-            if game and game.players:
-                self.current_game = game
-                self.tabs.tab(2, state="normal")
-                self.tabs.select(self.tab_game)
-                self._update_spectator_view()
-                turn_str = str(game.turn) if game.turn is not None else "-"
-                spectator_text = " (SPECTATOR)" if self.is_spectator else ""
-                self.status_label.configure(
-                    text=f"Turn: {turn_str}, Spectators: {game.spectators}{spectator_text}"
-                )
-                for item in self.game_tree.get_children():
-                    self.game_tree.delete(item)
-                for player in game.players:
-                    card_str = f"({player['color']}, {player['shape']})" if player['color'] is not None else "-"
-                    self.game_tree.insert("", tk.END, values=(
-                        player["nick"],
-                        player["hand"],
-                        player["table"],
-                        card_str
-                    ))
-                if game.turn is not None and not self.is_spectator:
-                    self.turn_entry.delete(0, tk.END)
-                    self.turn_entry.insert(0, str(game.turn))
-                if self.is_spectator:
-                    self._draw_spectator_cards(game)
-                else:
-                    self._draw_cards(game)
-        except Exception as e:
-            self.log(f"[ERROR] Game parsing error: {e}\nBuffer was:\n{self.game_buffer}", "error")
-        finally:
-            self.game_buffer = ""
-
-    def _process_single_room(self, data):
-        try:
-            lines = data.splitlines()
-            room_info = None
-            for line in lines:
-                line = line.strip()
-                if not line:
-                    continue
-                if line.startswith("Room ") and "players:" in line:
-                    if room_info:
-                        break
-                    try:
-                        room_id = int(line.split()[1].split('-')[0])
-                        room_info = {
-                            "id": room_id,
-                            "players": [],
-                            "spectators": 0,
-                            "state": "",
-                        }
-                    except:
-                        room_info = None
-                elif room_info:
-                    if line and not any(x in line for x in ["spectators", "Waiting", "Match"]):
-                        room_info["players"].append(line)
-                    elif "spectators" in line:
-                        try:
-                            room_info["spectators"] = int(line.split()[0])
-                        except:
-                            pass
-                    elif "Waiting to start the match." in line:
-                        room_info["state"] = "Waiting to start the match."
-                    elif "Match in progress." in line:
-                        room_info["state"] = "Match in progress."
-            if room_info:
-                players_str = ", ".join(room_info["players"]) if room_info["players"] else "(empty)"
-                msg = f"Room {room_info['id']}: {players_str}, {room_info['spectators']} spectators, {room_info['state']}"
-                self.log(msg, "system")
-                if self.nickname in room_info["players"]:
-                    self.current_room_id = room_info["id"]
-                    self.in_room = True
-                    self.is_spectator = False
-                    self.log(f"[SYSTEM] Joined room {self.current_room_id}", "system")
-                elif self.is_spectator:
-                    self.current_room_id = room_info["id"]
-                    self.in_room = True
-                    self.log(f"[SYSTEM] Joined as spectator to room {self.current_room_id}", "system")
-        except Exception as e:
-            self.log(f"[ERROR] Room parsing error: {e}", "error")
-
-    def _draw_cards(self, game):
-        my_player = None
-        for player in game.players:
-            if player["nick"] == self.nickname:
-                my_player = player
-                break
-        if my_player:
-            self._draw_big_card(self.card_canvas, my_player["color"], my_player["shape"])
-        else:
-            self._draw_big_card(self.card_canvas, None, None)
-        my_index = -1
-        for i, player in enumerate(game.players):
-            if player["nick"] == self.nickname:
-                my_index = i
-                break
-        for canvas in self.left_cards + self.right_cards:
-            canvas.delete("all")
-        for label in self.left_nicks + self.right_nicks:
-            label.config(text="")
-        if my_index >= 0 and len(game.players) > 1:
-            other_players = []
-            for i in range(1, len(game.players)):
-                idx = (my_index + i) % len(game.players)
-                other_players.append(game.players[idx])
-            for i in range(min(4, len(other_players))):
-                player = other_players[i]
-                if i < len(self.left_cards):
-                    self._draw_small_card(self.left_cards[i], player["color"], player["shape"], player["nick"])
-            for i in range(min(3, len(other_players) - 4)):
-                player = other_players[i + 4]
-                if i < len(self.right_cards):
-                    self._draw_small_card(self.right_cards[i], player["color"], player["shape"], player["nick"])
-
-    def _draw_spectator_cards(self, game):
-        for canvas in self.spectator_cards:
-            canvas.delete("all")
-        for label in self.spectator_labels:
-            label.config(text="")
-        for i in range(min(8, len(game.players))):
-            player = game.players[i]
-            canvas = self.spectator_cards[i]
-            label = self.spectator_labels[i]
-            if player['color'] is not None:
-                fill = CARD_COLORS.get(player['color'], "white")
-                canvas.create_rectangle(5, 5, 45, 65, fill=fill, outline="black", width=2)
-                canvas.create_text(25, 25, text=str(player['shape']), font=("Arial", 10, "bold"))
-            else:
-                canvas.create_rectangle(5, 5, 45, 65, fill="lightgray", outline="black", width=2)
-                canvas.create_text(25, 25, text="?", font=("Arial", 10))
-            label.config(text=player['nick'][:8] if player['nick'] else "")
-
-    def force_switch_to_game(self):
-        self.log("[SYSTEM] Forcing switch to game", "system")
-        self.tabs.tab(2, state="normal")
-        self.tabs.select(self.tab_game)
-        self._update_spectator_view()
-        self.send_refresh()
-
-def main():
-    if len(sys.argv) != 3:
-        print("Usage: python3 client.py <IP> <PORT>")
-        print("Example: python3 client.py localhost 12345")
-        sys.exit(1)
-    host = sys.argv[1]
-    port = int(sys.argv[2])
-    root = tk.Tk()
-    root.geometry("1000x750")
-    app = TotemClientGUI(root, host, port)
-    def on_close():
-        if app.net:
-            app.net.close()
-        root.destroy()
-    root.protocol("WM_DELETE_WINDOW", on_close)
-    root.mainloop()
-
-if __name__ == "__main__":
-    main()
\ No newline at end of file
+import argparse
+import asyncio
+import bisect
+import json
+import os
+import threading
+import queue
+import sys
+import re
+import struct
+import time
+from collections import namedtuple, deque
+
+# tkinter is imported on first use, so --headless and the tools built on this module start without it
+tk = ttk = messagebox = filedialog = None
+
+def load_tk():
+    global tk, ttk, messagebox, filedialog
+    if tk is None:
+        import tkinter
+        from tkinter import ttk as tk_ttk, messagebox as tk_messagebox, filedialog as tk_filedialog
+        tk, ttk, messagebox, filedialog = tkinter, tk_ttk, tk_messagebox, tk_filedialog
+    return tk
+
+CARD_COLORS = {
+    0: "#ff4d4d",
+    1: "#4dff4d",
+    2: "#4d4dff",
+    3: "#ffff4d",
+}
+
+SMALL_CARD = {
+    "unknown": ((2, 2, 58, 78), 1, ("Arial", 12)),
+    "known": ((5, 5, 55, 75), 2, ("Arial", 14, "bold")),
+    "text": (30, 30),
+    "nick": (30, 60),
+}
+BIG_CARD = {
+    "unknown": ((5, 5, 115, 155), 2, ("Arial", 48)),
+    "known": ((10, 10, 110, 150), 3, ("Arial", 32, "bold")),
+    "text": (60, 80),
+    "nick": None,
+}
+SPECTATOR_CARD = {
+    "unknown": ((5, 5, 45, 65), 2, ("Arial", 10)),
+    "known": ((5, 5, 45, 65), 2, ("Arial", 10, "bold")),
+    "text": (25, 25),
+    "nick": None,
+}
+
+LOG_MAX_LINES = 5000
+
+FRAME_INTERVAL_MS = 16
+IDLE_POLL_MS = 50
+DRAIN_BUDGET_MS = 8
+
+PROTO_TEXT = 1
+PROTO_BINARY = 2
+PROTO_DELTA = 3
+FRAME_MARK = 0x01
+FRAME_HEADER = 4
+
+CAPTURE_MAGIC = b"TOTEMCAP1\n"
+REC_SESSION = ord("H")
+REC_RECEIVED = ord("R")
+REC_SENT = ord("S")
+_REC_HEADER = struct.Struct("<BqI")
+_REC_ITEM = struct.Struct("<BI")
+
+LATENCY_WINDOW = 1000
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+TIMED_COMMANDS = ("draw", "grab")
+ACTION_STAGES = ("response", "frame", "render")
+STATS_REFRESH_MS = 1000
+
+class LineFramer:
+    def __init__(self):
+        self.buffer = bytearray()
+        self.binary = False
+
+    def feed(self, data):
+        if self.binary or FRAME_MARK in data:
+            self.binary = True
+            return self._feed_mixed(data)
+        # some server replies are terminated with NUL instead of a newline
+        if b"\0" in data:
+            data = data.replace(b"\0", b"\n")
+        buf = self.buffer
+        start = len(buf)
+        buf += data
+        end = buf.find(b"\n", start)
+        if end == -1:
+            return []
+        end = buf.rfind(b"\n", end)
+        # '\n' never occurs inside a multi-byte UTF-8 sequence, so only whole lines get decoded
+        with memoryview(buf) as view:
+            text = str(view[:end], "utf-8", "replace")
+        del buf[:end + 1]
+        return [line for line in text.replace("\r", "").split("\n") if line]
+
+    # protocol 2: binary frames (returned as bytes) interleaved with text lines;
+    # frame payloads may contain '\n' or NUL, so frames are stepped over by their length
+    # and only the text between them is searched for separators
+    def _feed_mixed(self, data):
+        buf = self.buffer
+        buf += data
+        items = []
+        pos = 0
+        size = len(buf)
+        while pos < size:
+            if buf[pos] == FRAME_MARK:
+                if size - pos < FRAME_HEADER:
+                    break
+                end = pos + FRAME_HEADER + int.from_bytes(buf[pos + 2:pos + 4], "big")
+                if end > size:
+                    break
+                items.append(bytes(buf[pos + 1:end]))
+                pos = end
+                continue
+            # a frame mark also ends the line before it
+            mark = buf.find(FRAME_MARK, pos)
+            if mark == -1:
+                end = max(buf.rfind(b"\n", pos), buf.rfind(b"\0", pos))
+                if end == -1:
+                    break
+                next_pos = end + 1
+            else:
+                end = next_pos = mark
+            with memoryview(buf) as view:
+                text = str(view[pos:end], "utf-8", "replace")
+            items += [line for line in text.replace("\0", "\n").replace("\r", "").split("\n") if line]
+            pos = next_pos
+        del buf[:pos]
+        return items
+
+class AsyncConnection:
+    def __init__(self, host, port, on_lines=None, on_disconnect=None):
+        self.host = host
+        self.port = port
+        self.on_lines = on_lines
+        self.on_disconnect = on_disconnect
+        self.reader = None
+        self.writer = None
+        self.connected = False
+        self._lines = asyncio.Queue()
+        self._pump_task = None
+
+    async def open(self, timeout=5):
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), timeout
+        )
+        self.connected = True
+        self._pump_task = asyncio.get_running_loop().create_task(self._pump())
+
+    async def _pump(self):
+        framer = LineFramer()
+        try:
+            while True:
+                data = await self.reader.read(4096)
+                if not data:
+                    break
+                lines = framer.feed(data)
+                if lines:
+                    self._deliver(lines)
+        except (OSError, asyncio.CancelledError):
+            pass
+        finally:
+            self.connected = False
+            self._lines.put_nowait(None)
+            if self.on_disconnect:
+                self.on_disconnect()
+
+    def _deliver(self, lines):
+        if self.on_lines:
+            self.on_lines(lines)
+        else:
+            for line in lines:
+                self._lines.put_nowait(line)
+
+    async def recv(self):
+        return await self._lines.get()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        line = await self.recv()
+        if line is None:
+            raise StopAsyncIteration
+        return line
+
+    def send_line(self, line: str):
+        if not self.connected or self.writer.is_closing():
+            return
+        if not line.endswith("\n"):
+            line += "\n"
+        self.writer.write(line.encode("utf-8"))
+
+    async def drain(self):
+        if self.connected:
+            await self.writer.drain()
+
+    def close(self):
+        self.connected = False
+        if self.writer:
+            self.writer.close()
+        if self._pump_task:
+            self._pump_task.cancel()
+
+    async def aclose(self):
+        self.close()
+        if self._pump_task:
+            try:
+                await self._pump_task
+            except asyncio.CancelledError:
+                pass
+
+# append-only capture: records of (kind, monotonic ns, length) + payload;
+# a received record holds one read's worth of framed items, each (is_frame, length) + data
+class SessionRecorder:
+    def __init__(self, path):
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(CAPTURE_MAGIC)
+        self.lock = threading.Lock()
+
+    def _write(self, kind, payload):
+        header = _REC_HEADER.pack(kind, time.monotonic_ns(), len(payload))
+        with self.lock:
+            if not self.file.closed:
+                self.file.write(header + payload)
+
+    def session(self, host, port):
+        self._write(REC_SESSION, f"{host}:{port}".encode("utf-8"))
+
+    def received(self, lines):
+        parts = []
+        for line in lines:
+            data = line if type(line) is bytes else line.encode("utf-8")
+            parts.append(_REC_ITEM.pack(type(line) is bytes, len(data)))
+            parts.append(data)
+        self._write(REC_RECEIVED, b"".join(parts))
+
+    def sent(self, line):
+        self._write(REC_SENT, line.encode("utf-8"))
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+def read_capture(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(CAPTURE_MAGIC):
+        raise ValueError(f"{path} is not a Totem capture")
+    pos = len(CAPTURE_MAGIC)
+    while pos + _REC_HEADER.size <= len(data):
+        kind, ns, length = _REC_HEADER.unpack_from(data, pos)
+        pos += _REC_HEADER.size
+        payload = data[pos:pos + length]
+        if len(payload) < length:
+            break
+        pos += length
+        if kind == REC_RECEIVED:
+            lines = []
+            item = 0
+            while item < length:
+                is_frame, size = _REC_ITEM.unpack_from(payload, item)
+                item += _REC_ITEM.size
+                chunk = payload[item:item + size]
+                lines.append(chunk if is_frame else chunk.decode("utf-8"))
+                item += size
+            yield kind, ns, lines
+        else:
+            yield kind, ns, payload.decode("utf-8")
+
+class RollingHistogram:
+    def __init__(self, window=LATENCY_WINDOW):
+        self.samples = deque(maxlen=window)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def summary(self):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        def ms(p):
+            return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 2)
+        buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        for sample in ordered:
+            buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, sample * 1000)] += 1
+        return {"count": len(ordered), "p50": ms(50), "p90": ms(90), "p99": ms(99),
+                "max": round(ordered[-1] * 1000, 2), "buckets": buckets}
+
+# Times draw/grab from send_line to the first reply line, to the Turn frame that reflects it
+# and to the canvas render of that frame. Replies come back in command order, so pending
+# actions are matched oldest first.
+class ActionTimer:
+    def __init__(self):
+        self.pending = deque(maxlen=100)
+        self.framed = []
+        self.histograms = {
+            (command, stage): RollingHistogram() for command in TIMED_COMMANDS for stage in ACTION_STAGES
+        }
+
+    def sent(self, line, at=None):
+        command, _, turn = line.strip().partition(" ")
+        if command in TIMED_COMMANDS and turn.isdigit():
+            self.pending.append({"command": command, "turn": int(turn),
+                                 "sent": at or time.perf_counter(), "response": None})
+
+    def _stage(self, action, stage, at):
+        self.histograms[(action["command"], stage)].add(at - action["sent"])
+
+    def response(self, command, at, final=False):
+        # command None matches either kind; a final reply (an error) means no frame will follow
+        for action in self.pending:
+            if action["response"] is None and command in (None, action["command"]):
+                action["response"] = at
+                self._stage(action, "response", at)
+                if final:
+                    self.pending.remove(action)
+                return
+
+    def frame(self, turn, at):
+        # a draw shows up as the next turn; a grab as the first frame after its reply
+        for action in list(self.pending):
+            if action["command"] == "draw":
+                if turn <= action["turn"]:
+                    continue
+                if action["response"] is None:
+                    action["response"] = at
+                    self._stage(action, "response", at)
+            elif action["response"] is None or turn < action["turn"]:
+                continue
+            self._stage(action, "frame", at)
+            self.pending.remove(action)
+            self.framed.append(action)
+
+    def rendered(self, at):
+        for action in self.framed:
+            self._stage(action, "render", at)
+        self.framed = []
+
+    def reset(self):
+        self.pending.clear()
+        self.framed = []
+
+    def summary(self):
+        return {f"{command} {stage}": histogram.summary()
+                for (command, stage), histogram in self.histograms.items()}
+
+    def export(self, path):
+        with open(path, "w") as f:
+            json.dump({"buckets_ms": list(LATENCY_BUCKETS_MS), "window": LATENCY_WINDOW,
+                       "latency_ms": self.summary()}, f, indent=2)
+
+class NetworkClient:
+    def __init__(self, host, port, on_receive, on_disconnect, recorder=None):
+        self.host = host
+        self.port = port
+        self.on_receive = on_receive
+        self.on_disconnect = on_disconnect
+        self.recorder = recorder
+        self.actions = ActionTimer()
+        self.loop = None
+        self.conn = None
+        self.loop_thread = None
+
+    @property
+    def connected(self):
+        return self.conn is not None and self.conn.connected
+
+    def connect(self):
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.loop_thread.start()
+        self.conn = AsyncConnection(
+            self.host,
+            self.port,
+            on_lines=self._on_lines,
+            on_disconnect=self.on_disconnect,
+        )
+        try:
+            asyncio.run_coroutine_threadsafe(self.conn.open(), self.loop).result()
+        except Exception:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.conn = None
+            raise
+        if self.recorder:
+            self.recorder.session(self.host, self.port)
+
+    def _on_lines(self, lines):
+        if self.recorder:
+            self.recorder.received(lines)
+        self.on_receive(lines, "server")
+
+    def send_line(self, line: str):
+        if self.connected:
+            if self.recorder:
+                self.recorder.sent(line)
+            self.actions.sent(line)
+            self.loop.call_soon_threadsafe(self.conn.send_line, line)
+
+    def close(self):
+        if not self.conn:
+            return
+        done = asyncio.run_coroutine_threadsafe(self.conn.aclose(), self.loop)
+        done.add_done_callback(lambda f: self.loop.call_soon_threadsafe(self.loop.stop))
+
+class GameState:
+    def __init__(self):
+        self.turn = None
+        self.players = []
+        self.spectators = 0
+        self.current_player_nick = None
+        self.version = None
+
+    def apply(self, version, turn, current, spectators, changes):
+        if self.version is None or version != self.version + 1:
+            return None
+        game = GameState()
+        game.version = version
+        game.turn = turn
+        game.spectators = spectators
+        game.players = list(self.players)
+        for index, hand, table, color, shape in changes:
+            if index >= len(game.players):
+                return None
+            player = dict(game.players[index])
+            player["hand"] = hand
+            player["table"] = table
+            player["color"] = None if color == 0xFF else color
+            player["shape"] = None if shape == 0xFF else shape
+            game.players[index] = player
+        if current < len(game.players):
+            game.current_player_nick = game.players[current]["nick"]
+        return game
+
+    @staticmethod
+    def parse(text: str):
+        for event in ProtocolDecoder().feed(text.splitlines()):
+            if type(event) is GameFrame:
+                return event.state
+        return None
+
+class LobbyState:
+    def __init__(self):
+        self.rooms = []
+
+    def apply_update(self, room):
+        for i, existing in enumerate(self.rooms):
+            if existing["id"] == room["id"]:
+                self.rooms[i] = room
+                return
+        self.rooms.append(room)
+
+    def apply_remove(self, room_id):
+        self.rooms = [room for room in self.rooms if room["id"] != room_id]
+
+    @staticmethod
+    def parse(text: str):
+        lobby = LobbyState()
+        for event in ProtocolDecoder().feed(text.splitlines()):
+            if type(event) is LobbyFrame:
+                lobby.rooms = list(event.rooms)
+            elif type(event) is RoomFrame:
+                lobby.rooms.append(event.room)
+        return lobby
+
+NickAccepted = namedtuple("NickAccepted", "")
+# complete is False for the rooms of a list reply read so far, True once the list has ended
+LobbyFrame = namedtuple("LobbyFrame", "rooms complete")
+RoomFrame = namedtuple("RoomFrame", "room")
+LobbySubscribed = namedtuple("LobbySubscribed", "")
+LobbyUpdate = namedtuple("LobbyUpdate", "room")
+LobbyRemove = namedtuple("LobbyRemove", "room_id")
+GameFrame = namedtuple("GameFrame", "state")
+GameHalted = namedtuple("GameHalted", "")
+FightWon = namedtuple("FightWon", "")
+FightLost = namedtuple("FightLost", "")
+GrabMistake = namedtuple("GrabMistake", "")
+GameWon = namedtuple("GameWon", "")
+GameLost = namedtuple("GameLost", "")
+Error = namedtuple("Error", "kind text")
+Info = namedtuple("Info", "text")
+ProtocolEnabled = namedtuple("ProtocolEnabled", "version")
+GameResync = namedtuple("GameResync", "version")
+
+ROOM_WAITING = "Waiting to start the match."
+ROOM_IN_PROGRESS = "Match in progress."
+LOBBY_END = "End of rooms."
+
+_EXACT_LINES = {
+    "Nickname set successfully.": NickAccepted(),
+    "Subscribed to lobby updates.": LobbySubscribed(),
+    "Protocol 3 enabled.": ProtocolEnabled(PROTO_DELTA),
+    "Protocol 2 enabled.": ProtocolEnabled(PROTO_BINARY),
+    "Protocol 1 enabled.": ProtocolEnabled(PROTO_TEXT),
+    "All players left- match halted.": GameHalted(),
+    "You win the fight.": FightWon(),
+    "You lost a fight- take cards from the winner.": FightLost(),
+    "You made a mistake. Take all the cards :)": GrabMistake(),
+    "You won the game!": GameWon(),
+    "You lost the game.": GameLost(),
+}
+for _kind, _text in [
+    ("nick_taken", "Nickname unavailable, choose another."),
+    ("nick_length", "Nickname must be between 3 and 16 characters"),
+    ("not_in_room", "Currently not in a room."),
+    ("not_in_room", "Not in a room."),
+    ("not_in_room", "Not in a, room."),
+    ("already_in_room", "Already in a room."),
+    ("invalid_argument", "Invalid argument."),
+    ("too_long", "Command too long."),
+    ("unrecognized", "Unrecognized command."),
+    ("not_your_turn", "Not your turn."),
+    ("spectator", "Spectators can't play."),
+    ("server_full", "Server is full, try again later."),
+    ("room_limit", "Room limit reached, try again later."),
+]:
+    _EXACT_LINES[_text] = Error(_kind, _text)
+
+# replies that end a draw/grab without a frame, and which command they can answer (None = either)
+_ACTION_ERRORS = {
+    "not_your_turn": "draw",
+    "wrong_turn": None,
+    "spectator": None,
+    "invalid_argument": None,
+}
+
+_TEXT_RE = re.compile(
+    r"Turn (?P<turn>\d+)$"
+    r"|Room (?P<room>-?\d+)- players:$"
+    r"|Lobby removed: (?P<lobby_removed>-?\d+)$"
+    r"|Current turn is\.(?P<wrong_turn>\d+)$"
+    r"|Room -?\d+ (?:(?P<room_exists>already exists)|(?P<room_missing>doesn't exist\.)"
+    r"|(?P<room_full>is full\.)|(?P<room_started>has already started playing))"
+    r"|(?P<permission>You don't have permission to start)"
+)
+_GAME_RE = re.compile(
+    r"Current player: (?P<current>.*)$"
+    r"|Player (?P<nick>.+) has (?P<hand>\d+) cards in hand and (?P<table>\d+) cards on the table\.$"
+    r"|Currently on top- color (?P<color>\d+), shape (?P<shape>\d+)$"
+    r"|(?P<spectators>\d+) spectators watching\.$"
+)
+_ROOM_SPECTATORS_RE = re.compile(r"(\d+) spectators$")
+
+class ProtocolDecoder:
+    TEXT, LOBBY, ROOM, GAME = range(4)
+
+    def __init__(self):
+        self.mode = ProtocolDecoder.TEXT
+        self.lobby = None
+        self.lobby_flushed = False
+        self.room = None
+        self.room_in_lobby = False
+        self.room_counted = False
+        self.room_is_update = False
+        self.next_room_is_update = False
+        self.game = None
+        self.player = None
+        self.roster = []
+        self.state = None
+        self.resync_pending = False
+
+    def feed(self, lines):
+        events = []
+        for line in lines:
+            self._line(line, events)
+        if self.mode == ProtocolDecoder.LOBBY and not self.lobby_flushed:
+            events.append(LobbyFrame(list(self.lobby), False))
+            self.lobby_flushed = True
+        return events
+
+    def _line(self, line, events):
+        mode = self.mode
+        if type(line) is bytes:
+            if mode == ProtocolDecoder.ROOM:
+                self._close_room(events)
+            if self.mode == ProtocolDecoder.LOBBY:
+                self._close_lobby(events)
+            self._frame(line, events)
+            return
+        if mode == ProtocolDecoder.GAME:
+            m = _GAME_RE.match(line)
+            if m:
+                self._game_line(m, events)
+                return
+        elif mode == ProtocolDecoder.ROOM:
+            if not self._room_line(line, events):
+                self._line(line, events)
+            return
+        elif mode == ProtocolDecoder.LOBBY:
+            if line == LOBBY_END:
+                self._close_lobby(events)
+                return
+            if not line.startswith("Room "):
+                self._close_lobby(events)
+        event = _EXACT_LINES.get(line)
+        if event is not None:
+            events.append(event)
+            return
+        if line == "Lobby update:":
+            self.next_room_is_update = True
+            return
+        if line == "Available rooms:":
+            if self.mode == ProtocolDecoder.LOBBY:
+                self._close_lobby(events)
+            self.mode = ProtocolDecoder.LOBBY
+            self.lobby = []
+            self.lobby_flushed = False
+            return
+        m = _TEXT_RE.match(line)
+        if m is None:
+            events.append(Info(line))
+            return
+        kind = m.lastgroup
+        if kind == "turn":
+            self.game = GameState()
+            self.game.turn = int(m.group("turn"))
+            self.player = None
+            self.mode = ProtocolDecoder.GAME
+        elif kind == "room":
+            self._open_room(int(m.group("room")), events)
+        elif kind == "lobby_removed":
+            events.append(LobbyRemove(int(m.group("lobby_removed"))))
+        else:
+            events.append(Error(kind, line))
+
+    # servers before "End of rooms." end the list with whatever line comes next
+    def _close_lobby(self, events):
+        events.append(LobbyFrame(list(self.lobby), True))
+        self.lobby = None
+        self.mode = ProtocolDecoder.TEXT
+
+    def _open_room(self, room_id, events):
+        in_lobby = self.mode == ProtocolDecoder.LOBBY
+        if in_lobby and self.lobby_flushed and any(r["id"] == room_id for r in self.lobby):
+            self._close_lobby(events)
+            in_lobby = False
+        self.room = {"id": room_id, "players": [], "spectators": 0, "state": ""}
+        self.room_in_lobby = in_lobby
+        self.room_counted = False
+        self.room_is_update = self.next_room_is_update
+        self.next_room_is_update = False
+        self.mode = ProtocolDecoder.ROOM
+
+    def _room_line(self, line, events):
+        room = self.room
+        if line == ROOM_WAITING or line == ROOM_IN_PROGRESS:
+            room["state"] = line
+            self._close_room(events)
+            return True
+        if not self.room_counted:
+            m = _ROOM_SPECTATORS_RE.match(line)
+            if m:
+                room["spectators"] = int(m.group(1))
+                self.room_counted = True
+            else:
+                room["players"].append(line)
+            return True
+        self._close_room(events)
+        return False
+
+    def _close_room(self, events):
+        if self.room_in_lobby:
+            self.lobby.append(self.room)
+            self.lobby_flushed = False
+            self.mode = ProtocolDecoder.LOBBY
+        else:
+            events.append(LobbyUpdate(self.room) if self.room_is_update else RoomFrame(self.room))
+            self.mode = ProtocolDecoder.TEXT
+        self.room = None
+
+    def _game_line(self, m, events):
+        kind = m.lastgroup
+        game = self.game
+        if kind == "table":
+            self.player = {
+                "nick": m.group("nick"),
+                "hand": int(m.group("hand")),
+                "table": int(m.group("table")),
+                "color": None,
+                "shape": None,
+            }
+            game.players.append(self.player)
+        elif kind == "shape":
+            if self.player is not None:
+                self.player["color"] = int(m.group("color"))
+                self.player["shape"] = int(m.group("shape"))
+        elif kind == "current":
+            game.current_player_nick = m.group("current").strip()
+        else:
+            game.spectators = int(m.group("spectators"))
+            events.append(GameFrame(game))
+            self.game = None
+            self.player = None
+            self.mode = ProtocolDecoder.TEXT
+
+    # frame = type byte, 2-byte length, payload (see encodeRoster/encodeState in server.cpp)
+    def _frame(self, frame, events):
+        kind = frame[0]
+        payload = memoryview(frame)[3:]
+        if kind == ord("R"):
+            roster = []
+            pos = 1
+            for _ in range(payload[0]):
+                length = payload[pos]
+                roster.append(str(payload[pos + 1:pos + 1 + length], "utf-8", "replace"))
+                pos += 1 + length
+            self.roster = roster
+            self.state = None
+            self.resync_pending = False
+        elif kind == ord("G"):
+            events.append(GameFrame(self._full_state(payload)))
+        elif kind == ord("S"):
+            game = self._full_state(payload[4:])
+            game.version = int.from_bytes(payload[0:4], "big")
+            self.state = game
+            self.resync_pending = False
+            events.append(GameFrame(game))
+        elif kind == ord("D"):
+            version = int.from_bytes(payload[0:4], "big")
+            changes = [tuple(payload[i:i + 5]) for i in range(12, 12 + 5 * payload[11], 5)]
+            game = None
+            if self.state is not None:
+                game = self.state.apply(version, int.from_bytes(payload[4:8], "big"), payload[8],
+                                        int.from_bytes(payload[9:11], "big"), changes)
+            if game is None:
+                # missed a delta: ask for a snapshot once and drop deltas until it arrives
+                self.state = None
+                if not self.resync_pending:
+                    self.resync_pending = True
+                    events.append(GameResync(version))
+            else:
+                self.state = game
+                events.append(GameFrame(game))
+        else:
+            events.append(Info(f"<binary frame {chr(kind)}, {len(frame)} bytes>"))
+
+    def _full_state(self, payload):
+        game = GameState()
+        game.turn = int.from_bytes(payload[0:4], "big")
+        current = payload[4]
+        count = payload[5]
+        game.spectators = int.from_bytes(payload[6:8], "big")
+        roster = self.roster
+        for i in range(count):
+            hand, table, color, shape = payload[8 + 4 * i:12 + 4 * i]
+            game.players.append({
+                "nick": roster[i] if i < len(roster) else f"#{i}",
+                "hand": hand,
+                "table": table,
+                "color": None if color == 0xFF else color,
+                "shape": None if shape == 0xFF else shape,
+            })
+        if current < count:
+            game.current_player_nick = game.players[current]["nick"]
+        return game
+
+class WakeupQueue(queue.Queue):
+    def __init__(self):
+        super().__init__()
+        self.wake = None
+
+    def put(self, item, block=True, timeout=None):
+        super().put(item, block, timeout)
+        if self.wake:
+            self.wake()
+
+# log lines that "Hide game frames" leaves out: game state and the refreshes that ask for it
+def is_frame_line(text, tag):
+    if tag == "client":
+        return text.endswith("] refresh")
+    if tag == "server":
+        return bool(text.startswith(("Turn ", "<binary frame")) or _GAME_RE.match(text))
+    return False
+
+class LogModel:
+    def __init__(self, max_lines=LOG_MAX_LINES, widget_filter=None):
+        self.max_lines = max_lines
+        self.widget_filter = widget_filter
+        self.lines = deque(maxlen=max_lines)
+        self.pending = deque(maxlen=max_lines)
+
+    def append(self, text, tag=None):
+        self.lines.append((text, tag))
+        self.pending.append((text, tag))
+
+    def take_pending(self):
+        pending = list(self.pending)
+        self.pending.clear()
+        if self.widget_filter is None:
+            return pending
+        return [(text, tag) for text, tag in pending if self.widget_filter(text, tag)]
+
+    def reload(self):
+        self.pending.clear()
+        self.pending.extend(self.lines)
+
+class KeyedTreeview:
+    def __init__(self, tree, columns):
+        self.tree = tree
+        self.columns = columns
+        self.rows = {}
+        self.order = []
+
+    # rows of a list still being read (complete=False) are added or refreshed, and the rows it
+    # has not reached yet stay after them; only a complete list removes rows
+    def update(self, rows, complete=True):
+        tree = self.tree
+        new_rows = {}
+        order = []
+        for key, values in rows:
+            iid = str(key)
+            if iid in new_rows:
+                continue
+            new_rows[iid] = tuple(values)
+            order.append(iid)
+        if not complete:
+            for iid in self.order:
+                if iid not in new_rows:
+                    new_rows[iid] = self.rows[iid]
+                    order.append(iid)
+        removed = [iid for iid in self.order if iid not in new_rows]
+        if removed:
+            tree.delete(*removed)
+        kept = [iid for iid in self.order if iid in new_rows]
+        moved = kept != [iid for iid in order if iid in self.rows]
+        for index, iid in enumerate(order):
+            values = new_rows[iid]
+            old = self.rows.get(iid)
+            if old is None:
+                tree.insert("", index, iid=iid, values=values)
+                continue
+            if moved:
+                tree.move(iid, "", index)
+            if old != values:
+                for column, value, old_value in zip(self.columns, values, old):
+                    if value != old_value:
+                        tree.set(iid, column, value)
+        self.rows = new_rows
+        self.order = order
+
+    def clear(self):
+        if self.order:
+            self.tree.delete(*self.order)
+        self.rows = {}
+        self.order = []
+
+class CardView:
+    def __init__(self, canvas, layout, label=None):
+        self.canvas = canvas
+        self.layout = layout
+        self.label = label
+        self.rect = canvas.create_rectangle(0, 0, 0, 0, outline="black", state="hidden")
+        self.text = canvas.create_text(*layout["text"], state="hidden")
+        self.nick = None
+        if layout["nick"]:
+            self.nick = canvas.create_text(*layout["nick"], font=("Arial", 8), state="hidden")
+        self.shown = None
+        self.label_text = ""
+
+    def show(self, color, shape, nick="", label_text=""):
+        key = (color, shape, nick)
+        if key != self.shown:
+            canvas = self.canvas
+            if color is None:
+                coords, width, font = self.layout["unknown"]
+                fill, text = "lightgray", "?"
+            else:
+                coords, width, font = self.layout["known"]
+                fill, text = CARD_COLORS.get(color, "white"), str(shape)
+            if self.shown is None or (self.shown[0] is None) != (color is None):
+                canvas.coords(self.rect, *coords)
+                canvas.itemconfigure(self.rect, width=width, state="normal")
+                canvas.itemconfigure(self.text, font=font, state="normal")
+            canvas.itemconfigure(self.rect, fill=fill)
+            canvas.itemconfigure(self.text, text=text)
+            if self.nick is not None and (self.shown is None or self.shown[2] != nick):
+                canvas.itemconfigure(self.nick, text=nick[:6], state="normal" if nick else "hidden")
+            self.shown = key
+        self._set_label(label_text)
+
+    def clear(self):
+        if self.shown is not None:
+            self.canvas.itemconfigure(self.rect, state="hidden")
+            self.canvas.itemconfigure(self.text, state="hidden")
+            if self.nick is not None:
+                self.canvas.itemconfigure(self.nick, state="hidden")
+            self.shown = None
+        self._set_label("")
+
+    def _set_label(self, text):
+        if self.label is not None and text != self.label_text:
+            self.label.config(text=text)
+            self.label_text = text
+
+class TotemClientGUI:
+    def __init__(self, root, host, port, log_lines=LOG_MAX_LINES, protocol=PROTO_TEXT, recorder=None):
+        load_tk()
+        self.root = root
+        self.host = host
+        self.port = port
+        self.net = None
+        self.recorder = recorder
+        self.log_model = LogModel(log_lines, self._log_filter)
+        self.msg_queue = WakeupQueue()
+        self.nickname = None
+        self.nickname_set = False
+        self.in_room = False
+        self.current_room_id = None
+        self.leaving_room = False
+        self.is_spectator = False
+        self.spectator_refresh_timer = None
+        self.lobby_refresh_timer = None
+        self.stats_timer = None
+        self.lobby_subscribed = False
+        self.game_started = False
+        self.decoder = ProtocolDecoder()
+        self.pending_game = None
+        self.pending_game_received = None
+        self.pending_lobby = None
+        self.pending_lobby_complete = True
+        self.frame_latencies = deque(maxlen=100)
+        self.protocol = protocol
+        self.current_lobby = LobbyState()
+        self.current_game = GameState()
+        self._event_handlers = {
+            NickAccepted: self._on_nick_accepted,
+            LobbyFrame: self._on_lobby_frame,
+            LobbySubscribed: self._on_lobby_subscribed,
+            ProtocolEnabled: self._on_protocol_enabled,
+            GameResync: self._on_game_resync,
+            LobbyUpdate: self._on_lobby_update,
+            LobbyRemove: self._on_lobby_remove,
+            RoomFrame: self._on_room_frame,
+            GameFrame: self._on_game_frame,
+            GameWon: self._on_game_won,
+            GameLost: self._on_game_lost,
+            Error: self._on_error,
+        }
+        self._build_ui()
+        self._wake_pending = False
+        self._draining = False
+        self._drain_scheduled = False
+        self._wake_fds = None
+        self._setup_wakeup()
+        if self._wake_fds is None:
+            self._schedule_poll()
+
+    def _build_ui(self):
+        self.root.title("Totem Client")
+        self.tabs = ttk.Notebook(self.root)
+        self.tabs.pack(fill=tk.BOTH, expand=True)
+        self.tab_connect = ttk.Frame(self.tabs)
+        self.tab_lobby = ttk.Frame(self.tabs)
+        self.tab_game = ttk.Frame(self.tabs)
+        self.tab_log = ttk.Frame(self.tabs)
+        self.tab_stats = ttk.Frame(self.tabs)
+        self.tabs.add(self.tab_connect, text="Connection")
+        self.tabs.add(self.tab_lobby, text="Lobby")
+        self.tabs.add(self.tab_game, text="Game")
+        self.tabs.add(self.tab_log, text="Log")
+        self.tabs.add(self.tab_stats, text="Stats")
+        self.tabs.tab(1, state="disabled")
+        self.tabs.tab(2, state="disabled")
+        self._build_connect_tab()
+        self._build_lobby_tab()
+        self._build_game_tab()
+        self._build_log_tab()
+        self._build_stats_tab()
+        self.tabs.bind("<<NotebookTabChanged>>", self._on_tab_changed)
+
+    def _build_connect_tab(self):
+        f = self.tab_connect
+        ttk.Label(f, text=f"Connecting to {self.host}:{self.port}").pack(pady=10)
+        connect_frame = ttk.Frame(f)
+        connect_frame.pack(pady=10)
+        ttk.Button(connect_frame, text="Connect to Server", command=self.on_connect).pack(pady=5)
+        self.connection_status = ttk.Label(f, text="Not connected", foreground="red")
+        self.connection_status.pack(pady=5)
+        nick_frame = ttk.Frame(f)
+        nick_frame.pack(pady=10)
+        ttk.Label(nick_frame, text="Nickname:").pack(side=tk.LEFT)
+        self.nick_entry = ttk.Entry(nick_frame, width=20, state="disabled")
+        self.nick_entry.pack(side=tk.LEFT, padx=5)
+        self.nick_entry.insert(0, "Player")
+        self.set_nick_button = ttk.Button(nick_frame, text="Set Nickname", command=self.on_set_nick, state="disabled")
+        self.set_nick_button.pack(side=tk.LEFT, padx=5)
+
+    def _build_lobby_tab(self):
+        f = self.tab_lobby
+        top = ttk.Frame(f)
+        top.pack(fill=tk.X, pady=5)
+        ttk.Button(top, text="Refresh List", command=self.send_list).pack(side=tk.LEFT, padx=5)
+        ttk.Label(top, text="Room ID:").pack(side=tk.LEFT)
+        self.room_entry = ttk.Entry(top, width=8)
+        self.room_entry.pack(side=tk.LEFT, padx=5)
+        ttk.Button(top, text="Create", command=self.send_create).pack(side=tk.LEFT, padx=5)
+        ttk.Button(top, text="Leave", command=self.send_leave).pack(side=tk.LEFT, padx=5)
+        self.start_lobby_button = ttk.Button(top, text="Start Game", command=self.send_start, state=tk.DISABLED)
+        self.start_lobby_button.pack(side=tk.LEFT, padx=5)
+        columns = ("id", "players", "spectators", "state")
+        self.lobby_tree = ttk.Treeview(f, columns=columns, show="headings", height=15)
+        self.lobby_tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        for col in columns:
+            self.lobby_tree.heading(col, text=col.capitalize())
+        self.lobby_tree.column("id", width=80)
+        self.lobby_tree.column("players", width=200)
+        self.lobby_tree.column("spectators", width=80)
+        self.lobby_tree.column("state", width=200)
+        self.lobby_rows = KeyedTreeview(self.lobby_tree, columns)
+        bottom = ttk.Frame(f)
+        bottom.pack(fill=tk.X, pady=5)
+        ttk.Button(bottom, text="Join", command=self.on_join).pack(side=tk.LEFT, padx=5)
+        ttk.Button(bottom, text="Spectate", command=self.on_spectate).pack(side=tk.LEFT, padx=5)
+
+    def _build_game_tab(self):
+        f = self.tab_game
+        columns = ("nick", "hand", "table", "card")
+        self.game_tree = ttk.Treeview(f, columns=columns, show="headings", height=10)
+        self.game_tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        for col in columns:
+            self.game_tree.heading(col, text=col.capitalize())
+        self.game_tree.column("nick", width=120)
+        self.game_tree.column("hand", width=80)
+        self.game_tree.column("table", width=80)
+        self.game_tree.column("card", width=100)
+        self.game_rows = KeyedTreeview(self.game_tree, columns)
+        self.normal_player_frame = ttk.Frame(f)
+        status_frame = ttk.Frame(self.normal_player_frame)
+        status_frame.pack(fill=tk.X, pady=5)
+        self.status_label = ttk.Label(status_frame, text="Turn: -, Spectators: -")
+        self.status_label.pack(side=tk.LEFT, padx=10)
+        ttk.Label(status_frame, text="Turn #:").pack(side=tk.LEFT)
+        self.turn_entry = ttk.Entry(status_frame, width=6)
+        self.turn_entry.pack(side=tk.LEFT, padx=5)
+        ttk.Button(status_frame, text="Refresh", command=self.send_refresh).pack(side=tk.LEFT, padx=5)
+        cards_frame = ttk.Frame(self.normal_player_frame)
+        cards_frame.pack(fill=tk.X, pady=10)
+        left_frame = ttk.Frame(cards_frame)
+        left_frame.pack(side=tk.LEFT, padx=10)
+        self.left_cards = []
+        self.left_nicks = []
+        for r in range(2):
+            for c in range(2):
+                card_frame = ttk.Frame(left_frame)
+                card_frame.grid(row=r, column=c, padx=3, pady=3)
+                canvas = tk.Canvas(card_frame, width=60, height=80, bg="white")
+                canvas.pack()
+                label = ttk.Label(card_frame, text="", font=("Arial", 8))
+                label.pack()
+                self.left_cards.append(canvas)
+                self.left_nicks.append(label)
+        self.card_canvas = tk.Canvas(cards_frame, width=120, height=160, bg="white")
+        self.card_canvas.pack(side=tk.LEFT, padx=20)
+        self.big_card = CardView(self.card_canvas, BIG_CARD)
+        right_frame = ttk.Frame(cards_frame)
+        right_frame.pack(side=tk.LEFT, padx=10)
+        self.right_cards = []
+        self.right_nicks = []
+        for r in range(2):
+            for c in range(2):
+                card_frame = ttk.Frame(right_frame)
+                card_frame.grid(row=r, column=c, padx=3, pady=3)
+                canvas = tk.Canvas(card_frame, width=60, height=80, bg="white")
+                canvas.pack()
+                label = ttk.Label(card_frame, text="", font=("Arial", 8))
+                label.pack()
+                self.right_cards.append(canvas)
+                self.right_nicks.append(label)
+        self.spectator_frame = ttk.Frame(f)
+        ttk.Label(self.spectator_frame, text="Spectator View - Top Cards:").pack(pady=5)
+        cards_container = ttk.Frame(self.spectator_frame)
+        cards_container.pack()
+        self.spectator_cards = []
+        self.spectator_labels = []
+        for r in range(2):
+            for c in range(4):
+                card_frame = ttk.Frame(cards_container)
+                card_frame.grid(row=r, column=c, padx=5, pady=5)
+                canvas = tk.Canvas(card_frame, width=50, height=70, bg="white")
+                canvas.pack()
+                label = ttk.Label(card_frame, text="", font=("Arial", 8))
+                label.pack()
+                self.spectator_cards.append(canvas)
+                self.spectator_labels.append(label)
+        self.side_card_views = [CardView(c, SMALL_CARD) for c in self.left_cards + self.right_cards[:3]]
+        self.spectator_card_views = [
+            CardView(c, SPECTATOR_CARD, label) for c, label in zip(self.spectator_cards, self.spectator_labels)
+        ]
+        self.bottom_frame = ttk.Frame(f)
+        self.bottom_frame.pack(fill=tk.X, pady=10)
+        self.draw_button = ttk.Button(self.bottom_frame, text="Draw", command=self.send_draw)
+        self.draw_button.pack(side=tk.LEFT, padx=5)
+        self.grab_button = ttk.Button(self.bottom_frame, text="Grab", command=self.send_grab)
+        self.grab_button.pack(side=tk.LEFT, padx=5)
+        self.leave_game_button = ttk.Button(self.bottom_frame, text="Leave", command=self.send_leave)
+        self.leave_game_button.pack(side=tk.LEFT, padx=5)
+        self._update_spectator_view()
+
+    def _build_log_tab(self):
+        f = self.tab_log
+        log_frame = ttk.Frame(f)
+        log_frame.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        self.log_text = tk.Text(log_frame, height=25, wrap=tk.WORD, state=tk.DISABLED)
+        self.log_text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.log_text.tag_config("client", foreground="#00aa00")
+        self.log_text.tag_config("server", foreground="#0066ff")
+        self.log_text.tag_config("error", foreground="#cc0000")
+        self.log_text.tag_config("system", foreground="#888888")
+        scrollbar = ttk.Scrollbar(log_frame, command=self.log_text.yview)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.log_text["yscrollcommand"] = scrollbar.set
+        cmd_frame = ttk.Frame(f)
+        cmd_frame.pack(side=tk.BOTTOM, fill=tk.X, pady=5)
+        self.hide_frames = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            cmd_frame, text="Hide game frames", variable=self.hide_frames, command=self._reload_log
+        ).pack(side=tk.RIGHT, padx=5)
+        ttk.Label(cmd_frame, text="Command:").pack(side=tk.LEFT, padx=5)
+        self.cmd_entry = ttk.Entry(cmd_frame)
+        self.cmd_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        self.cmd_entry.bind("<Return>", lambda e: self.send_manual_cmd())
+        self.send_cmd_button = ttk.Button(cmd_frame, text="Send", command=self.send_manual_cmd)
+        self.send_cmd_button.pack(side=tk.LEFT, padx=5)
+
+    def _build_stats_tab(self):
+        f = self.tab_stats
+        columns = ("action", "count", "p50", "p90", "p99", "max", "histogram")
+        self.stats_tree = ttk.Treeview(f, columns=columns, show="headings", height=8)
+        self.stats_tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        for col in columns:
+            self.stats_tree.heading(col, text=col if col.startswith("p") else col.capitalize())
+        self.stats_tree.column("action", width=140)
+        for col in ("count", "p50", "p90", "p99", "max"):
+            self.stats_tree.column(col, width=70, anchor=tk.E)
+        self.stats_tree.column("histogram", width=200)
+        self.stats_rows = KeyedTreeview(self.stats_tree, columns)
+        bottom = ttk.Frame(f)
+        bottom.pack(fill=tk.X, pady=5)
+        edges = ", ".join(str(edge) for edge in LATENCY_BUCKETS_MS)
+        ttk.Label(bottom, text=f"Times in ms since send, last {LATENCY_WINDOW} actions; buckets <= {edges}, more").pack(
+            side=tk.LEFT, padx=5)
+        ttk.Button(bottom, text="Export...", command=self.export_stats).pack(side=tk.RIGHT, padx=5)
+
+    # the stats table only ticks while its tab is shown
+    def _on_tab_changed(self, event):
+        if self.tabs.select() == str(self.tab_stats):
+            if not self.stats_timer:
+                self._refresh_stats()
+        elif self.stats_timer:
+            self.root.after_cancel(self.stats_timer)
+            self.stats_timer = None
+
+    def _refresh_stats(self):
+        self.stats_timer = self.root.after(STATS_REFRESH_MS, self._refresh_stats)
+        if self.net is None:
+            return
+        rows = []
+        for name, summary in self.net.actions.summary().items():
+            if summary is None:
+                rows.append((name, (name, 0, "-", "-", "-", "-", "")))
+                continue
+            top = max(summary["buckets"])
+            bars = "".join(" ▁▂▃▄▅▆▇█"[0 if not n else 1 + 7 * n // top] for n in summary["buckets"])
+            rows.append((name, (name, summary["count"], summary["p50"], summary["p90"],
+                                summary["p99"], summary["max"], bars)))
+        self.stats_rows.update(rows)
+
+    def export_stats(self):
+        if self.net is None:
+            messagebox.showerror("Error", "No latency data yet")
+            return
+        path = filedialog.asksaveasfilename(defaultextension=".json", initialfile="totem_latency.json")
+        if path:
+            self.net.actions.export(path)
+            self.log(f"[SYSTEM] Latency histograms written to {path}", "system")
+
+    def _clear_game_ui(self):
+        self.game_rows.clear()
+        self.status_label.configure(text="Turn: -, Spectators: -")
+        self.turn_entry.delete(0, tk.END)
+        self.big_card.clear()
+        for view in self.side_card_views + self.spectator_card_views:
+            view.clear()
+
+    def _update_spectator_view(self):
+        if self.is_spectator:
+            self.normal_player_frame.pack_forget()
+            self.spectator_frame.pack(fill=tk.X, pady=10)
+            self.draw_button.pack_forget()
+            self.grab_button.pack_forget()
+            self.leave_game_button.pack(side=tk.LEFT, padx=5)
+        else:
+            self.normal_player_frame.pack(fill=tk.X, pady=5)
+            self.spectator_frame.pack_forget()
+            self.draw_button.pack(side=tk.LEFT, padx=5)
+            self.grab_button.pack(side=tk.LEFT, padx=5)
+            self.leave_game_button.pack(side=tk.LEFT, padx=5)
+
+    def _start_spectator_refresh(self):
+        if self.spectator_refresh_timer:
+            self.root.after_cancel(self.spectator_refresh_timer)
+        if self.is_spectator and self.in_room and self.net and self.net.connected:
+            self.net.send_line("refresh")
+            self.msg_queue.put((f"[CLIENT -> SERVER] refresh", "client"))
+            self.spectator_refresh_timer = self.root.after(1000, self._start_spectator_refresh)
+
+    def _stop_spectator_refresh(self):
+        if self.spectator_refresh_timer:
+            self.root.after_cancel(self.spectator_refresh_timer)
+            self.spectator_refresh_timer = None
+
+    def _start_lobby_refresh(self):
+        if self.lobby_refresh_timer:
+            self.root.after_cancel(self.lobby_refresh_timer)
+        if self.game_started or self.lobby_subscribed:
+            self._stop_lobby_refresh()
+            return
+        if not self.is_spectator and self.in_room and self.net and self.net.connected:
+            self.net.send_line("list")
+            self.msg_queue.put((f"[CLIENT -> SERVER] list", "client"))
+            self.lobby_refresh_timer = self.root.after(5000, self._start_lobby_refresh)
+
+    def _stop_lobby_refresh(self):
+        if self.lobby_refresh_timer:
+            self.root.after_cancel(self.lobby_refresh_timer)
+            self.lobby_refresh_timer = None
+
+    def log(self, text, tag=None):
+        self.log_model.append(text, tag)
+        if self.msg_queue.wake and not self._draining:
+            self.msg_queue.wake()
+
+    def _log_filter(self, text, tag):
+        return not (self.hide_frames.get() and is_frame_line(text, tag))
+
+    def _flush_log(self):
+        pending = self.log_model.take_pending()
+        if not pending:
+            return
+        chunks = []
+        for text, tag in pending:
+            chunks.append(text + "\n")
+            chunks.append(tag or "")
+        self.log_text.configure(state=tk.NORMAL)
+        self.log_text.insert(tk.END, *chunks)
+        line_count = int(self.log_text.index("end-1c").split(".")[0]) - 1
+        if line_count > self.log_model.max_lines:
+            self.log_text.delete("1.0", f"{line_count - self.log_model.max_lines + 1}.0")
+        self.log_text.see(tk.END)
+        self.log_text.configure(state=tk.DISABLED)
+
+    def _reload_log(self):
+        self.log_text.configure(state=tk.NORMAL)
+        self.log_text.delete("1.0", tk.END)
+        self.log_text.configure(state=tk.DISABLED)
+        self.log_model.reload()
+        self._flush_log()
+
+    def on_connect(self):
+        self.log(f"[SYSTEM] Connecting to {self.host}:{self.port}...", "system")
+        self.net = NetworkClient(
+            self.host,
+            self.port,
+            on_receive=lambda data, tag=None: self.msg_queue.put((data, tag, time.perf_counter())),
+            on_disconnect=self.on_disconnect,
+            recorder=self.recorder,
+        )
+        try:
+            self.net.connect()
+        except Exception as e:
+            messagebox.showerror("Connection Error", f"Cannot connect to server:\n{e}")
+            return
+        self.log("[SYSTEM] Connected to server", "system")
+        self.connection_status.configure(text="Connected", foreground="green")
+        self.nick_entry.configure(state="normal")
+        self.set_nick_button.configure(state="normal")
+        self.log("[SYSTEM] Choose and set your nickname", "system")
+
+    def on_set_nick(self):
+        if not self.net or not self.net.connected:
+            messagebox.showerror("Error", "First connect to the server")
+            return
+        nick = self.nick_entry.get().strip()
+        if len(nick) < 3:
+            messagebox.showerror("Error", "Nickname must be at least 3 characters long.")
+            return
+        if len(nick) > 16:
+            messagebox.showerror("Error", "Nickname cannot be longer than 16 characters.")
+            return
+        self.log(f"[SYSTEM] Trying to set nickname: {nick}", "system")
+        self.net.send_line(nick)
+        self.msg_queue.put((f"[CLIENT -> SERVER] {nick}", "client"))
+
+    def on_disconnect(self):
+        self.log("[SYSTEM] Disconnected from server.", "system")
+        self._stop_spectator_refresh()
+        self._stop_lobby_refresh()
+        self.connection_status.configure(text="Not connected", foreground="red")
+        self.nick_entry.configure(state="disabled")
+        self.set_nick_button.configure(state="disabled")
+        self.tabs.tab(1, state="disabled")
+        self.tabs.tab(2, state="disabled")
+        self.tabs.tab(0, state="normal")
+        self.tabs.select(0)
+        self.is_spectator = False
+        self.in_room = False
+        self.game_started = False
+        self.lobby_subscribed = False
+
+    def send_manual_cmd(self):
+        cmd = self.cmd_entry.get().strip()
+        if cmd and self.net:
+            self.net.send_line(cmd)
+            self.msg_queue.put((f"[CLIENT -> SERVER] {cmd}", "client"))
+            self.cmd_entry.delete(0, tk.END)
+
+    def send_list(self):
+        if self.net and not self.game_started:
+            self.net.send_line("list")
+            self.msg_queue.put((f"[CLIENT -> SERVER] list", "client"))
+
+    def send_create(self):
+        rid = self.room_entry.get().strip()
+        if rid.isdigit() and self.net:
+            self.net.send_line(f"create {rid}")
+            self.msg_queue.put((f"[CLIENT -> SERVER] create {rid}", "client"))
+            if not self.lobby_subscribed:
+                self.root.after(1000, self.send_list)
+
+    def send_leave(self):
+        if self.net:
+            self._stop_spectator_refresh()
+            self._stop_lobby_refresh()
+            self.game_started = False
+            self.leaving_room = True
+            self.net.actions.reset()
+            self.net.send_line("leave")
+            self.msg_queue.put((f"[CLIENT -> SERVER] leave", "client"))
+            self.current_room_id = None
+            self.in_room = False
+            self.is_spectator = False
+            self._clear_game_state()
+            self.tabs.tab(2, state="disabled")
+            self.tabs.tab(1, state="normal")
+            self.tabs.select(self.tab_lobby)
+            self.root.after(2000, lambda: setattr(self, 'leaving_room', False))
+            if not self.lobby_subscribed:
+                self.root.after(500, self.send_list)
+
+    def _clear_game_state(self):
+        self.pending_game = None
+        self._clear_game_ui()
+        self.current_game = GameState()
+
+    def send_start(self):
+        if self.net and not self.is_spectator:
+            self.net.send_line("start")
+            self.msg_queue.put((f"[CLIENT -> SERVER] start", "client"))
+            self._stop_lobby_refresh()
+            self.game_started = True
+
+    def send_refresh(self):
+        if self.net:
+            self.net.send_line("refresh")
+            self.msg_queue.put((f"[CLIENT -> SERVER] refresh", "client"))
+
+    def send_draw(self):
+        if self.net and not self.is_spectator:
+            t = self.turn_entry.get().strip()
+            if t.isdigit():
+                self.net.send_line(f"draw {t}")
+                self.msg_queue.put((f"[CLIENT -> SERVER] draw {t}", "client"))
+
+    def send_grab(self):
+        if self.net and not self.is_spectator:
+            t = self.turn_entry.get().strip()
+            if t.isdigit():
+                self.net.send_line(f"grab {t}")
+                self.msg_queue.put((f"[CLIENT -> SERVER] grab {t}", "client"))
+
+    def on_join(self):
+        sel = self.lobby_tree.selection()
+        if not sel:
+            messagebox.showwarning("No selection", "Select a room from the list")
+            return
+        rid = self.lobby_tree.item(sel[0], "values")[0]
+        if self.net:
+            self._stop_spectator_refresh()
+            self._stop_lobby_refresh()
+            self.game_started = False
+            self._clear_game_state()
+            self.net.send_line(f"join {rid}")
+            self.msg_queue.put((f"[CLIENT -> SERVER] join {rid}", "client"))
+            self.is_spectator = False
+            self.in_room = False
+            self._update_spectator_view()
+            if not self.lobby_subscribed:
+                self.root.after(1000, self.send_list)
+                self.root.after(6000, self._start_lobby_refresh)
+
+    def on_spectate(self):
+        sel = self.lobby_tree.selection()
+        if not sel:
+            messagebox.showwarning("No selection", "Select a room from the list")
+            return
+        rid = self.lobby_tree.item(sel[0], "values")[0]
+        if self.net:
+            self._stop_spectator_refresh()
+            self._stop_lobby_refresh()
+            self.game_started = False
+            self._clear_game_state()
+            self.net.send_line(f"spectate {rid}")
+            self.msg_queue.put((f"[CLIENT -> SERVER] spectate {rid}", "client"))
+            self.is_spectator = True
+            self.current_room_id = rid
+            self.in_room = True
+            self._update_spectator_view()
+            self.root.after(500, self._start_spectator_refresh)
+
+    def _return_to_lobby_after_game(self):
+        if self.net:
+            self.net.send_line("leave")
+            self.msg_queue.put((f"[CLIENT -> SERVER] leave", "client"))
+        self._stop_spectator_refresh()
+        self._stop_lobby_refresh()
+        self.game_started = False
+        self.tabs.tab(2, state="disabled")
+        self.tabs.tab(1, state="normal")
+        self.tabs.select(self.tab_lobby)
+        self.current_room_id = None
+        self.in_room = False
+        self.is_spectator = False
+        self._clear_game_state()
+        if not self.lobby_subscribed:
+            self.root.after(500, self.send_list)
+
+    def _setup_wakeup(self):
+        try:
+            read_fd, write_fd = os.pipe()
+        except OSError:
+            return
+        os.set_blocking(read_fd, False)
+        os.set_blocking(write_fd, False)
+        try:
+            self.root.tk.createfilehandler(read_fd, tk.READABLE, self._on_wakeup)
+        except (AttributeError, tk.TclError):
+            os.close(read_fd)
+            os.close(write_fd)
+            return
+        self._wake_fds = (read_fd, write_fd)
+        self.msg_queue.wake = self._wake
+
+    def _wake(self):
+        if self._wake_pending:
+            return
+        self._wake_pending = True
+        try:
+            os.write(self._wake_fds[1], b"\0")
+        except (BlockingIOError, OSError):
+            pass
+
+    def _on_wakeup(self, fd, mask):
+        self._wake_pending = False
+        try:
+            while os.read(fd, 4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+        self._drain()
+
+    def _drain(self):
+        self._drain_scheduled = False
+        deadline = time.perf_counter() + DRAIN_BUDGET_MS / 1000
+        self._draining = True
+        try:
+            while True:
+                item = self.msg_queue.get_nowait()
+                self._handle_data(*item)
+                if time.perf_counter() >= deadline:
+                    break
+        except queue.Empty:
+            pass
+        finally:
+            self._draining = False
+        self._flush_log()
+        if not self.msg_queue.empty() and not self._drain_scheduled:
+            self._drain_scheduled = True
+            self.root.after(1, self._drain)
+
+    def _schedule_poll(self):
+        self.root.after(FRAME_INTERVAL_MS if self.in_room else IDLE_POLL_MS, self._poll)
+
+    def _poll(self):
+        self._drain()
+        self._schedule_poll()
+
+    def _handle_data(self, data, tag=None, received=None):
+        if tag not in (None, "server"):
+            self.log(data, tag)
+            return
+        if isinstance(data, str):
+            data = [data]
+        for line in data:
+            if type(line) is bytes:
+                line = f"<binary frame {chr(line[0])}, {len(line)} bytes>"
+            self.log(line, "server")
+        actions = self.net.actions if self.net else None
+        for event in self.decoder.feed(data):
+            if actions is not None:
+                self._time_action(actions, event, received or time.perf_counter())
+            handler = self._event_handlers.get(type(event))
+            if handler:
+                handler(event)
+        if self.pending_lobby is not None:
+            self._process_lobby_frame()
+        if self.pending_game is not None:
+            self.pending_game_received = received
+            self._process_game_frame()
+
+    def _time_action(self, actions, event, at):
+        kind = type(event)
+        if kind is GameFrame:
+            if event.state is not None and event.state.turn is not None:
+                actions.frame(event.state.turn, at)
+        elif kind is FightWon or kind is GrabMistake:
+            actions.response("grab", at)
+        elif kind is Error and event.kind in _ACTION_ERRORS:
+            actions.response(_ACTION_ERRORS[event.kind], at, final=True)
+        elif kind is GameWon or kind is GameLost:
+            actions.reset()
+
+    def _on_nick_accepted(self, event):
+        if self.nickname_set:
+            return
+        self.nickname_set = True
+        self.nickname = self.nick_entry.get().strip()
+        self.tabs.tab(0, state="disabled")
+        self.tabs.tab(1, state="normal")
+        self.tabs.select(self.tab_lobby)
+        self.log("[SYSTEM] Nickname set successfully, switching to lobby", "system")
+        if self.protocol != PROTO_TEXT:
+            self.net.send_line(f"protocol {self.protocol}")
+            self.msg_queue.put((f"[CLIENT -> SERVER] protocol {self.protocol}", "client"))
+        self.net.send_line("subscribe lobby")
+        self.msg_queue.put((f"[CLIENT -> SERVER] subscribe lobby", "client"))
+        self.root.after(1000, self.send_list)
+
+    def _on_protocol_enabled(self, event):
+        self.log(f"[SYSTEM] Using protocol {event.version}", "system")
+
+    def _on_lobby_subscribed(self, event):
+        self.lobby_subscribed = True
+        self._stop_lobby_refresh()
+        self.log("[SYSTEM] Subscribed to lobby updates", "system")
+
+    def _on_error(self, event):
+        if event.kind == "nick_taken":
+            if not self.nickname_set:
+                messagebox.showerror("Nickname taken", "This nickname is already taken. Choose another.")
+                self.log("[SYSTEM] Nickname taken, choose another", "system")
+            return
+        if event.kind == "nick_length":
+            if not self.nickname_set:
+                messagebox.showerror("Invalid nickname", "Nickname must be between 3 and 16 characters.")
+                self.log("[SYSTEM] Invalid nickname", "system")
+            return
+        if event.kind == "not_in_room":
+            if self.leaving_room:
+                self.leaving_room = False
+                return
+            self._stop_spectator_refresh()
+            self._stop_lobby_refresh()
+            self.game_started = False
+            self.current_room_id = None
+            self.in_room = False
+            self.is_spectator = False
+            self._clear_game_state()
+            self.tabs.tab(2, state="disabled")
+            self.tabs.tab(1, state="normal")
+            self.tabs.select(self.tab_lobby)
+            if not self.lobby_subscribed:
+                self.root.after(500, self.send_list)
+            return
+        self.log(f"[ERROR] {event.text}", "error")
+
+    def _on_game_resync(self, event):
+        self.log(f"[SYSTEM] Missed game update {event.version}, requesting full state", "system")
+        self.send_refresh()
+
+    def _on_game_frame(self, event):
+        if self.leaving_room or not self.in_room:
+            return
+        if not self.is_spectator and not self.game_started:
+            self.log("[SYSTEM] Game started, switching to game tab", "system")
+            self._stop_lobby_refresh()
+            self.game_started = True
+        self.pending_game = event.state
+
+    def _on_lobby_frame(self, event):
+        if self.game_started:
+            return
+        self.pending_lobby = event.rooms
+        self.pending_lobby_complete = event.complete
+
+    def _on_lobby_update(self, event):
+        self.current_lobby.apply_update(event.room)
+        if not self.game_started:
+            self.pending_lobby = list(self.current_lobby.rooms)
+            self.pending_lobby_complete = True
+
+    def _on_lobby_remove(self, event):
+        self.current_lobby.apply_remove(event.room_id)
+        if not self.game_started:
+            self.pending_lobby = list(self.current_lobby.rooms)
+            self.pending_lobby_complete = True
+
+    def _on_room_frame(self, event):
+        if self.in_room and self.pending_game is None:
+            self._process_single_room(event.room)
+
+    def _on_game_won(self, event):
+        if not self.is_spectator:
+            messagebox.showinfo("You won!", "Congratulations! You won the game!")
+        self._return_to_lobby_after_game()
+
+    def _on_game_lost(self, event):
+        if not self.is_spectator:
+            messagebox.showinfo("You lost", "Unfortunately, you lost the game.")
+        self._return_to_lobby_after_game()
+
+    def _process_lobby_frame(self):
+        rooms = self.pending_lobby
+        if rooms is None:
+            return
+        self.pending_lobby = None
+        try:
+            self.lobby_rows.update((
+                (room["id"], (
+                    room["id"],
+                    ", ".join(room["players"]) if room["players"] else "(empty)",
+                    room["spectators"],
+                    room["state"],
+                ))
+                for room in rooms
+            ), self.pending_lobby_complete)
+            # which room we are in is only known once the whole list is in
+            if not self.pending_lobby_complete:
+                return
+            lobby = LobbyState()
+            lobby.rooms = rooms
+            self.current_lobby = lobby
+            # spectators are not listed in a room, so a lobby that does not name us
+            # leaves the room a spectator joined alone
+            for room in lobby.rooms:
+                if self.nickname in room["players"]:
+                    self.current_room_id = room["id"]
+                    self.in_room = True
+                    self.is_spectator = False
+                    break
+            else:
+                if not self.is_spectator:
+                    self.current_room_id = None
+            self.start_lobby_button.configure(state=tk.DISABLED)
+            if self.current_room_id and not self.is_spectator:
+                for room in lobby.rooms:
+                    if room["id"] == self.current_room_id:
+                        if room["players"] and room["players"][0] == self.nickname:
+                            if room["state"] == ROOM_WAITING:
+                                self.start_lobby_button.configure(state=tk.NORMAL)
+                        break
+            if not self.game_started and not self.is_spectator and self.in_room and not self.lobby_refresh_timer:
+                self.root.after(1000, self._start_lobby_refresh)
+        except Exception as e:
+            self.log(f"[ERROR] Lobby update error: {e}", "error")
+
+    def _process_game_frame(self):
+        game = self.pending_game
+        if game is None:
+            return
+        self.pending_game = None
+        try:
+            if game.players:
+                self.current_game = game
+                self.tabs.tab(2, state="normal")
+                self.tabs.select(self.tab_game)
+                self._update_spectator_view()
+                self.game_rows.update(
+                    (player["nick"], (
+                        player["nick"],
+                        player["hand"],
+                        player["table"],
+                        f"({player['color']}, {player['shape']})" if player['color'] is not None else "-",
+                    ))
+                    for player in game.players
+                )
+                if game.turn is not None and not self.is_spectator:
+                    self.turn_entry.delete(0, tk.END)
+                    self.turn_entry.insert(0, str(game.turn))
+                if self.is_spectator:
+                    self._draw_spectator_cards(game)
+                else:
+                    self._draw_cards(game)
+                turn_str = str(game.turn) if game.turn is not None else "-"
+                spectator_text = " (SPECTATOR)" if self.is_spectator else ""
+                latency = self._record_frame_latency()
+                if self.net:
+                    self.net.actions.rendered(time.perf_counter())
+                latency_text = f", Latency: {latency * 1000:.1f} ms" if latency is not None else ""
+                self.status_label.configure(
+                    text=f"Turn: {turn_str}, Spectators: {game.spectators}{spectator_text}{latency_text}"
+                )
+        except Exception as e:
+            self.log(f"[ERROR] Game update error: {e}", "error")
+
+    def _record_frame_latency(self):
+        if self.pending_game_received is not None:
+            self.root.update_idletasks()
+            self.frame_latencies.append(time.perf_counter() - self.pending_game_received)
+            self.pending_game_received = None
+        if not self.frame_latencies:
+            return None
+        return sorted(self.frame_latencies)[len(self.frame_latencies) // 2]
+
+    def _process_single_room(self, room_info):
+        self.log(describe_room(room_info), "system")
+        if self.nickname in room_info["players"]:
+            self.current_room_id = room_info["id"]
+            self.in_room = True
+            self.is_spectator = False
+            self.log(f"[SYSTEM] Joined room {self.current_room_id}", "system")
+        elif self.is_spectator:
+            self.current_room_id = room_info["id"]
+            self.in_room = True
+            self.log(f"[SYSTEM] Joined as spectator to room {self.current_room_id}", "system")
+
+    def _draw_cards(self, game):
+        my_index = -1
+        for i, player in enumerate(game.players):
+            if player["nick"] == self.nickname:
+                my_index = i
+                break
+        if my_index >= 0:
+            my_player = game.players[my_index]
+            self.big_card.show(my_player["color"], my_player["shape"])
+        else:
+            self.big_card.show(None, None)
+        other_players = []
+        if my_index >= 0 and len(game.players) > 1:
+            for i in range(1, len(game.players)):
+                other_players.append(game.players[(my_index + i) % len(game.players)])
+        for i, view in enumerate(self.side_card_views):
+            if i < len(other_players):
+                player = other_players[i]
+                view.show(player["color"], player["shape"], player["nick"])
+            else:
+                view.clear()
+
+    def _draw_spectator_cards(self, game):
+        for i, view in enumerate(self.spectator_card_views):
+            if i < len(game.players):
+                player = game.players[i]
+                view.show(player["color"], player["shape"], label_text=player["nick"][:8])
+            else:
+                view.clear()
+
+    def force_switch_to_game(self):
+        self.log("[SYSTEM] Forcing switch to game", "system")
+        self.tabs.tab(2, state="normal")
+        self.tabs.select(self.tab_game)
+        self._update_spectator_view()
+        self.send_refresh()
+
+def describe_room(room):
+    players = ", ".join(room["players"]) if room["players"] else "(empty)"
+    return f"Room {room['id']}: {players}, {room['spectators']} spectators, {room['state']}"
+
+def describe_game(game):
+    seats = []
+    for player in game.players:
+        top = f", top {player['color']}/{player['shape']}" if player["color"] is not None else ""
+        seats.append(f"{player['nick']} {player['hand']} in hand, {player['table']} on table{top}")
+    return f"Turn {game.turn}, {game.current_player_nick} to play, {game.spectators} spectators: " + "; ".join(seats)
+
+def describe_event(event):
+    kind = type(event)
+    if kind is GameFrame:
+        return describe_game(event.state)
+    if kind is LobbyFrame:
+        return "\n".join([f"Lobby: {len(event.rooms)} room(s)"] + ["  " + describe_room(room) for room in event.rooms])
+    if kind is RoomFrame:
+        return describe_room(event.room)
+    if kind is LobbyUpdate:
+        return "Lobby update: " + describe_room(event.room)
+    if kind is LobbyRemove:
+        return f"Lobby update: room {event.room_id} removed"
+    if kind is Error:
+        return f"Error ({event.kind}): {event.text}"
+    if kind is Info:
+        return event.text
+    fields = ", ".join(f"{name}={value}" for name, value in event._asdict().items())
+    return f"{kind.__name__}({fields})" if fields else kind.__name__
+
+def event_json(event):
+    data = {"event": type(event).__name__}
+    data.update(event._asdict())
+    if type(event) is GameFrame:
+        game = event.state
+        data["state"] = {"version": game.version, "turn": game.turn, "current": game.current_player_nick,
+                         "spectators": game.spectators, "players": game.players}
+    return json.dumps(data)
+
+# line-oriented client without Tk: stdin lines are sent as commands, decoded events are printed;
+# lines starting with / are handled locally so scripts can pace themselves. /wait also matches events
+# that arrived since the last command was sent, as a reply on localhost can beat the /wait line itself
+class HeadlessClient:
+    def __init__(self, host, port, nick=None, protocol=PROTO_TEXT, as_json=False, recorder=None, out=sys.stdout):
+        self.host = host
+        self.port = port
+        self.nick = nick
+        self.protocol = protocol
+        self.as_json = as_json
+        self.recorder = recorder
+        self.out = out
+        self.decoder = ProtocolDecoder()
+        self.echo = not sys.stdin.isatty()
+        self.conn = None
+        self.closed = None
+        self.waiting = []
+        self.since_send = set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.closed = loop.create_future()
+        self.conn = AsyncConnection(self.host, self.port, on_lines=self._on_lines, on_disconnect=self._on_disconnect)
+        await self.conn.open()
+        if self.recorder:
+            self.recorder.session(self.host, self.port)
+        self.note(f"Connected to {self.host}:{self.port}")
+        if self.nick:
+            self.send(self.nick)
+        # a daemon thread, so a blocked readline does not hold up exit once the server hangs up
+        commands = asyncio.Queue()
+        def read_stdin():
+            for line in sys.stdin:
+                loop.call_soon_threadsafe(commands.put_nowait, line.rstrip("\n"))
+            loop.call_soon_threadsafe(commands.put_nowait, None)
+        threading.Thread(target=read_stdin, daemon=True).start()
+        try:
+            while not self.closed.done():
+                line = asyncio.ensure_future(commands.get())
+                await asyncio.wait({line, self.closed}, return_when=asyncio.FIRST_COMPLETED)
+                if not line.done():
+                    line.cancel()
+                    break
+                if line.result() is None or not await self._command(line.result().strip()):
+                    break
+        finally:
+            await self.conn.aclose()
+        return 0
+
+    async def _command(self, line):
+        if not line:
+            return True
+        if not line.startswith("/"):
+            self.send(line)
+            return True
+        name, _, rest = line.partition(" ")
+        args = rest.split()
+        if name == "/quit":
+            return False
+        if name == "/sleep" and len(args) == 1:
+            await asyncio.sleep(float(args[0]))
+        elif name == "/wait" and 1 <= len(args) <= 2:
+            await self._wait(args[0], float(args[1]) if len(args) == 2 else 10.0)
+        else:
+            self.note("Local commands: /sleep SECONDS, /wait EVENT [TIMEOUT], /quit")
+        return True
+
+    async def _wait(self, name, timeout):
+        if name in self.since_send:
+            self.since_send.discard(name)
+            return
+        seen = asyncio.get_running_loop().create_future()
+        self.waiting.append((name, seen))
+        try:
+            await asyncio.wait_for(asyncio.shield(seen), timeout)
+        except asyncio.TimeoutError:
+            self.note(f"Timed out waiting for {name}")
+        finally:
+            self.waiting.remove((name, seen))
+
+    def send(self, line):
+        if not self.conn.connected:
+            return
+        if self.recorder:
+            self.recorder.sent(line)
+        if self.echo:
+            self.note(f"> {line}")
+        self.since_send.clear()
+        self.conn.send_line(line)
+
+    def note(self, text):
+        if self.as_json:
+            text = json.dumps({"event": "Client", "text": text})
+        print(text, file=self.out, flush=True)
+
+    def _on_lines(self, lines):
+        if self.recorder:
+            self.recorder.received(lines)
+        for event in self.decoder.feed(lines):
+            kind = type(event)
+            if kind is LobbyFrame and not event.complete:
+                continue
+            print(event_json(event) if self.as_json else describe_event(event), file=self.out)
+            if kind is NickAccepted and self.protocol != PROTO_TEXT:
+                self.send(f"protocol {self.protocol}")
+            elif kind is GameResync:
+                self.send("refresh")
+            for name, seen in self.waiting:
+                if name == kind.__name__ and not seen.done():
+                    seen.set_result(event)
+                    break
+            else:
+                self.since_send.add(kind.__name__)
+        self.out.flush()
+
+    def _on_disconnect(self):
+        self.note("Disconnected from server")
+        if not self.closed.done():
+            self.closed.set_result(None)
+
+def main():
+    parser = argparse.ArgumentParser(description="Totem client",
+                                     epilog="Example: python3 client.py localhost 12345")
+    parser.add_argument("host")
+    parser.add_argument("port", type=int)
+    parser.add_argument("--record", metavar="FILE", help="append received lines and sent commands to a capture file")
+    parser.add_argument("--headless", action="store_true",
+                        help="no GUI: send stdin lines as commands and print the decoded server events")
+    parser.add_argument("--nick", help="headless: nickname to send after connecting")
+    parser.add_argument("--protocol", type=int, default=PROTO_TEXT, choices=(PROTO_TEXT, PROTO_BINARY, PROTO_DELTA),
+                        help="game state as text (1, default), binary snapshots (2) or binary deltas (3)")
+    parser.add_argument("--json", action="store_true", help="headless: print events as JSON lines")
+    args = parser.parse_args()
+    recorder = SessionRecorder(args.record) if args.record else None
+    if args.headless:
+        headless = HeadlessClient(args.host, args.port, args.nick, args.protocol, args.json, recorder)
+        try:
+            return asyncio.run(headless.run())
+        except KeyboardInterrupt:
+            return 0
+        except (OSError, asyncio.TimeoutError) as e:
+            print(f"Cannot connect to {args.host}:{args.port}: {e}")
+            return 1
+        finally:
+            if recorder:
+                recorder.close()
+    root = load_tk().Tk()
+    root.geometry("1000x750")
+    app = TotemClientGUI(root, args.host, args.port, protocol=args.protocol, recorder=recorder)
+    def on_close():
+        if app.net:
+            app.net.close()
+        if recorder:
+            recorder.close()
+        root.destroy()
+    root.protocol("WM_DELETE_WINDOW", on_close)
+    root.mainloop()
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,174 @@
+import argparse
+import json
+import sys
+import time
+
+import client
+from client import read_capture, ProtocolDecoder, REC_SESSION, REC_RECEIVED, REC_SENT
+
+class HandlerTimer:
+    def __init__(self):
+        self.total = {}
+        self.calls = {}
+
+    def wrap(self, name, fn):
+        self.total.setdefault(name, 0.0)
+        self.calls.setdefault(name, 0)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.total[name] += time.perf_counter() - started
+                self.calls[name] += 1
+        return timed
+
+    def report(self):
+        return {
+            name: {
+                "calls": self.calls[name],
+                "total_ms": round(self.total[name] * 1000, 3),
+                "mean_us": round(self.total[name] / self.calls[name] * 1e6, 1) if self.calls[name] else None,
+            }
+            for name in sorted(self.total, key=self.total.get, reverse=True)
+        }
+
+# stands in for NetworkClient: sent commands go nowhere, the capture already holds the server's answers
+class ReplayNet:
+    connected = True
+
+    def __init__(self):
+        self.sent = 0
+        self.actions = client.ActionTimer()
+
+    def send_line(self, line):
+        self.sent += 1
+
+    def close(self):
+        pass
+
+# message boxes would block the replay until clicked
+class QuietMessages:
+    def __init__(self, app):
+        self.app = app
+
+    def showinfo(self, title, text):
+        self.app.log(f"[REPLAY] {title}: {text}", "system")
+
+    showerror = showinfo
+
+def sessions(path):
+    found = []
+    for record in read_capture(path):
+        if record[0] == REC_SESSION or not found:
+            found.append([])
+        found[-1].append(record)
+    return found
+
+def pace(records, speed, idle=None):
+    # yields records at their recorded offsets divided by speed (speed None = as fast as possible)
+    base = records[0][1]
+    started = time.perf_counter()
+    for record in records:
+        if speed:
+            due = (record[1] - base) / 1e9 / speed
+            while True:
+                left = due - (time.perf_counter() - started)
+                if left <= 0:
+                    break
+                if idle:
+                    idle()
+                time.sleep(min(left, 0.001))
+        yield record
+
+def replay_decoder(records, speed, timer):
+    decoder = ProtocolDecoder()
+    feed = timer.wrap("ProtocolDecoder.feed", decoder.feed)
+    events = {}
+    for kind, ns, data in pace(records, speed):
+        if kind != REC_RECEIVED:
+            continue
+        for event in feed(data):
+            name = type(event).__name__
+            events[name] = events.get(name, 0) + 1
+    return events
+
+def replay_gui(records, speed, timer):
+    root = client.load_tk().Tk()
+    root.geometry("1000x750")
+    host, _, port = records[0][2].rpartition(":") if records[0][0] == REC_SESSION else ("replay", "", "0")
+    app = client.TotemClientGUI(root, host, int(port))
+    app.net = ReplayNet()
+    client.messagebox = QuietMessages(app)
+    for name in ("_handle_data", "_process_lobby_frame", "_process_game_frame", "_flush_log"):
+        setattr(app, name, timer.wrap(name, getattr(app, name)))
+    for event_type, handler in app._event_handlers.items():
+        app._event_handlers[event_type] = timer.wrap(handler.__name__, handler)
+    render = timer.wrap("render", root.update_idletasks)
+    for kind, ns, data in pace(records, speed, root.update):
+        if kind == REC_RECEIVED:
+            app.msg_queue.put((data, "server", time.perf_counter()))
+        elif kind == REC_SENT:
+            # the nickname is read back from the entry once the server accepts it
+            if not app.nickname_set:
+                app.nick_entry.configure(state="normal")
+                app.nick_entry.delete(0, client.tk.END)
+                app.nick_entry.insert(0, data)
+            app.net.actions.sent(data)
+            app.msg_queue.put((f"[CLIENT -> SERVER] {data}", "client"))
+        else:
+            continue
+        while not app.msg_queue.empty():
+            app._drain()
+        render()
+    root.destroy()
+    return {"commands_swallowed": app.net.sent, "latency_ms": app.net.actions.summary()}
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a Totem client capture through the receive path")
+    parser.add_argument("capture")
+    parser.add_argument("--session", type=int, default=0, help="index of the recorded session to replay")
+    parser.add_argument("--speed", type=float, default=1.0, help="1.0 = recorded pace")
+    parser.add_argument("--fast", action="store_true", help="replay as fast as possible")
+    parser.add_argument("--decoder-only", action="store_true", help="only run ProtocolDecoder, no GUI")
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+    found = sessions(args.capture)
+    if not 0 <= args.session < len(found):
+        print(f"{args.capture} has {len(found)} session(s)")
+        return 1
+    records = found[args.session]
+    speed = None if args.fast else args.speed
+    timer = HandlerTimer()
+    started = time.perf_counter()
+    if args.decoder_only:
+        extra = {"events": replay_decoder(records, speed, timer)}
+    else:
+        extra = replay_gui(records, speed, timer)
+    elapsed = time.perf_counter() - started
+    received = [data for kind, ns, data in records if kind == REC_RECEIVED]
+    lines = sum(len(batch) for batch in received)
+    frames = sum(type(line) is bytes for batch in received for line in batch)
+    result = {
+        "session": args.session,
+        "records": len(records),
+        "lines": lines,
+        "frames": frames,
+        "sent": sum(kind == REC_SENT for kind, ns, data in records),
+        "recorded_seconds": round((records[-1][1] - records[0][1]) / 1e9, 3),
+        "seconds": round(elapsed, 3),
+        "lines_per_sec": round(lines / elapsed, 1) if elapsed else 0.0,
+        "handlers": timer.report(),
+    }
+    result.update(extra)
+    print(f"Session {args.session}: {result['records']} records, {lines} lines ({frames} binary frames), "
+          f"{result['sent']} sent, recorded over {result['recorded_seconds']} s")
+    print(f"Replayed in {result['seconds']} s: {result['lines_per_sec']} lines/s")
+    for name, stat in result["handlers"].items():
+        print(f"{name:>24}: n={stat['calls']} total={stat['total_ms']} ms mean={stat['mean_us']} us")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -20,15 +20,35 @@
 #include <ctime>
 #include <algorithm>
 #include <random>
+#include <memory>
+#include <mutex>
+#include <sys/uio.h>
+#include <chrono>
+#include <unordered_map>
+#include <unordered_set>
+#include <shared_mutex>
+#include <deque>
+#include <atomic>
 
 #define buff_size 1400
 #define shm "TotemMem"
 #define clMut "TotemClientMut"
-#define rmMut "TotemRoomMut"
-#define MQ_NAME "TotemQueue"
 #define timeoutLen 30
+#define PROTO_TEXT 1
+#define PROTO_BINARY 2
+#define PROTO_DELTA 3
+#define FRAME_MARK '\x01'
+#define DEFAULT_CAPACITY 4096
+// narzut managera segmentu (nagłówek, indeks nazwanych obiektów, wyrównania)
+#define SHM_OVERHEAD 65536
+// tyle niewysłanych bajtów może czekać na klienta, który nie czyta, zanim zostanie rozłączony
+#define OUTPUT_LIMIT (4 << 20)
+// kubełek i histogramu opóźnień: [2^(i-1), 2^i) mikrosekund, kubełek 0 - poniżej 1 us
+#define STAT_BUCKETS 24
 
 using namespace boost::interprocess;
+// timed_receive w boost::interprocess przelicza termin względem zegara systemowego
+typedef std::chrono::system_clock turnClock;
 
 typedef managed_shared_memory::segment_manager segman;
 typedef allocator<void, segman> alloc;
@@ -44,7 +64,8 @@ struct client{
     int fd;
     long roomId;
     string nick;
-    client(int fd_, long roomId_, const char* nick_, const allocator_type& allocate): fd(fd_), roomId(roomId_), nick(nick_, charAlloc(allocate)) {}
+    int proto;
+    client(int fd_, long roomId_, const char* nick_, const allocator_type& allocate): fd(fd_), roomId(roomId_), nick(nick_, charAlloc(allocate)), proto(PROTO_TEXT) {}
 };
 struct room{
     long id;
@@ -74,248 +95,456 @@ typedef boost::container::vector<room, roomAlloc> roomVector;
 
 struct message{
     int sender;
+    int proto;
     char cmd[50];
+    long long received; // odczyt linii z gniazda (statNow)
+    long long queued;   // wstawienie do kolejki pokoju
 };
 typedef struct message message;
 
-std::string describeRoom(room *temp){
-    std::string roomDesc = "Room " + std::to_string(temp->id) + "- players:\n";
+// ---- statystyki dla komendy "stats" - pisane z pętli epoll i z wątków gameRunner, więc atomowe ----
 
-    for (int j = 0; j < 8; j++) {
-        if (temp->players[j].fd == -1) continue;
-        roomDesc += std::string(temp->players[j].nick.c_str()) + "\n";
+enum statCommand{ ST_LIST, ST_CREATE, ST_JOIN, ST_SPECTATE, ST_START, ST_DRAW, ST_GRAB, ST_REFRESH, ST_LEAVE, ST_COUNT };
+const char* statNames[ST_COUNT] = {"list", "create", "join", "spectate", "start", "draw", "grab", "refresh", "leave"};
+
+int statKind(const char* cmd){
+    static const char* prefixes[ST_COUNT] = {"list", "create ", "join ", "spectate", "start", "draw ", "grab ", "refresh", "leave"};
+    for(int i=0; i<ST_COUNT; i++){
+        if(strncmp(cmd, prefixes[i], strlen(prefixes[i]))==0)return i;
     }
+    return -1;
+}
 
-    roomDesc += std::to_string(temp->spectatorCount) + " spectators\n";
-    if(temp->state==IDLE)roomDesc+="Waiting to start the match.\n";
-    else roomDesc+="Match in progress.\n";
-    return roomDesc;
+long long statNow(){
+    return std::chrono::duration_cast<std::chrono::microseconds>(std::chrono::steady_clock::now().time_since_epoch()).count();
 }
 
-int getArgument(const char* cmd, int startIndex){
-    std::string arg="";
-    for(int i=startIndex; cmd[i]!='\000'; i++){
-        arg+=cmd[i];
+struct latencyHistogram{
+    std::atomic<unsigned long> count{0};
+    std::atomic<unsigned long> totalUs{0};
+    std::atomic<unsigned long> maxUs{0};
+    std::atomic<unsigned long> buckets[STAT_BUCKETS] = {};
+    void add(long long us){
+        unsigned long v = us < 0 ? 0 : (unsigned long)us;
+        int b = v == 0 ? 0 : std::min(STAT_BUCKETS - 1, 64 - __builtin_clzl(v));
+        buckets[b]++;
+        count++;
+        totalUs += v;
+        unsigned long seen = maxUs;
+        while(v > seen && !maxUs.compare_exchange_weak(seen, v));
     }
-    try{
-        int num=std::stoi(arg);
-        if(num<0)return -1;
-        return num;
+    std::string describe(const char* what, const char* name){
+        unsigned long n = count;
+        std::string out = std::string(what) + " " + name + ": " + std::to_string(n) + " calls, avg " +
+            std::to_string(n ? totalUs / n : 0) + " us, max " + std::to_string(maxUs) + " us, buckets";
+        int last = STAT_BUCKETS - 1;
+        while(last > 0 && buckets[last] == 0) last--;
+        for(int i=0; i<=last; i++) out += " " + std::to_string(buckets[i]);
+        return out + "\n";
     }
-    catch(...){
-        return -1;
+};
+
+struct serverStats{
+    long long started = statNow();
+    latencyHistogram latency[ST_COUNT];   // od odczytu linii do obsłużenia komendy
+    latencyHistogram queueWait[ST_COUNT]; // od wstawienia do kolejki pokoju do odebrania przez gameRunner
+    std::atomic<unsigned long> dropped{0};
+    std::atomic<unsigned long> queueHighWater{0};
+    std::atomic<int> gameThreads{0};
+    void noteQueueDepth(unsigned long depth){
+        unsigned long seen = queueHighWater;
+        while(depth > seen && !queueHighWater.compare_exchange_weak(seen, depth));
     }
-}
+};
+serverStats stats;
 
-void handleComms(int clientSocket, sockaddr_in clientAddress){
-    managed_shared_memory segment(open_only, shm);
-    clientVector* clients = segment.find<clientVector>("clients").first;
-    roomVector* rooms     = segment.find<roomVector>("rooms").first;
-    named_mutex client_mutex(open_only, clMut);
-    named_mutex room_mutex(open_only, rmMut);
-    message_queue mq(open_only, MQ_NAME);
-    if((clients==0)||(rooms==0)){
-        shutdown(clientSocket, SHUT_RDWR);
-        close(clientSocket);
-        return;
+// liczy działające wątki gameRunner, także przy wcześniejszym return
+struct gameThreadCount{
+    gameThreadCount(){ stats.gameThreads++; }
+    ~gameThreadCount(){ stats.gameThreads--; }
+};
+
+// w gameRunner: czas w kolejce zapisany od razu, czas całej komendy przy wyjściu z bloku (także przez continue)
+struct commandTimer{
+    int kind;
+    long long received;
+    commandTimer(message &cmd): kind(statKind(cmd.cmd)), received(cmd.received){
+        if(kind != -1) stats.queueWait[kind].add(statNow() - cmd.queued);
     }
+    ~commandTimer(){
+        if(kind == ST_DRAW || kind == ST_GRAB || kind == ST_REFRESH) stats.latency[kind].add(statNow() - received);
+    }
+};
 
-    // bufor danych od klienta
-    std::string inputBuffer; 
+// ---- wyjście do klientów: gniazda są nieblokujące, a to, czego jądro nie przyjęło od razu,
+// czeka w buforze połączenia i wychodzi z pętli epoll po EPOLLOUT. Piszą pętla epoll i wątki
+// gameRunner, więc bufory chroni jeden muteks; jeden wolny klient nie zatrzymuje pozostałych ----
 
-    char buff[buff_size] = "Connected to the \"Totem\" game server. Choose your nickname:\n";
-    printf("Connection from %s\n", inet_ntoa(clientAddress.sin_addr));
-    write(clientSocket, buff, strlen(buff));
+struct outputBuffers{
+    std::mutex lock;
+    int epfd = -1;
+    std::unordered_map<int, std::string> pending;
+};
+outputBuffers output;
 
-    unsigned int i;
-    bool alreadySet = false;
-    message cmd;
+void watchOutput(int fd, bool writable){
+    epoll_event ev{};
+    ev.events = writable ? (EPOLLIN | EPOLLOUT) : EPOLLIN;
+    ev.data.fd = fd;
+    epoll_ctl(output.epfd, EPOLL_CTL_MOD, fd, &ev);
+}
 
-    while (true) {
-        int readBytes = read(clientSocket, buff, buff_size - 1);
-        if (readBytes <= 0) {
-            // error lub zamknięcie połączenia przez klienta
-            break;
+// jak writev, ale bez czekania: reszta trafia do bufora; klient z buforem ponad OUTPUT_LIMIT
+// dostaje shutdown, a pętla epoll obsłuży go jak każde rozłączenie
+void sendParts(int fd, const iovec* parts, int count){
+    std::lock_guard<std::mutex> guard(output.lock);
+    auto it = output.pending.find(fd);
+    size_t done = 0;
+    if (it == output.pending.end()) {
+        ssize_t written = writev(fd, parts, count);
+        if (written == -1 && errno != EAGAIN && errno != EWOULDBLOCK) return; // zerwane - zajmie się tym read()
+        done = written == -1 ? 0 : written;
+    }
+    std::string rest;
+    for (int i = 0; i < count; i++) {
+        size_t len = parts[i].iov_len;
+        if (done >= len) { done -= len; continue; }
+        rest.append((const char*)parts[i].iov_base + done, len - done);
+        done = 0;
+    }
+    if (rest.empty()) return;
+    if (it == output.pending.end()) {
+        it = output.pending.emplace(fd, std::string()).first;
+        watchOutput(fd, true);
+    }
+    it->second += rest;
+    if (it->second.length() > OUTPUT_LIMIT) {
+        printf("[ERROR] Client %d is not reading, %zu bytes pending - disconnecting\n", fd, it->second.length());
+        output.pending.erase(it);
+        shutdown(fd, SHUT_RDWR);
+    }
+}
+
+void sendTo(int fd, const void* data, size_t len){
+    iovec part;
+    part.iov_base = (void*)data;
+    part.iov_len = len;
+    sendParts(fd, &part, 1);
+}
+
+// wysyła do kolejki pokoju bez czekania - pętla epoll nie może stać na pełnej kolejce;
+// kolejki nie ma już po zakończonej grze (pokój zostaje INPROGRESS) - wtedy false,
+// a z replyIfGone nadawca dostaje ten sam błąd, co poza pokojem
+bool sendToRoom(long roomId, message &cmd, bool replyIfGone=false){
+    std::string qName="TotemRoom"+std::to_string(roomId);
+    try{
+        message_queue roomQ(open_only, qName.c_str());
+        cmd.queued=statNow();
+        if(!roomQ.try_send(&cmd, sizeof(cmd), 1)){
+            printf("[ERROR] Room %ld queue full, dropped '%s'\n", roomId, cmd.cmd);
+            stats.dropped++;
+            return false;
         }
+        stats.noteQueueDepth(roomQ.get_num_msg());
+    }
+    catch(interprocess_exception&){
+        printf("[DEBUG] Room %ld has no running game, dropped '%s'\n", roomId, cmd.cmd);
+        if(replyIfGone) sendTo(cmd.sender, "Not in a, room.\n", 16);
+        return false;
+    }
+    return true;
+}
 
-        buff[readBytes] = '\0';
-        inputBuffer += buff;
+// EPOLLOUT: wysyła ile się da z bufora, po opróżnieniu wraca do samego EPOLLIN
+void flushOutput(int fd){
+    std::lock_guard<std::mutex> guard(output.lock);
+    auto it = output.pending.find(fd);
+    if (it == output.pending.end()) {
+        watchOutput(fd, false);
+        return;
+    }
+    ssize_t written = write(fd, it->second.data(), it->second.length());
+    if (written == -1) {
+        if (errno == EAGAIN || errno == EWOULDBLOCK) return;
+        written = it->second.length();
+    }
+    it->second.erase(0, written);
+    if (it->second.empty()) {
+        output.pending.erase(it);
+        watchOutput(fd, false);
+    }
+}
 
-        // przetwarzenie pełnych linii (komend) z bufora
-        size_t pos;
-        while ((pos = inputBuffer.find('\n')) != std::string::npos) {
-            std::string line = inputBuffer.substr(0, pos);
-            inputBuffer.erase(0, pos + 1);
+void dropOutput(int fd){
+    std::lock_guard<std::mutex> guard(output.lock);
+    output.pending.erase(fd);
+}
 
-            // Kompatybilność z klientami Windows
-            if (!line.empty() && line.back() == '\r')
-                line.pop_back();
+#define ROOM_STRIPES 64
 
-            if (line.empty())
-                continue;
+// blokady pokoi zamiast jednego globalnego muteksu:
+// table - kształt wektora rooms i roomById, wyłącznie tylko przy dodawaniu/usuwaniu pokoju;
+// stripes - zawartość pokoju, muteks wybierany po id (pokoje z różnych pasków nie czekają na siebie)
+struct roomLocks{
+    std::shared_mutex table;
+    std::mutex stripes[ROOM_STRIPES];
+    std::mutex& of(long roomId){ return stripes[roomId % ROOM_STRIPES]; }
+};
 
-            //DEBUG
-            printf("[DEBUG] From %s: line='%s', len=%zu\n",
-                inet_ntoa(clientAddress.sin_addr),
-                line.c_str(),
-                line.length());
+// jeden pokój: współdzielona blokada tablicy + jego pasek
+struct roomLock{
+    roomLocks& locks;
+    std::mutex& stripe;
+    roomLock(roomLocks& locks_, long roomId): locks(locks_), stripe(locks_.of(roomId)) {}
+    void lock(){ locks.table.lock_shared(); stripe.lock(); }
+    void unlock(){ stripe.unlock(); locks.table.unlock_shared(); }
+};
 
-            // --------- NICKNAME ---------
+// indeksy do wektorów w pamięci współdzielonej - wszystkie wątki są w jednym procesie;
+// clientByFd/clientByNick/lobbySubscribers chroni client_mutex, roomById chroni roomLocks::table
+std::unordered_map<int, unsigned int> clientByFd;
+std::unordered_map<std::string, unsigned int> clientByNick;
+std::unordered_map<long, unsigned int> roomById;
+// deskryptory subskrybentów lobby - powiadomienie przechodzi tylko po nich, nie po wszystkich klientach
+std::unordered_set<int> lobbySubscribers;
+// pokoje w trakcie gry (ich gracze i widzowie nie dostają zmian lobby); pokój nie wraca do IDLE,
+// więc wystarcza notifyLobby po "start" i po usunięciu pokoju; też chroni client_mutex
+std::unordered_set<long> playingRooms;
+
+int findClient(int fd){
+    auto it = clientByFd.find(fd);
+    return it == clientByFd.end() ? -1 : (int)it->second;
+}
 
-            if (!alreadySet) {
-                std::string nick = line;
+bool nickTaken(const std::string& nick){
+    return clientByNick.count(nick) > 0;
+}
 
-                if (nick.length() < 3 || nick.length() > 16) {
-                    const char* msg = "Nickname must be between 3 and 16 characters\n";
-                    write(clientSocket, msg, strlen(msg));
-                    continue;
-                }
+int findRoom(long roomId){
+    auto it = roomById.find(roomId);
+    return it == roomById.end() ? -1 : (int)it->second;
+}
 
-                //DEBUG
-                printf("[DEBUG] Nick attempt from %s: '%s' (len=%zu)\n",
-                    inet_ntoa(clientAddress.sin_addr),
-                    nick.c_str(),
-                    nick.length());
+// rozmiar segmentu dla podanej liczby klientów; pokoi nie może być więcej niż klientów,
+// a nicki (do 16 znaków) mieszczą się w buforze stringa i nie alokują nic w segmencie
+size_t segmentSize(unsigned int capacity){
+    return SHM_OVERHEAD + (sizeof(client) + sizeof(room)) * (size_t)capacity * 5 / 4;
+}
 
-                client_mutex.lock();
-                bool available = true;
-                unsigned int clientIndex = 0;
-
-                // przeszukiwanie klientów w celu sprawdzenia dostępności nicku
-                for (i = 0; i < clients->size(); i++) {
-                    if (clients->at(i).fd == clientSocket) {
-                        clientIndex = i;
-                        if (clients->at(i).nick != "") {
-                            alreadySet = true;
-                            break;
-                        }
-                    }
-                    if (clients->at(i).nick == nick.c_str()) {
-                        available = false;
-                        break;
-                    }
-                }
+std::string describeMemory(clientVector* clients, roomVector* rooms){
+    segman* manager = clients->get_allocator().get_segment_manager();
+    size_t size = manager->get_size();
+    size_t free = manager->get_free_memory();
+    return "Memory: " + std::to_string(size - free) + " of " + std::to_string(size) + " bytes used, " +
+        std::to_string(free) + " free; clients " + std::to_string(clients->size()) + "/" + std::to_string(clients->capacity()) +
+        ", rooms " + std::to_string(rooms->size()) + "/" + std::to_string(rooms->capacity()) + ".\n";
+}
 
-                if (alreadySet) {
-                    const char* msg = "Nickname already set\n";
-                    write(clientSocket, msg, strlen(msg));
-                    client_mutex.unlock();
-                    continue;
-                }
+void addClient(clientVector* clients, int fd, const alloc& allocInst){
+    clients->emplace_back(fd, -1, "", allocInst);
+    clientByFd[fd] = clients->size() - 1;
+}
 
-                if (available) {
-                    clients->at(clientIndex).nick.assign(nick.c_str());
-                    const char* ok =
-                        "Nickname set successfully.\n"
-                        "Available commands: list, create roomId, join roomId, spectate roomId, start, "
-                        "draw turnNum, grab turnNum, refresh, leave\n";
-                    write(clientSocket, ok, strlen(ok));
-                    alreadySet = true;
-                } else {
-                    const char* msg = "Nickname unavailable, choose another.\n";
-                    write(clientSocket, msg, strlen(msg));
-                }
+void setNick(clientVector* clients, unsigned int index, const std::string& nick){
+    clients->at(index).nick.assign(nick.c_str());
+    clientByNick[nick] = index;
+}
 
-                client_mutex.unlock();
-            }
+// kolejność klientów nie ma znaczenia - ostatni wskakuje na miejsce usuniętego
+void removeClient(clientVector* clients, unsigned int index){
+    clientByFd.erase(clients->at(index).fd);
+    lobbySubscribers.erase(clients->at(index).fd);
+    if (clients->at(index).nick != "") clientByNick.erase(clients->at(index).nick.c_str());
+    unsigned int last = clients->size() - 1;
+    if (index != last) {
+        clients->at(index) = clients->at(last);
+        clientByFd[clients->at(index).fd] = index;
+        if (clients->at(index).nick != "") clientByNick[clients->at(index).nick.c_str()] = index;
+    }
+    clients->pop_back();
+}
 
-            // --------- KOMENDY ---------
+void addRoom(roomVector* rooms, const room& temp){
+    rooms->push_back(temp);
+    roomById[temp.id] = rooms->size() - 1;
+}
 
-            else {
-                std::string cmdStr = line;
+// jak przy klientach ostatni pokój wskakuje na miejsce usuniętego - poprawiany jest tylko jego indeks
+// (kolejność pokoi w odpowiedzi na "list" może się przez to zmienić)
+void removeRoom(roomVector* rooms, unsigned int index){
+    roomById.erase(rooms->at(index).id);
+    unsigned int last = rooms->size() - 1;
+    if (index != last) {
+        rooms->at(index) = rooms->at(last);
+        roomById[rooms->at(index).id] = index;
+    }
+    rooms->pop_back();
+}
 
-                cmd.sender = clientSocket;
-                memset(cmd.cmd, '\0', 50);
-                if (snprintf(cmd.cmd, 50, "%s", cmdStr.c_str()) >= (int)sizeof(cmd.cmd)) {
-                    const char* msg = "Command too long.\n";
-                    write(clientSocket, msg, strlen(msg));
-                    continue;
-                }
+std::string describeRoom(room *temp){
+    std::string roomDesc = "Room " + std::to_string(temp->id) + "- players:\n";
 
-                // list
-                if (cmdStr.rfind("list", 0) == 0) {   // starts_with "list"
-                    room_mutex.lock();
+    for (int j = 0; j < 8; j++) {
+        if (temp->players[j].fd == -1) continue;
+        roomDesc += std::string(temp->players[j].nick.c_str()) + "\n";
+    }
 
-                    const char* header = "Available rooms:\n";
-                    write(clientSocket, header, strlen(header));
+    roomDesc += std::to_string(temp->spectatorCount) + " spectators\n";
+    if(temp->state==IDLE)roomDesc+="Waiting to start the match.\n";
+    else roomDesc+="Match in progress.\n";
+    return roomDesc;
+}
 
-                    for (i = 0; i < rooms->size(); i++) {
-                        room temp = rooms->at(i);
-                        std::string roomDesc = describeRoom(&temp);
-                        write(clientSocket, roomDesc.c_str(), roomDesc.length());
-                    }
+// gotowa odpowiedź na "list": zmiana pokoi tylko podbija lobbyVersion, a snapshot przebudowuje
+// pierwsze "list", które zobaczy nieaktualną wersję - seria create/leave bez "list" nic nie serializuje;
+// listę kończy "End of rooms.", żeby klient nie musiał czekać na następny wiersz
+const char lobbyHeader[] = "Available rooms:\n";
+const char lobbyTrailer[] = "End of rooms.\n";
+std::mutex lobbySnapshotMutex;
+std::shared_ptr<const std::string> lobbySnapshot = std::make_shared<const std::string>();
+unsigned long lobbySnapshotVersion = 0;
+std::atomic<unsigned long> lobbyVersion{0};
+
+void invalidateLobbySnapshot(){
+    lobbyVersion++;
+}
 
-                    room_mutex.unlock();
-                }
-                else {
-                    // create / join / start / leave - priorytet 0
-                    if (cmdStr.rfind("create ", 0) == 0 ||
-                        cmdStr.rfind("join ",   0) == 0 ||
-                        cmdStr.rfind("start",   0) == 0 ||
-                        cmdStr.rfind("leave",   0) == 0 ||
-                        cmdStr.rfind("spectate",   0) == 0)
-                    {
-                        mq.send(&cmd, sizeof(cmd), 0);
-                    }
-                    // draw / grab / refresh - priorytet 1
-                    else if (cmdStr.rfind("draw ",    0) == 0 ||
-                             cmdStr.rfind("grab ",    0) == 0 ||
-                             cmdStr.rfind("refresh", 0) == 0)
-                    {
-                        mq.send(&cmd, sizeof(cmd), 1);
-                    }
-                    else {
-                        const char* msg = "Unrecognized command.\n";
-                        write(clientSocket, msg, strlen(msg));
-                    }
-                }
-            }
+std::shared_ptr<const std::string> currentLobbySnapshot(roomLocks& room_locks, roomVector* rooms){
+    std::lock_guard<std::mutex> guard(lobbySnapshotMutex);
+    // wersja czytana przed przejściem - zmiana w jego trakcie wymusi kolejną przebudowę
+    unsigned long version = lobbyVersion;
+    if (version != lobbySnapshotVersion) {
+        std::string snapshot;
+        room_locks.table.lock_shared();
+        for(unsigned int i=0; i<rooms->size(); i++){
+            room& r=rooms->at(i);
+            std::lock_guard<std::mutex> roomGuard(room_locks.of(r.id));
+            snapshot+=describeRoom(&r);
         }
+        room_locks.table.unlock_shared();
+        lobbySnapshot = std::make_shared<const std::string>(std::move(snapshot));
+        lobbySnapshotVersion = version;
+        printf("[DEBUG] Lobby snapshot v%lu, %zu bytes\n", version, lobbySnapshot->length());
     }
+    return lobbySnapshot;
+}
 
-    // wyjście z pętli = klient kończy -> zostaje wysłany "leave" do kolejki
-    cmd.sender = clientSocket;
-    memset(cmd.cmd, '\0', 50);
-    sprintf(cmd.cmd, "leave");
-    mq.send(&cmd, sizeof(cmd), 0);
-    sleep(1); //odczekać, żeby główny wątek mógł zareagować na komendę
+void sendLobbySnapshot(int clientSocket, roomLocks& room_locks, roomVector* rooms){
+    std::shared_ptr<const std::string> snapshot = currentLobbySnapshot(room_locks, rooms);
+    iovec parts[3];
+    parts[0].iov_base = (void*)lobbyHeader;
+    parts[0].iov_len = sizeof(lobbyHeader) - 1;
+    parts[1].iov_base = (void*)snapshot->data();
+    parts[1].iov_len = snapshot->length();
+    parts[2].iov_base = (void*)lobbyTrailer;
+    parts[2].iov_len = sizeof(lobbyTrailer) - 1;
+    sendParts(clientSocket, parts, 3);
+}
+
+// wysyła zmianę pokoju wszystkim subskrybentom lobby, którzy nie są w trakcie gry
+void notifyLobby(long roomId, named_mutex& client_mutex, roomLocks& room_locks, clientVector* clients, roomVector* rooms){
+    invalidateLobbySnapshot();
+    // tylko zmieniony pokój - współdzielona blokada tablicy i jego własny pasek
+    std::string update;
+    bool playing=false;
+    roomLock room_lock(room_locks, roomId);
+    room_lock.lock();
+    int roomIndex=findRoom(roomId);
+    if(roomIndex!=-1){
+        update="Lobby update:\n"+describeRoom(&rooms->at(roomIndex));
+        playing=(rooms->at(roomIndex).state==INPROGRESS);
+    }
+    room_lock.unlock();
+    if(update.empty()) update="Lobby removed: "+std::to_string(roomId)+"\n";
 
-    // usunięcie klienta ze wspólnej listy
     client_mutex.lock();
-    i = 0;
-    while (i < clients->size()) {
-        if (clients->at(i).fd == clientSocket) break;
-        i++;
+    if(playing) playingRooms.insert(roomId);
+    else playingRooms.erase(roomId);
+    for(int fd : lobbySubscribers){
+        int i=findClient(fd);
+        if(i==-1) continue;
+        if(clients->at(i).roomId!=-1 && playingRooms.count(clients->at(i).roomId)) continue;
+        sendTo(fd, update.c_str(), update.length());
     }
-    if (i < clients->size()) {
-        printf("Client %s timed out.\n",
-               clients->at(i).nick.c_str()[0] ? clients->at(i).nick.c_str() : "unnamed");
-        clients->erase(clients->begin() + i);
+    client_mutex.unlock();
+}
+
+// odpowiedź na "stats": jeden wiersz stanu, kolejki, pamięć, histogramy; kończy ją "End of stats."
+std::string describeStats(named_mutex& client_mutex, roomLocks& room_locks, clientVector* clients, roomVector* rooms){
+    unsigned int roomCount=0, inProgress=0, players=0, spectators=0;
+    std::vector<long> running;
+    room_locks.table.lock_shared();
+    roomCount=rooms->size();
+    for(unsigned int i=0; i<rooms->size(); i++){
+        room& r=rooms->at(i);
+        std::lock_guard<std::mutex> guard(room_locks.of(r.id));
+        for(int j=0; j<8; j++){
+            if(r.players[j].fd!=-1)players++;
+        }
+        spectators+=r.spectatorCount;
+        if(r.state==INPROGRESS){
+            inProgress++;
+            running.push_back(r.id);
+        }
+    }
+    room_locks.table.unlock_shared();
+    // kolejki otwierane bez blokad - pokój mógł się w międzyczasie skończyć
+    unsigned long queued=0, deepest=0;
+    for(long id : running){
+        try{
+            std::string qName="TotemRoom"+std::to_string(id);
+            message_queue roomQ(open_only, qName.c_str());
+            unsigned long depth=roomQ.get_num_msg();
+            queued+=depth;
+            deepest=std::max(deepest, depth);
+        }
+        catch(interprocess_exception&){}
     }
+    client_mutex.lock();
+    std::string memory=describeMemory(clients, rooms);
+    std::string out="Stats: uptime "+std::to_string((statNow()-stats.started)/1000000)+" s, clients "+
+        std::to_string(clients->size())+", rooms "+std::to_string(roomCount)+" ("+std::to_string(inProgress)+
+        " in progress), players "+std::to_string(players)+", spectators "+std::to_string(spectators)+
+        ", game threads "+std::to_string(stats.gameThreads)+".\n";
     client_mutex.unlock();
+    out+="Queues: "+std::to_string(queued)+" queued, deepest "+std::to_string(deepest)+", high-water "+
+        std::to_string(stats.queueHighWater)+", dropped "+std::to_string(stats.dropped)+".\n";
+    out+=memory;
+    for(int i=0; i<ST_COUNT; i++) out+=stats.latency[i].describe("Command", statNames[i]);
+    for(int i=ST_SPECTATE; i<ST_COUNT; i++){
+        if(i==ST_START)continue;
+        out+=stats.queueWait[i].describe("Queue wait", statNames[i]);
+    }
+    return out+"End of stats.\n";
+}
 
-    shutdown(clientSocket, SHUT_RDWR);
-    close(clientSocket);
-    return;
+int getArgument(const char* cmd, int startIndex){
+    std::string arg="";
+    for(int i=startIndex; cmd[i]!='\000'; i++){
+        arg+=cmd[i];
+    }
+    try{
+        int num=std::stoi(arg);
+        if(num<0)return -1;
+        return num;
+    }
+    catch(...){
+        return -1;
+    }
 }
 
-std::vector<int> updateRoomVars(long roomId, named_mutex& mut, roomVector* rooms, room& gameRoom, int& pCount, std::vector<client>& players){
-    mut.lock();
+std::vector<int> updateRoomVars(long roomId, roomLocks& room_locks, roomVector* rooms, room& gameRoom, int& pCount, std::vector<client>& players){
+    roomLock room_lock(room_locks, roomId);
+    room_lock.lock();
     unsigned int i;
-    bool found=false;
-    for(i=0; i<rooms->size(); i++){
-        if(rooms->at(i).id==roomId){
-            found=true;
-            break;
-        }
-    }
-    if(!found){
-        mut.unlock();
+    int roomIndex=findRoom(roomId);
+    if(roomIndex==-1){
+        room_lock.unlock();
         printf("[error] Internal error - trying to serve game in room %ld, which doesn't exist.\n", roomId);
         return std::vector<int>({-1});
     }
     std::vector<client> oldPlayers(players);
-    gameRoom=rooms->at(i);
+    gameRoom=rooms->at(roomIndex);
     pCount=0;
     for(i=0; i<8;i++){
         if(gameRoom.players[i].fd!=-1) pCount++;
@@ -324,7 +553,7 @@ std::vector<int> updateRoomVars(long roomId, named_mutex& mut, roomVector* rooms
     for(i=0; i<8;i++){
         if(gameRoom.players[i].fd!=-1) players.push_back(gameRoom.players[i]);
     };
-    mut.unlock();
+    room_lock.unlock();
     printf("See who left\n");
     std::vector<int> whoLeft;
     for(i=0; i<oldPlayers.size(); i++){
@@ -342,40 +571,219 @@ struct card{
     int shape;
 };
 typedef struct card card;
+// ręka to kolejka: gra się kartą z przodu, zebrane karty dokłada się na koniec
+typedef std::deque<card> cardQueue;
 
-std::string describeState(int &turnNum, int &playerCount, int &currentPlayer, room &gameRoom, std::vector<client> &players, std::vector<std::vector<card>> &hands, std::vector<std::vector<card>> &table){
+std::string describeState(int &turnNum, int &playerCount, int &currentPlayer, room &gameRoom, std::vector<client> &players, std::vector<cardQueue> &hands, std::vector<std::vector<card>> &table){
     if(playerCount==0)return "All players left- match halted.\n";
-    std::string state = "Turn " + std::to_string(turnNum) + "\n";
-    state += "Current player: " + std::string(players.at(currentPlayer).nick.c_str()) + "\n";
+    std::string state;
+    state.reserve(64 + playerCount * 128);
+    state += "Turn ";
+    state += std::to_string(turnNum);
+    state += "\nCurrent player: ";
+    state += players.at(currentPlayer).nick.c_str();
+    state += "\n";
     for (int i = 0; i < playerCount; i++) {
-        state += "Player " + std::string(players.at(i).nick.c_str()) +
-            " has " + std::to_string(hands.at(i).size()) +
-            " cards in hand and " + std::to_string(table.at(i).size()) +
-            " cards on the table.\n";
+        state += "Player ";
+        state += players.at(i).nick.c_str();
+        state += " has ";
+        state += std::to_string(hands.at(i).size());
+        state += " cards in hand and ";
+        state += std::to_string(table.at(i).size());
+        state += " cards on the table.\n";
 
             if (table.at(i).size() > 0) {
-                card topc = table.at(i).at(table.at(i).size() - 1);
-                state += "Currently on top- color " + std::to_string(topc.color) +
-                ", shape " + std::to_string(topc.shape) + "\n";
+                card topc = table.at(i).back();
+                state += "Currently on top- color ";
+                state += std::to_string(topc.color);
+                state += ", shape ";
+                state += std::to_string(topc.shape);
+                state += "\n";
             }
     }
-    state += std::to_string(gameRoom.spectatorCount) + " spectators watching.\n";
+    state += std::to_string(gameRoom.spectatorCount);
+    state += " spectators watching.\n";
 
     return state;
 }
 
-void gameRunner(long roomId){
+// ramka binarna: FRAME_MARK, typ, długość (2 bajty, big endian), dane
+std::string frame(char type, const std::string& payload){
+    std::string out;
+    out += FRAME_MARK;
+    out += type;
+    out += (char)((payload.length() >> 8) & 0xFF);
+    out += (char)(payload.length() & 0xFF);
+    return out + payload;
+}
+
+// 'R': liczba graczy, potem dla każdego długość nicku i nick
+std::string encodeRoster(int &playerCount, std::vector<client> &players){
+    std::string payload;
+    payload += (char)playerCount;
+    for (int i = 0; i < playerCount; i++) {
+        const char* nick = players.at(i).nick.c_str();
+        payload += (char)strlen(nick);
+        payload += nick;
+    }
+    return frame('R', payload);
+}
+
+// stan jednego gracza: karty w ręce, karty na stole, kolor i kształt wierzchniej karty (0xFF - brak)
+std::string encodeSeat(int i, std::vector<cardQueue> &hands, std::vector<std::vector<card>> &table){
+    std::string seat;
+    seat += (char)hands.at(i).size();
+    seat += (char)table.at(i).size();
+    if (table.at(i).size() > 0) {
+        card topc = table.at(i).back();
+        seat += (char)topc.color;
+        seat += (char)topc.shape;
+    } else {
+        seat += (char)0xFF;
+        seat += (char)0xFF;
+    }
+    return seat;
+}
+
+void putU32(std::string &out, unsigned int value){
+    for (int shift = 24; shift >= 0; shift -= 8) out += (char)((value >> shift) & 0xFF);
+}
+
+// tura (4 bajty), indeks aktualnego gracza, liczba graczy, widzowie (2 bajty), potem stany graczy
+std::string statePayload(int &turnNum, int &playerCount, int &currentPlayer, room &gameRoom, std::vector<cardQueue> &hands, std::vector<std::vector<card>> &table){
+    std::string payload;
+    putU32(payload, turnNum);
+    payload += (char)currentPlayer;
+    payload += (char)playerCount;
+    payload += (char)((gameRoom.spectatorCount >> 8) & 0xFF);
+    payload += (char)(gameRoom.spectatorCount & 0xFF);
+    for (int i = 0; i < playerCount; i++) {
+        payload += encodeSeat(i, hands, table);
+    }
+    return payload;
+}
+
+// 'G': pełny stan (protokół 2)
+std::string encodeState(int &turnNum, int &playerCount, int &currentPlayer, room &gameRoom, std::vector<cardQueue> &hands, std::vector<std::vector<card>> &table){
+    if(playerCount==0)return "All players left- match halted.\n";
+    return frame('G', statePayload(turnNum, playerCount, currentPlayer, gameRoom, hands, table));
+}
+
+// ostatnio rozesłany stan - z niego liczone są delty dla protokołu 3
+struct sentState{
+    unsigned int version = 0;
+    std::vector<std::string> seats;
+    // stan zakodowany od ostatniej zmiany - refresh tylko go kopiuje;
+    // puste pole znaczy, że format jeszcze nie był potrzebny
+    std::string text, binary, snapshot, roster;
+    void invalidate(){ text.clear(); binary.clear(); snapshot.clear(); roster.clear(); }
+};
+
+// 'S': wersja (4 bajty) + pełny stan, klient zastępuje nim swój stan
+std::string encodeSnapshot(sentState &sent, int &turnNum, int &playerCount, int &currentPlayer, room &gameRoom, std::vector<cardQueue> &hands, std::vector<std::vector<card>> &table){
+    if(playerCount==0)return "All players left- match halted.\n";
+    std::string payload;
+    putU32(payload, sent.version);
+    return frame('S', payload + statePayload(turnNum, playerCount, currentPlayer, gameRoom, hands, table));
+}
+
+// 'D': wersja (4 bajty), tura (4 bajty), indeks aktualnego gracza, widzowie (2 bajty),
+// liczba zmian, potem dla każdej zmiany indeks gracza i jego nowy stan
+std::string encodeDelta(sentState &sent, std::vector<std::string> &seats, int &turnNum, int &currentPlayer, room &gameRoom){
+    std::string changes;
+    int changed = 0;
+    for (unsigned int i = 0; i < seats.size(); i++) {
+        if (seats[i] == sent.seats[i]) continue;
+        changes += (char)i;
+        changes += seats[i];
+        changed++;
+    }
+    std::string payload;
+    putU32(payload, sent.version);
+    putU32(payload, turnNum);
+    payload += (char)currentPlayer;
+    payload += (char)((gameRoom.spectatorCount >> 8) & 0xFF);
+    payload += (char)(gameRoom.spectatorCount & 0xFF);
+    payload += (char)changed;
+    return frame('D', payload + changes);
+}
+
+void sendState(int fd, int proto, sentState &sent, int &turnNum, int &playerCount, int &currentPlayer, room &gameRoom, std::vector<client> &players, std::vector<cardQueue> &hands, std::vector<std::vector<card>> &table){
+    std::string* state;
+    if (proto >= PROTO_DELTA) {
+        if (sent.snapshot.empty()) sent.snapshot = encodeSnapshot(sent, turnNum, playerCount, currentPlayer, gameRoom, hands, table);
+        state = &sent.snapshot;
+    } else if (proto >= PROTO_BINARY) {
+        if (sent.binary.empty()) sent.binary = encodeState(turnNum, playerCount, currentPlayer, gameRoom, hands, table);
+        state = &sent.binary;
+    } else {
+        if (sent.text.empty()) sent.text = describeState(turnNum, playerCount, currentPlayer, gameRoom, players, hands, table);
+        sendTo(fd, sent.text.data(), sent.text.length());
+        return;
+    }
+    if (sent.roster.empty()) sent.roster = encodeRoster(playerCount, players);
+    iovec parts[2];
+    parts[0].iov_base = (void*)sent.roster.data();
+    parts[0].iov_len = sent.roster.length();
+    parts[1].iov_base = (void*)state->data();
+    parts[1].iov_len = state->length();
+    sendParts(fd, parts, 2);
+}
+
+// rozsyła stan wszystkim graczom, każdemu w wynegocjowanym formacie;
+// po zmianie składu (sent.seats nie pasuje) protokół 3 dostaje pełny stan zamiast delty
+void broadcastState(sentState &sent, int &turnNum, int &playerCount, int &currentPlayer, room &gameRoom, std::vector<client> &players, std::vector<cardQueue> &hands, std::vector<std::vector<card>> &table){
+    std::vector<std::string> seats;
+    for (int i = 0; i < playerCount; i++) seats.push_back(encodeSeat(i, hands, table));
+    bool full = sent.seats.size() != seats.size();
+    sent.version++;
+    sent.invalidate();
+    std::string delta;
+    for (int p = 0; p < playerCount; p++) {
+        std::string* state;
+        if (players[p].proto >= PROTO_DELTA) {
+            if (delta.empty()) {
+                if (full) {
+                    sent.snapshot = encodeSnapshot(sent, turnNum, playerCount, currentPlayer, gameRoom, hands, table);
+                    delta = sent.snapshot;
+                }
+                else delta = encodeDelta(sent, seats, turnNum, currentPlayer, gameRoom);
+            }
+            state = &delta;
+        } else if (players[p].proto >= PROTO_BINARY) {
+            if (sent.binary.empty()) sent.binary = encodeState(turnNum, playerCount, currentPlayer, gameRoom, hands, table);
+            state = &sent.binary;
+        } else {
+            if (sent.text.empty()) sent.text = describeState(turnNum, playerCount, currentPlayer, gameRoom, players, hands, table);
+            state = &sent.text;
+        }
+        sendTo(players[p].fd, state->c_str(), state->length());
+    }
+    sent.seats.swap(seats);
+}
+
+void broadcastRoster(int &playerCount, std::vector<client> &players){
+    std::string roster;
+    for (int p = 0; p < playerCount; p++) {
+        if (players[p].proto < PROTO_BINARY) continue;
+        if (roster.empty()) roster = encodeRoster(playerCount, players);
+        sendTo(players[p].fd, roster.c_str(), roster.length());
+    }
+}
+
+void gameRunner(long roomId, roomLocks& room_locks){
+    gameThreadCount running;
     managed_shared_memory segment(open_only, shm);
     roomVector* rooms = segment.find<roomVector>("rooms").first;
-    named_mutex room_mutex(open_only, rmMut);
     std::string qName="TotemRoom"+std::to_string(roomId);
-    message_queue mq(create_only, qName.c_str(), 100, sizeof(message));
+    // kolejkę tworzy handleCommand przed uruchomieniem wątku
+    message_queue mq(open_only, qName.c_str());
     alloc allocInst(segment.get_segment_manager());
 
     room gameRoom(allocInst);
     std::vector<client> players;
     int playerCount=0;
-    updateRoomVars(roomId, room_mutex, rooms, gameRoom, playerCount, players);
+    updateRoomVars(roomId, room_locks, rooms, gameRoom, playerCount, players);
     
     std::vector<card> cards;
     for(int i=0;i<18;i++){
@@ -389,35 +797,33 @@ void gameRunner(long roomId){
     std::default_random_engine rng { rd() };
     std::shuffle(std::begin(cards), std::end(cards), rng);
     int currentPlayer=rng()%playerCount;
-    std::vector<std::vector<card>> hands;
-    std::vector<std::vector<card>> table;
-    for(int i=0; i<playerCount; i++){
-        hands.push_back(std::vector<card>());
-        table.push_back(std::vector<card>());
-    }
+    std::vector<cardQueue> hands(playerCount);
+    std::vector<std::vector<card>> table(playerCount);
     for(unsigned int i=0; i<cards.size(); i++){
         hands.at(i%playerCount).push_back(cards.at(i));
     }
     std::vector<card> pub;
 
     bool end=false;
-    int timeout=0;
     message cmd;
     unsigned int prio;
     message_queue::size_type recSize;
-    time_t timer=time(NULL);
+    // termin automatycznego ruchu - przesuwany przy każdym dobraniu karty
+    turnClock::time_point deadline=turnClock::now()+std::chrono::seconds(timeoutLen);
     int turnNum=0;
+    sentState sent;
 
         // --- AUTOMATIC REFRESH AFTER GAME INITIALIZATION ---
-    std::string state = describeState(turnNum, playerCount, currentPlayer, gameRoom, players, hands, table);
-    for (int i = 0; i < playerCount; i++) {
-        write(players[i].fd, state.c_str(), state.length());
-    }
+    broadcastRoster(playerCount, players);
+    broadcastState(sent, turnNum, playerCount, currentPlayer, gameRoom, players, hands, table);
 
     while(!end){
-        if(mq.try_receive(&cmd, sizeof(cmd), recSize, prio)){
+        if(mq.timed_receive(&cmd, sizeof(cmd), recSize, prio, deadline)){
+            commandTimer timer(cmd);
             if((strncmp(cmd.cmd, "leave", 5)==0)||(strncmp(cmd.cmd, "spectate", 8)==0)){
-                std::vector<int> whoLeft=updateRoomVars(roomId, room_mutex, rooms, gameRoom, playerCount, players);
+                std::vector<int> whoLeft=updateRoomVars(roomId, room_locks, rooms, gameRoom, playerCount, players);
+                // zmienia się liczba widzów albo skład - zapamiętany stan jest nieaktualny
+                sent.invalidate();
                 if(!whoLeft.empty()){
                     if(whoLeft.at(0)==-1){
                         printf("Room doesn't exist, stopping the match...\n");
@@ -427,22 +833,23 @@ void gameRunner(long roomId){
                     for(int j=whoLeft.size()-1; j>=0; j--){
                         if(currentPlayer>=playerCount)currentPlayer=0;
                         if(currentPlayer>whoLeft.at(j))currentPlayer--;
-                        for(card c : hands.at(whoLeft.at(j))){
-                            pub.push_back(c);
-                        }
-                        for(card c : table.at(whoLeft.at(j))){
-                            pub.push_back(c);
-                        }
+                        cardQueue &leftHand=hands.at(whoLeft.at(j));
+                        std::vector<card> &leftTable=table.at(whoLeft.at(j));
+                        pub.insert(pub.end(), leftHand.begin(), leftHand.end());
+                        pub.insert(pub.end(), leftTable.begin(), leftTable.end());
                         hands.erase(hands.begin()+whoLeft.at(j));
                         table.erase(table.begin()+whoLeft.at(j));
                     }
+                    // indeksy graczy się przesunęły - następny stan idzie w całości
+                    sent.version++;
+                    sent.seats.clear();
+                    broadcastRoster(playerCount, players);
                 }
 
             }
             else{
                 if((strncmp(cmd.cmd, "refresh", 7)==0)){
-                    std::string state=describeState(turnNum, playerCount, currentPlayer, gameRoom, players, hands, table);
-                    write(cmd.sender, state.c_str(), state.length());
+                    sendState(cmd.sender, cmd.proto, sent, turnNum, playerCount, currentPlayer, gameRoom, players, hands, table);
                 }
                 if((strncmp(cmd.cmd, "draw ", 5)==0)){
                     bool found=false;
@@ -455,42 +862,38 @@ void gameRunner(long roomId){
                     }
                     if(!found){
                         std::string err="Spectators can't play.\n";
-                        write(cmd.sender, err.c_str(), err.length());
+                        sendTo(cmd.sender, err.c_str(), err.length());
                         continue;
                     }
                     int reqTurn=getArgument(cmd.cmd, 5);
                     if(reqTurn==-1){
                         std::string err="Invalid argument.\n";
-                        write(cmd.sender, err.c_str(), err.length());
+                        sendTo(cmd.sender, err.c_str(), err.length());
                         continue;
                     }
                     if(reqTurn==turnNum){
                         if(i==currentPlayer){
                             if(hands.at(currentPlayer).size()>0){
-                                table.at(currentPlayer).push_back(hands.at(currentPlayer).at(0));
-                                hands.at(currentPlayer).erase(hands.at(currentPlayer).begin()+0);
+                                table.at(currentPlayer).push_back(hands.at(currentPlayer).front());
+                                hands.at(currentPlayer).pop_front();
                             }
                             turnNum++;
                             currentPlayer=(currentPlayer+1)%playerCount;
-                            timeout=0;
-                            timer=time(NULL);
+                            deadline=turnClock::now()+std::chrono::seconds(timeoutLen);
 
                             // --- BROADCAST NEW GAME STATE AFTER DRAW ---
-                            std::string state = describeState(turnNum, playerCount, currentPlayer, gameRoom, players, hands, table);
-                            for (int p = 0; p < playerCount; p++) {
-                                write(players[p].fd, state.c_str(), state.length());
-                            }
+                            broadcastState(sent, turnNum, playerCount, currentPlayer, gameRoom, players, hands, table);
 
                         }
                         else{
                             std::string err="Not your turn.\n";
-                            write(cmd.sender, err.c_str(), err.length());
+                            sendTo(cmd.sender, err.c_str(), err.length());
                             continue;
                         }
                     }
                     else{
                         std::string err="Current turn is."+std::to_string(turnNum)+"\n";
-                        write(cmd.sender, err.c_str(), err.length());
+                        sendTo(cmd.sender, err.c_str(), err.length());
                         continue;
                     }
                 }
@@ -505,13 +908,13 @@ void gameRunner(long roomId){
                     }
                     if(!found){
                         std::string err="Spectators can't play.\n";
-                        write(cmd.sender, err.c_str(), err.length());
+                        sendTo(cmd.sender, err.c_str(), err.length());
                         continue;
                     }
                     int reqTurn=getArgument(cmd.cmd, 5);
                     if(reqTurn==-1){
                         std::string err="Invalid argument.\n";
-                        write(cmd.sender, err.c_str(), err.length());
+                        sendTo(cmd.sender, err.c_str(), err.length());
                         continue;
                     }
                     if(reqTurn==turnNum){
@@ -529,88 +932,70 @@ void gameRunner(long roomId){
                         }
                         if(opps.empty()){
                             for(int j=0; j<playerCount; j++){
-                                for(card opC : table.at(j)){
-                                    hands.at(i).push_back(opC);
-                                }
+                                hands.at(i).insert(hands.at(i).end(), table.at(j).begin(), table.at(j).end());
                                 table.at(j).clear();
                             }
-                            for(card opC : pub){
-                                hands.at(i).push_back(opC);
-                            }
+                            hands.at(i).insert(hands.at(i).end(), pub.begin(), pub.end());
                             pub.clear();
                             std::string mesg="You made a mistake. Take all the cards :)\n";
-                            write(cmd.sender, mesg.c_str(), mesg.length());
+                            sendTo(cmd.sender, mesg.c_str(), mesg.length());
                         }
                         else{
                             for(unsigned int j=0; j<table.at(i).size(); j++){
                                 hands.at(opps.at(j%opps.size())).push_back(table.at(i).at(j));
                             }
                             for(int j : opps){
-                                for(card c : table.at(j)){
-                                    hands.at(j).push_back(c);
-                                }
+                                hands.at(j).insert(hands.at(j).end(), table.at(j).begin(), table.at(j).end());
                                 table.at(j).clear();
                             }
                             table.at(i).clear();
                             std::string mesg="You win the fight.\n";
-                            write(cmd.sender, mesg.c_str(), mesg.length());
+                            sendTo(cmd.sender, mesg.c_str(), mesg.length());
                             mesg="You lost a fight- take cards from the winner.\n";
                             for(int j : opps){
-                                write(players[j].fd, mesg.c_str(), mesg.length());
+                                sendTo(players[j].fd, mesg.c_str(), mesg.length());
                             }
 
                             if((hands.at(i).empty())&&(table.at(i).empty())){
                                 //wygrana
                                 end=true;
                                 mesg="You won the game!\n";
-                                write(cmd.sender, mesg.c_str(), mesg.length());
+                                sendTo(cmd.sender, mesg.c_str(), mesg.length());
                                 mesg="You lost the game.\n";
                                 for(int j=0; j<playerCount; j++){
                                     if(j==i)continue;
-                                    write(players[j].fd, mesg.c_str(), mesg.length());
+                                    sendTo(players[j].fd, mesg.c_str(), mesg.length());
                                 }
                             }
                         }
                     }
                     else{
                         std::string err="Current turn is."+std::to_string(turnNum)+"\n";
-                        write(cmd.sender, err.c_str(), err.length());
+                        sendTo(cmd.sender, err.c_str(), err.length());
                         continue;
                     }
 
                     // --- BROADCAST NEW GAME STATE AFTER GRAB (ONLY IF GAME NOT ENDED) ---
                     if (!end) {
-                        std::string state = describeState(turnNum, playerCount, currentPlayer, gameRoom, players, hands, table);
-                        
-                        for (int p = 0; p < playerCount; p++) {
-                            write(players[p].fd, state.c_str(), state.length());
-                        }
+                        broadcastState(sent, turnNum, playerCount, currentPlayer, gameRoom, players, hands, table);
                     }
 
                 }
             }
         }
         else{
-            time_t last=timer;
-            timer=time(NULL);
-            timeout+=timer-last;
-            if((timeout>=30)&&(playerCount!=0)){
+            // timed_receive wraca bez wiadomości dopiero po upływie terminu
+            if(playerCount!=0){
                 //wystaw mu karte
                 if(hands.at(currentPlayer).size()>0){
-                    table.at(currentPlayer).push_back(hands.at(currentPlayer).at(0));
-                    hands.at(currentPlayer).erase(hands.at(currentPlayer).begin()+0);
+                    table.at(currentPlayer).push_back(hands.at(currentPlayer).front());
+                    hands.at(currentPlayer).pop_front();
                 }
                 turnNum++;
                 currentPlayer=(currentPlayer+1)%playerCount;
-                timeout=0;
-                timer=time(NULL);
-                std::string state = describeState(turnNum, playerCount, currentPlayer, gameRoom, players, hands, table);
-                        
-                for (int p = 0; p < playerCount; p++) {
-                    write(players[p].fd, state.c_str(), state.length());
-                }
+                broadcastState(sent, turnNum, playerCount, currentPlayer, gameRoom, players, hands, table);
             }
-            usleep(50000);
+            deadline=turnClock::now()+std::chrono::seconds(timeoutLen);
         }
     }
 
@@ -618,6 +1003,494 @@ void gameRunner(long roomId){
 }
 
 
+// komendy lobby (create/join/spectate/start/leave) i przekazywanie komend gry do kolejki pokoju
+// zwraca true, gdy komenda poszła do kolejki pokoju i jej czas zapisze gameRunner
+bool handleCommand(message &cmd, unsigned int prio, clientVector* clients, roomVector* rooms, named_mutex& client_mutex, roomLocks& room_locks, alloc& allocInst){
+    bool queued=false;
+    if(prio==0){
+        if(strncmp(cmd.cmd, "leave", 5)==0){
+            int roomId=-1;
+            client_mutex.lock();
+            int clientIndex=findClient(cmd.sender);
+            if(clientIndex!=-1){
+                if(clients->at(clientIndex).roomId!=-1){
+                    roomId=clients->at(clientIndex).roomId;
+                    clients->at(clientIndex).roomId=-1;
+                }
+                else sendTo(cmd.sender, "Currently not in a room.", 25);
+            }
+            client_mutex.unlock();
+            if(roomId!=-1){
+                roomLock room_lock(room_locks, roomId);
+                room_lock.lock();
+                bool found=false;
+                bool empty=false;
+                unsigned int players=0;
+                int i=findRoom(roomId);
+                if(i!=-1){
+                    for(int j=0; j<8; j++){
+                        if(rooms->at(i).players[j].fd==cmd.sender){
+                            rooms->at(i).players[j].fd=-1;
+                            found=true;
+                        }
+                        if(rooms->at(i).players[j].fd!=-1)players++;
+                    }
+                    if(!found)rooms->at(i).spectatorCount--;
+                    if(rooms->at(i).state==INPROGRESS)sendToRoom(roomId, cmd);
+                    empty=(players==0)&&(rooms->at(i).spectatorCount==0);
+                }
+                room_lock.unlock();
+                // usunięcie pokoju zmienia wektor - potrzebna wyłączna blokada, a w międzyczasie ktoś mógł dołączyć
+                if(empty){
+                    room_locks.table.lock();
+                    i=findRoom(roomId);
+                    if(i!=-1){
+                        unsigned int present=rooms->at(i).spectatorCount;
+                        for(int j=0; j<8; j++){
+                            if(rooms->at(i).players[j].fd!=-1)present++;
+                        }
+                        if(present==0)removeRoom(rooms, i);
+                    }
+                    room_locks.table.unlock();
+                }
+                notifyLobby(roomId, client_mutex, room_locks, clients, rooms);
+            }
+        }
+        if(strncmp(cmd.cmd, "create ", 6)==0){
+            client_mutex.lock();
+            int clientIndex=findClient(cmd.sender);
+            if(clientIndex==-1){
+                client_mutex.unlock();
+                return false;
+            }
+            bool found=(clients->at(clientIndex).roomId!=-1);
+            if(found){
+                client_mutex.unlock();
+                sendTo(cmd.sender, "Already in a room.\n", 20);
+                return false;
+            };
+            int roomId=getArgument(cmd.cmd, 7);
+            if(roomId==-1){
+                client_mutex.unlock();
+                sendTo(cmd.sender, "Invalid argument.", 18);
+                return false;
+            }
+            room_locks.table.lock();
+            if(rooms->size()>=rooms->capacity()){
+                client_mutex.unlock();
+                room_locks.table.unlock();
+                const char* msg="Room limit reached, try again later.\n";
+                sendTo(cmd.sender, msg, strlen(msg));
+                return false;
+            }
+            if(findRoom(roomId)!=-1){
+                client_mutex.unlock();
+                room_locks.table.unlock();
+                std::string err="Room "+std::to_string(roomId)+" already exists\n";
+                sendTo(cmd.sender, err.c_str(), err.length());
+                return false;
+            }
+            room temp(allocInst);
+            temp.id=roomId;
+            temp.joinTimes[0]=time(NULL);
+            clients->at(clientIndex).roomId=roomId;
+            temp.players[0]=clients->at(clientIndex);
+            addRoom(rooms, temp);
+            room_locks.table.unlock();
+            client_mutex.unlock();
+            notifyLobby(roomId, client_mutex, room_locks, clients, rooms);
+        }
+        if(strncmp(cmd.cmd, "join ", 5)==0){
+            client_mutex.lock();
+            bool started=false;
+            int clientIndex=findClient(cmd.sender);
+            if(clientIndex==-1){
+                client_mutex.unlock();
+                return false;
+            }
+            bool found=(clients->at(clientIndex).roomId!=-1);
+            if(found){
+                client_mutex.unlock();
+                sendTo(cmd.sender, "Already in a room.\n", 20);
+                return false;
+            }
+            int roomId=getArgument(cmd.cmd, 5);
+            if(roomId==-1){
+                client_mutex.unlock();
+                sendTo(cmd.sender, "Invalid argument.", 18);
+                return false;
+            }
+            roomLock room_lock(room_locks, roomId);
+            room_lock.lock();
+            int roomIndex=findRoom(roomId);
+            int free=0;
+            if(roomIndex!=-1){
+                if(rooms->at(roomIndex).state==INPROGRESS)started=true;
+                for(int j=0; j<8; j++){
+                    if(rooms->at(roomIndex).players[j].fd==-1)free++;
+                }
+            }
+            if(roomIndex==-1){
+                room_lock.unlock();
+                client_mutex.unlock();
+                std::string err="Room "+std::to_string(roomId)+" doesn't exist.\n";
+                sendTo(cmd.sender, err.c_str(), err.length());
+                return false;
+            }
+            if(free==0){
+                room_lock.unlock();
+                client_mutex.unlock();
+                std::string err="Room "+std::to_string(roomId)+" is full.\n";
+                sendTo(cmd.sender, err.c_str(), err.length());
+                return false;
+            }
+            if(started){
+                room_lock.unlock();
+                client_mutex.unlock();
+                std::string err="Room "+std::to_string(roomId)+" has already started playing. "+
+                    "Consider spectating instead.\n";
+                sendTo(cmd.sender, err.c_str(), err.length());
+                return false;
+            }
+            clients->at(clientIndex).roomId=roomId;
+            for(int j=0; j<8; j++){
+                if(rooms->at(roomIndex).players[j].fd==-1){
+                    rooms->at(roomIndex).players[j]=clients->at(clientIndex);
+                    rooms->at(roomIndex).joinTimes[j]=time(NULL);
+                    break;
+                }
+            }
+            room_lock.unlock();
+            client_mutex.unlock();
+            notifyLobby(roomId, client_mutex, room_locks, clients, rooms);
+
+        }
+        if(strncmp(cmd.cmd, "spectate ", 9)==0){
+            client_mutex.lock();
+            int clientIndex=findClient(cmd.sender);
+            if(clientIndex==-1){
+                client_mutex.unlock();
+                return false;
+            }
+            bool found=(clients->at(clientIndex).roomId!=-1);
+            if(found){
+                client_mutex.unlock();
+                sendTo(cmd.sender, "Already in a room.\n", 20);
+                return false;
+            }
+            int roomId=getArgument(cmd.cmd, 9);
+            if(roomId==-1){
+                client_mutex.unlock();
+                sendTo(cmd.sender, "Invalid argument.", 18);
+                return false;
+            }
+            roomLock room_lock(room_locks, roomId);
+            room_lock.lock();
+            int roomIndex=findRoom(roomId);
+            if(roomIndex==-1){
+                room_lock.unlock();
+                client_mutex.unlock();
+                std::string err="Room "+std::to_string(roomId)+" doesn't exist.\n";
+                sendTo(cmd.sender, err.c_str(), err.length());
+                return false;
+            }
+            clients->at(clientIndex).roomId=roomId;
+            rooms->at(roomIndex).spectatorCount++;
+            if(rooms->at(roomIndex).state==INPROGRESS)sendToRoom(roomId, cmd);
+            room_lock.unlock();
+            client_mutex.unlock();
+            notifyLobby(roomId, client_mutex, room_locks, clients, rooms);
+        }
+        if(strncmp(cmd.cmd, "start", 5)==0){
+            client_mutex.lock();
+            int clientIndex=findClient(cmd.sender);
+            int roomId=(clientIndex==-1) ? -1 : clients->at(clientIndex).roomId;
+            if(roomId==-1){
+                client_mutex.unlock();
+                sendTo(cmd.sender, "Not in a room.\n", 16);
+                return false;
+            }
+            roomLock room_lock(room_locks, roomId);
+            room_lock.lock();
+            int roomIndex=findRoom(roomId);
+            bool allowed=false;
+            unsigned int pCount=0;
+            bool idle=false;
+            if(roomIndex!=-1){
+                room& r=rooms->at(roomIndex);
+                if(r.state==IDLE)idle=true;
+                int j=0;
+                for(int k=0; k<8; k++){
+                    if(r.players[k].fd!=-1)pCount++;
+                    if(r.players[k].fd==cmd.sender)j=k;
+                }
+                time_t min=time(NULL);
+                int minInd = -1;
+                for(int k=0; k<8; k++){
+                    if (r.players[k].fd == -1)
+                        continue;
+
+                    if (minInd == -1 || r.joinTimes[k] < min) {
+                        min = r.joinTimes[k];
+                        minInd = k;
+                    }
+                }
+                if((j==minInd)&&(pCount>=2))allowed=true;
+            }
+            if(roomIndex==-1){
+                room_lock.unlock();
+                client_mutex.unlock();
+                std::string err="Room "+std::to_string(roomId)+" doesn't exist.\n";
+                sendTo(cmd.sender, err.c_str(), err.length());
+                return false;
+            }
+            if(!allowed){
+                room_lock.unlock();
+                client_mutex.unlock();
+                std::string err="You don't have permission to start a game in room "+
+                    std::to_string(roomId)+" or there are less than 2 players.\n";
+                sendTo(cmd.sender, err.c_str(), err.length());
+                return false;
+            }
+            if(!idle){
+                room_lock.unlock();
+                client_mutex.unlock();
+                return false;
+            }
+            rooms->at(roomIndex).state=INPROGRESS;
+            std::string qName="TotemRoom"+std::to_string(roomId);
+            message_queue::remove(qName.c_str());
+            // kolejka istnieje zanim ktokolwiek (też leave/spectate) spróbuje do niej pisać
+            message_queue(create_only, qName.c_str(), 100, sizeof(message));
+            std::thread(gameRunner, roomId, std::ref(room_locks)).detach();
+
+            room_lock.unlock();
+            client_mutex.unlock();
+            notifyLobby(roomId, client_mutex, room_locks, clients, rooms);
+        }
+    }
+    else{
+        //przekaż do kolejki pokoju, w którym znajduje się nadawca
+        client_mutex.lock();
+        int clientIndex=findClient(cmd.sender);
+        int roomId=(clientIndex==-1) ? -1 : clients->at(clientIndex).roomId;
+        if(roomId==-1){
+            client_mutex.unlock();
+            sendTo(cmd.sender, "Not in a, room.\n", 16);
+            return false;
+        }
+        roomLock room_lock(room_locks, roomId);
+        room_lock.lock();
+        int roomIndex=findRoom(roomId);
+        if(roomIndex==-1){
+            room_lock.unlock();
+            client_mutex.unlock();
+            std::string err="Room "+std::to_string(roomId)+" doesn't exist.\n";
+            sendTo(cmd.sender, err.c_str(), err.length());
+            return false;
+        }
+        roomState state=rooms->at(roomIndex).state;
+        if((strncmp(cmd.cmd, "refresh", 7)==0)&&(state==IDLE)){
+            room temp=rooms->at(roomIndex);
+            std::string roomDesc=describeRoom(&temp);
+            sendTo(cmd.sender, roomDesc.c_str(), roomDesc.length());
+        }
+        else{
+            if(state==INPROGRESS)queued=sendToRoom(roomId, cmd, true);
+        }
+        room_lock.unlock();
+        client_mutex.unlock();
+    }
+    return queued;
+}
+
+// stan połączenia trzymany przez pętlę epoll (zamiast lokalnych zmiennych wątku)
+struct connection{
+    sockaddr_in address;
+    std::string inputBuffer;
+    bool alreadySet;
+    int proto;
+};
+
+// jedna pełna linia od klienta: nick albo komenda
+void handleLine(int clientSocket, connection &conn, std::string &line, clientVector* clients, roomVector* rooms, named_mutex& client_mutex, roomLocks& room_locks, alloc& allocInst){
+    message cmd;
+    cmd.received = statNow();
+
+    //DEBUG
+    printf("[DEBUG] From %s: line='%s', len=%zu\n",
+        inet_ntoa(conn.address.sin_addr),
+        line.c_str(),
+        line.length());
+
+    // --------- NICKNAME ---------
+
+    if (!conn.alreadySet) {
+        std::string nick = line;
+
+        if (nick.length() < 3 || nick.length() > 16) {
+            const char* msg = "Nickname must be between 3 and 16 characters\n";
+            sendTo(clientSocket, msg, strlen(msg));
+            return;
+        }
+
+        //DEBUG
+        printf("[DEBUG] Nick attempt from %s: '%s' (len=%zu)\n",
+            inet_ntoa(conn.address.sin_addr),
+            nick.c_str(),
+            nick.length());
+
+        client_mutex.lock();
+        int clientIndex = findClient(clientSocket);
+        if (clientIndex == -1) {
+            client_mutex.unlock();
+            return;
+        }
+        if (clients->at(clientIndex).nick != "") conn.alreadySet = true;
+        bool available = !nickTaken(nick);
+
+        if (conn.alreadySet) {
+            const char* msg = "Nickname already set\n";
+            sendTo(clientSocket, msg, strlen(msg));
+            client_mutex.unlock();
+            return;
+        }
+
+        if (available) {
+            setNick(clients, clientIndex, nick);
+            const char* ok =
+                "Nickname set successfully.\n"
+                "Available commands: list, create roomId, join roomId, spectate roomId, start, "
+                "draw turnNum, grab turnNum, refresh, leave, memory, stats\n";
+            sendTo(clientSocket, ok, strlen(ok));
+            conn.alreadySet = true;
+        } else {
+            const char* msg = "Nickname unavailable, choose another.\n";
+            sendTo(clientSocket, msg, strlen(msg));
+        }
+
+        client_mutex.unlock();
+    }
+
+    // --------- KOMENDY ---------
+
+    else {
+        std::string cmdStr = line;
+
+        cmd.sender = clientSocket;
+        cmd.proto = conn.proto;
+        memset(cmd.cmd, '\0', 50);
+        if (snprintf(cmd.cmd, 50, "%s", cmdStr.c_str()) >= (int)sizeof(cmd.cmd)) {
+            const char* msg = "Command too long.\n";
+            sendTo(clientSocket, msg, strlen(msg));
+            return;
+        }
+
+        // subscribe lobby / unsubscribe lobby
+        if (cmdStr == "subscribe lobby" || cmdStr == "unsubscribe lobby") {
+            bool subscribe = (cmdStr[0] == 's');
+            client_mutex.lock();
+            int clientIndex = findClient(clientSocket);
+            if (clientIndex != -1) {
+                if (subscribe) lobbySubscribers.insert(clientSocket);
+                else lobbySubscribers.erase(clientSocket);
+            }
+            client_mutex.unlock();
+            const char* msg = subscribe ? "Subscribed to lobby updates.\n" : "Unsubscribed from lobby updates.\n";
+            sendTo(clientSocket, msg, strlen(msg));
+        }
+        // protocol N - negocjacja formatu stanu gry, tylko poza pokojem
+        else if (cmdStr.rfind("protocol ", 0) == 0) {
+            int requested = getArgument(cmdStr.c_str(), 9);
+            std::string msg;
+            if (requested < PROTO_TEXT || requested > PROTO_DELTA) {
+                msg = "Unsupported protocol.\n";
+            } else {
+                bool inRoom = false;
+                client_mutex.lock();
+                int clientIndex = findClient(clientSocket);
+                if (clientIndex != -1) {
+                    inRoom = (clients->at(clientIndex).roomId != -1);
+                    if (!inRoom) clients->at(clientIndex).proto = requested;
+                }
+                client_mutex.unlock();
+                if (inRoom) {
+                    msg = "Protocol can only be changed outside a room.\n";
+                } else {
+                    conn.proto = requested;
+                    msg = "Protocol " + std::to_string(conn.proto) + " enabled.\n";
+                }
+            }
+            sendTo(clientSocket, msg.c_str(), msg.length());
+        }
+        // memory - zajętość segmentu pamięci współdzielonej
+        else if (cmdStr == "memory") {
+            client_mutex.lock();
+            std::string msg = describeMemory(clients, rooms);
+            client_mutex.unlock();
+            sendTo(clientSocket, msg.c_str(), msg.length());
+        }
+        // stats - liczniki, głębokości kolejek i histogramy opóźnień
+        else if (cmdStr == "stats") {
+            std::string msg = describeStats(client_mutex, room_locks, clients, rooms);
+            sendTo(clientSocket, msg.c_str(), msg.length());
+        }
+        // list
+        else if (cmdStr.rfind("list", 0) == 0) {   // starts_with "list"
+            sendLobbySnapshot(clientSocket, room_locks, rooms);
+            stats.latency[ST_LIST].add(statNow() - cmd.received);
+        }
+        else {
+            // create / join / start / leave - priorytet 0
+            if (cmdStr.rfind("create ", 0) == 0 ||
+                cmdStr.rfind("join ",   0) == 0 ||
+                cmdStr.rfind("start",   0) == 0 ||
+                cmdStr.rfind("leave",   0) == 0 ||
+                cmdStr.rfind("spectate",   0) == 0)
+            {
+                handleCommand(cmd, 0, clients, rooms, client_mutex, room_locks, allocInst);
+                stats.latency[statKind(cmd.cmd)].add(statNow() - cmd.received);
+            }
+            // draw / grab / refresh - priorytet 1
+            else if (cmdStr.rfind("draw ",    0) == 0 ||
+                     cmdStr.rfind("grab ",    0) == 0 ||
+                     cmdStr.rfind("refresh", 0) == 0)
+            {
+                // wysłane do pokoju mierzy gameRunner, tu tylko odpowiedzi udzielone od razu
+                if (!handleCommand(cmd, 1, clients, rooms, client_mutex, room_locks, allocInst))
+                    stats.latency[statKind(cmd.cmd)].add(statNow() - cmd.received);
+            }
+            else {
+                const char* msg = "Unrecognized command.\n";
+                sendTo(clientSocket, msg, strlen(msg));
+            }
+        }
+    }
+}
+
+// klient się rozłączył -> "leave" i usunięcie ze wspólnej listy; samo close() dopiero po chwili,
+// żeby gameRunner nie pisał do deskryptora przydzielonego już nowemu klientowi
+void dropConnection(int clientSocket, connection &conn, clientVector* clients, roomVector* rooms, named_mutex& client_mutex, roomLocks& room_locks, alloc& allocInst){
+    message cmd;
+    cmd.sender = clientSocket;
+    cmd.proto = conn.proto;
+    memset(cmd.cmd, '\0', 50);
+    sprintf(cmd.cmd, "leave");
+    handleCommand(cmd, 0, clients, rooms, client_mutex, room_locks, allocInst);
+
+    client_mutex.lock();
+    int i = findClient(clientSocket);
+    if (i != -1) {
+        printf("Client %s timed out.\n",
+               clients->at(i).nick.c_str()[0] ? clients->at(i).nick.c_str() : "unnamed");
+        removeClient(clients, i);
+    }
+    client_mutex.unlock();
+
+    shutdown(clientSocket, SHUT_RDWR);
+    dropOutput(clientSocket);
+}
+
 bool running=true;
 void terminator(int signum) {
    printf("Terminating due to signal %d...\n", signum);
@@ -628,10 +1501,20 @@ void terminator(int signum) {
 int main(int argc, char** argv){
     if(argc<2){
         printf("Enter port number as an argument.\n");
+        printf("Usage: %s <port> [capacity, default %d]\n", argv[0], DEFAULT_CAPACITY);
         return 10;
     }
+    int capacity=DEFAULT_CAPACITY;
+    if(argc>=3){
+        capacity=getArgument(argv[2], 0);
+        if(capacity<=0){
+            printf("Capacity must be a positive number of clients.\n");
+            return 10;
+        }
+    }
 
     signal(SIGINT, terminator);
+    signal(SIGPIPE, SIG_IGN);
     addrinfo hints{};
     hints.ai_flags=AI_PASSIVE;
     hints.ai_family=AF_INET;
@@ -648,7 +1531,7 @@ int main(int argc, char** argv){
     const int one = 1;
     setsockopt(sock, SOL_SOCKET, SO_REUSEADDR, &one, sizeof(one));
     bind(sock, resolved->ai_addr, resolved->ai_addrlen);
-    listen(sock, 5);
+    listen(sock, SOMAXCONN);
     fcntl(sock, F_SETFL, (fcntl(sock, F_GETFL)|O_NONBLOCK));
 
     struct shm_remove{
@@ -659,408 +1542,120 @@ int main(int argc, char** argv){
         cl_mutex_remove() { named_mutex::remove(clMut); }
         ~cl_mutex_remove(){ named_mutex::remove(clMut); }
     } clientMutexRemover;
-    struct rm_mutex_remove{
-        rm_mutex_remove() { named_mutex::remove(rmMut); }
-        ~rm_mutex_remove(){ named_mutex::remove(rmMut); }
-    } roomMutexRemover;
-    message_queue::remove(MQ_NAME);
-    message_queue mq(create_only, MQ_NAME, 100, sizeof(message));
     named_mutex client_mutex(create_only, clMut);
-    named_mutex room_mutex(create_only, rmMut);
-    managed_shared_memory segment(create_only, shm, 65536);
+    // static: odłączone wątki gameRunner trzymają referencję także wtedy, gdy main już się kończy
+    static roomLocks room_locks;
+    managed_shared_memory segment(create_only, shm, segmentSize(capacity));
     alloc allocInst(segment.get_segment_manager());
     clientVector* clients=segment.construct<clientVector>("clients")(clientAlloc(segment.get_segment_manager()));
     roomVector* rooms=segment.construct<roomVector>("rooms")(roomAlloc(segment.get_segment_manager()));
+    // cała pojemność od razu - wektory nie realokują się (i nie potrzebują drugiej kopii) pod obciążeniem
+    clients->reserve(capacity);
+    rooms->reserve(capacity);
+    printf("Capacity %d clients. %s", capacity, describeMemory(clients, rooms).c_str());
     
 
-    while(running){
-        sockaddr_in clientAddr;
-        socklen_t clientAddrLen=sizeof(clientAddr);
-        int clientSock=accept(sock, (sockaddr*)&clientAddr, &clientAddrLen);
-        if (clientSock != -1) {
-            client_mutex.lock();
-            clients->emplace_back(clientSock, -1, "", allocInst);
-            client_mutex.unlock();
+    int epfd = epoll_create1(0);
+    output.epfd = epfd;
+    epoll_event ev{};
+    ev.events = EPOLLIN;
+    ev.data.fd = sock;
+    epoll_ctl(epfd, EPOLL_CTL_ADD, sock, &ev);
+    std::unordered_map<int, connection> connections;
+    // zamknięte połączenia czekają chwilę na close() (patrz dropConnection)
+    std::vector<std::pair<int, time_t>> closing;
+    epoll_event events[64];
+    char buff[buff_size];
 
-            std::thread(handleComms, clientSock, clientAddr).detach();
+    while(running){
+        int ready = epoll_wait(epfd, events, 64, closing.empty() ? -1 : 1000);
+        if (ready == -1) {
+            if (errno == EINTR) continue;
+            perror("epoll_wait");
+            break;
         }
-        else{
-            message cmd;
-            unsigned int prio;
-            message_queue::size_type recSize;
-            if(mq.try_receive(&cmd, sizeof(cmd), recSize, prio)){
-                if(prio==0){
-                    if(strncmp(cmd.cmd, "leave", 5)==0){
-                        int roomId=-1;
-                        client_mutex.lock();
-                        for(unsigned int i=0; i<clients->size(); i++){
-                            if(clients->at(i).fd==cmd.sender){
-                                if(clients->at(i).roomId!=-1){
-                                    roomId=clients->at(i).roomId;
-                                    clients->at(i).roomId=-1;
-                                }
-                                else write(cmd.sender, "Currently not in a room.", 25);
-                                break;
-                            }
-                        }
-                        client_mutex.unlock();
-                        if(roomId!=-1){
-                            room_mutex.lock();
-                            bool found=false;
-                            unsigned int players=0;
-                            unsigned int i;
-                            std::string qName="TotemRoom"+std::to_string(roomId);
-                            for(i=0; i<rooms->size(); i++){
-                                if(rooms->at(i).id==roomId){
-                                    for(int j=0; j<8; j++){
-                                        if(rooms->at(i).players[j].fd==cmd.sender){
-                                            rooms->at(i).players[j].fd=-1;
-                                            found=true;
-                                        }
-                                        if(rooms->at(i).players[j].fd!=-1)players++;
-                                    }
-                                    if(!found)rooms->at(i).spectatorCount--;
-                                    if(rooms->at(i).state==INPROGRESS){
-                                        message_queue roomQ(open_only, qName.c_str());
-                                        roomQ.send(&cmd, sizeof(cmd), 1);
-                                    }
-                                    break;
-                                }
-                            }
-                            if((players==0)&&(rooms->at(i).spectatorCount==0)){
-                                rooms->erase(rooms->begin()+i);
-                            }
-                            room_mutex.unlock();
-                        }
-                    }
-                    if(strncmp(cmd.cmd, "create ", 6)==0){
-                        client_mutex.lock();
-                        bool found=false;
-                        unsigned int clientIndex;
-                        for(unsigned int i=0; i<clients->size(); i++){
-                            if(clients->at(i).fd==cmd.sender){
-                                clientIndex=i;
-                                if(clients->at(i).roomId!=-1)found=true;
-                                break;
-                            }
-                        }
-                        if(found){
-                            client_mutex.unlock();
-                            write(cmd.sender, "Already in a room.\n", 20);
-                            continue;
-                        };
-                        int roomId=getArgument(cmd.cmd, 7);
-                        if(roomId==-1){
-                            client_mutex.unlock();
-                            write(cmd.sender, "Invalid argument.", 18);
-                            continue;
-                        }
-                        room_mutex.lock();
-                        found=false;
-                        for(unsigned int i=0; i<rooms->size(); i++){
-                            if(rooms->at(i).id==roomId){
-                                found=true;
-                                break;
-                            }
-                        }
-                        if(found){
-                            client_mutex.unlock();
-                            room_mutex.unlock();
-                            std::string err="Room "+std::to_string(roomId)+" already exists\n";
-                            write(cmd.sender, err.c_str(), err.length());
-                            continue;
-                        }
-                        room temp(allocInst);
-                        temp.id=roomId;
-                        temp.joinTimes[0]=time(NULL);
-                        clients->at(clientIndex).roomId=roomId;
-                        temp.players[0]=clients->at(clientIndex);
-                        rooms->push_back(temp);
-                        room_mutex.unlock();
-                        client_mutex.unlock();
-                    }
-                    if(strncmp(cmd.cmd, "join ", 5)==0){
-                        client_mutex.lock();
-                        bool found=false;
-                        bool started=false;
-                        unsigned int clientIndex;
-                        for(unsigned int i=0; i<clients->size(); i++){
-                            if(clients->at(i).fd==cmd.sender){
-                                clientIndex=i;
-                                if(clients->at(i).roomId!=-1)found=true;
-                                break;
-                            }
-                        }
-                        if(found){
-                            client_mutex.unlock();
-                            write(cmd.sender, "Already in a room.\n", 20);
-                            continue;
-                        }
-                        int roomId=getArgument(cmd.cmd, 5);
-                        if(roomId==-1){
-                            client_mutex.unlock();
-                            write(cmd.sender, "Invalid argument.", 18);
-                            continue;
-                        }
-                        room_mutex.lock();
-                        found=false;
-                        unsigned int roomIndex;
-                        int free=0;
-                        for(unsigned int i=0; i<rooms->size(); i++){
-                            if(rooms->at(i).id==roomId){
-                                roomIndex=i;
-                                found=true;
-                                if(rooms->at(i).state==INPROGRESS)started=true;
-                                for(int j=0; j<8; j++){
-                                    if(rooms->at(i).players[j].fd==-1)free++;
-                                }
-                                break;
-                            }
-                        }
-                        if(!found){
-                            room_mutex.unlock();
-                            client_mutex.unlock();
-                            std::string err="Room "+std::to_string(roomId)+" doesn't exist.\n";
-                            write(cmd.sender, err.c_str(), err.length());
-                            continue;
-                        }
-                        if(free==0){
-                            room_mutex.unlock();
-                            client_mutex.unlock();
-                            std::string err="Room "+std::to_string(roomId)+" is full.\n";
-                            write(cmd.sender, err.c_str(), err.length());
-                            continue;
-                        }
-                        if(started){
-                            room_mutex.unlock();
-                            client_mutex.unlock();
-                            std::string err="Room "+std::to_string(roomId)+" has already started playing. "+
-                                "Consider spectating instead.\n";
-                            write(cmd.sender, err.c_str(), err.length());
-                            continue;
-                        }
-                        clients->at(clientIndex).roomId=roomId;
-                        for(int j=0; j<8; j++){
-                            if(rooms->at(roomIndex).players[j].fd==-1){
-                                rooms->at(roomIndex).players[j]=clients->at(clientIndex);
-                                rooms->at(roomIndex).joinTimes[j]=time(NULL);
-                                break;
-                            }
-                        }
-                        room_mutex.unlock();
-                        client_mutex.unlock();
-                        
-                    }
-                    if(strncmp(cmd.cmd, "spectate ", 9)==0){
-                        client_mutex.lock();
-                        bool found=false;
-                        unsigned int clientIndex;
-                        for(unsigned int i=0; i<clients->size(); i++){
-                            if(clients->at(i).fd==cmd.sender){
-                                clientIndex=i;
-                                if(clients->at(i).roomId!=-1)found=true;
-                                break;
-                            }
-                        }
-                        if(found){
-                            client_mutex.unlock();
-                            write(cmd.sender, "Already in a room.\n", 20);
-                            continue;
-                        }
-                        int roomId=getArgument(cmd.cmd, 9);
-                        if(roomId==-1){
-                            client_mutex.unlock();
-                            write(cmd.sender, "Invalid argument.", 18);
-                            continue;
-                        }
-                        room_mutex.lock();
-                        found=false;
-                        unsigned int roomIndex;
-                        for(unsigned int i=0; i<rooms->size(); i++){
-                            if(rooms->at(i).id==roomId){
-                                roomIndex=i;
-                                found=true;
-                                break;
-                            }
-                        }
-                        if(!found){
-                            room_mutex.unlock();
-                            client_mutex.unlock();
-                            std::string err="Room "+std::to_string(roomId)+" doesn't exist.\n";
-                            write(cmd.sender, err.c_str(), err.length());
-                            continue;
-                        }
-                        clients->at(clientIndex).roomId=roomId;
-                        rooms->at(roomIndex).spectatorCount++;
-                        if(rooms->at(roomIndex).state==INPROGRESS){
-                            std::string qName="TotemRoom"+std::to_string(roomId);
-                            message_queue roomQ(open_only, qName.c_str());
-                            roomQ.send(&cmd, sizeof(cmd), 1);
-                        }
-                        room_mutex.unlock();
-                        client_mutex.unlock();
-                    }
-                    if(strncmp(cmd.cmd, "start", 5)==0){
-                        client_mutex.lock();
-                        bool found=false;
-                        int roomId;
-                        for(unsigned int i=0; i<clients->size(); i++){
-                            if(clients->at(i).fd==cmd.sender){
-                                roomId=clients->at(i).roomId;
-                                if(roomId!=-1)found=true;
-                                break;
-                            }
-                        }
-                        if(!found){
-                            client_mutex.unlock();
-                            write(cmd.sender, "Not in a room.\n", 16);
-                            continue;
-                        }
-                        room_mutex.lock();
-                        found=false;
-                        unsigned int roomIndex;
-                        bool allowed=false;
-                        unsigned int pCount=0;
-                        bool idle=false;
-                        for(unsigned int i=0; i<rooms->size(); i++){
-                            if(rooms->at(i).id==roomId){
-                                roomIndex=i;
-                                found=true;
-                                if(rooms->at(i).state==IDLE)idle=true;
-                                int j=0;
-                                for(int k=0; k<8; k++){
-                                    if(rooms->at(i).players[k].fd!=-1)pCount++;
-                                    if(rooms->at(i).players[k].fd==cmd.sender)j=k;
-                                }
-                                time_t min=time(NULL);
-                                int minInd = -1;
-                                for(int k=0; k<8; k++){
-                                    if (rooms->at(i).players[k].fd == -1)
-                                        continue;
-
-                                    if (rooms->at(i).joinTimes[k] < min) {
-                                        min = rooms->at(i).joinTimes[k];
-                                        minInd = k;
-                                    }
-                                }
-                                if((j==minInd)&&(pCount>=2))allowed=true;
-                                break;
-                            }
-                        }
-                        if(!found){
-                            room_mutex.unlock();
-                            client_mutex.unlock();
-                            std::string err="Room "+std::to_string(roomId)+" doesn't exist.\n";
-                            write(cmd.sender, err.c_str(), err.length());
-                            continue;
-                        }
-                        if(!allowed){
-                            room_mutex.unlock();
-                            client_mutex.unlock();
-                            std::string err="You don't have permission to start a game in room "+
-                                std::to_string(roomId)+" or there are less than 2 players.\n";
-                            write(cmd.sender, err.c_str(), err.length());
-                            continue;
-                        }
-                        if(!idle){
-                            room_mutex.unlock();
-                            client_mutex.unlock();
-                            continue;
-                        }
-                        rooms->at(roomIndex).state=INPROGRESS;
-                        std::string qName="TotemRoom"+std::to_string(roomId);
-                        message_queue::remove(qName.c_str());
-                        std::thread(gameRunner, roomId).detach();
-
-                        // retry-loop: czekamy aż gameRunner utworzy kolejkę
-                        message_queue* roomQptr = nullptr;
-                        for (int tries = 0; tries < 20; tries++) {
-                            try {
-                                roomQptr = new message_queue(open_only, qName.c_str());
-                                break;
-                            } catch (...) {
-                                usleep(50000); // 50 ms
-                            }
-                        }
-                        if (!roomQptr) {
-                            printf("[ERROR] Could not open room queue after start!\n");
-                        } else {
-                            message r;
-                            r.sender = -1;
-                            strcpy(r.cmd, "refresh");
-                            roomQptr->send(&r, sizeof(r), 1);
-                            delete roomQptr;
-                        }
-
-                        room_mutex.unlock();
-                        client_mutex.unlock();
-                    }
-                }
-                else{
-                    //przekaż do kolejki pokoju, w którym znajduje się nadawca
+        for (int e = 0; e < ready; e++) {
+            int fd = events[e].data.fd;
+            if (fd == sock) {
+                while (true) {
+                    sockaddr_in clientAddr;
+                    socklen_t clientAddrLen=sizeof(clientAddr);
+                    // nieblokujące jak gniazdo nasłuchujące - zapisy idą przez sendParts
+                    int clientSock=accept4(sock, (sockaddr*)&clientAddr, &clientAddrLen, SOCK_NONBLOCK);
+                    if (clientSock == -1) break;
                     client_mutex.lock();
-                    bool found=false;
-                    int roomId;
-                    for(unsigned int i=0; i<clients->size(); i++){
-                        if(clients->at(i).fd==cmd.sender){
-                            roomId=clients->at(i).roomId;
-                            if(roomId!=-1)found=true;
-                            break;
-                        }
-                    }
-                    if(!found){
-                        client_mutex.unlock();
-                        write(cmd.sender, "Not in a, room.\n", 16);
-                        continue;
-                    }
-                    room_mutex.lock();
-                    found=false;
-                    unsigned int roomIndex;
-                    roomState state;
-                    for(unsigned int i=0; i<rooms->size(); i++){
-                        if(rooms->at(i).id==roomId){
-                            roomIndex=i;
-                            found=true;
-                            state=rooms->at(i).state;
-                            break;
+                    bool added = false;
+                    if (clients->size() < (unsigned int)capacity) {
+                        try {
+                            addClient(clients, clientSock, allocInst);
+                            added = true;
+                        } catch (interprocess_exception& ex) {
+                            printf("[ERROR] Could not register client: %s\n", ex.what());
                         }
                     }
-                    if(!found){
-                        room_mutex.unlock();
-                        client_mutex.unlock();
-                        std::string err="Room "+std::to_string(roomId)+" doesn't exist.\n";
-                        write(cmd.sender, err.c_str(), err.length());
+                    client_mutex.unlock();
+                    if (!added) {
+                        // odmowa zamiast wyjątku z pełnego segmentu
+                        const char* full = "Server is full, try again later.\n";
+                        write(clientSock, full, strlen(full));
+                        printf("Rejected connection from %s. %s", inet_ntoa(clientAddr.sin_addr), describeMemory(clients, rooms).c_str());
+                        shutdown(clientSock, SHUT_RDWR);
+                        close(clientSock);
                         continue;
                     }
-                    if((strncmp(cmd.cmd, "refresh", 7)==0)&&(state==IDLE)){
-                        room temp=rooms->at(roomIndex);
-                        std::string roomDesc=describeRoom(&temp);
-                        write(cmd.sender, roomDesc.c_str(), roomDesc.length());
-                    }
-                    else{
-                        if(state==INPROGRESS){
-                            std::string qName="TotemRoom"+std::to_string(roomId);
-                            message_queue roomQ(open_only, qName.c_str());
-                            roomQ.send(&cmd, sizeof(cmd), 1);
-                        }
-                    }
-                    room_mutex.unlock();
-                    client_mutex.unlock();
+                    dropOutput(clientSock);
+                    connections[clientSock] = connection{clientAddr, std::string(), false, PROTO_TEXT};
+                    ev.events = EPOLLIN;
+                    ev.data.fd = clientSock;
+                    epoll_ctl(epfd, EPOLL_CTL_ADD, clientSock, &ev);
+
+                    const char* hello = "Connected to the \"Totem\" game server. Choose your nickname:\n";
+                    printf("Connection from %s\n", inet_ntoa(clientAddr.sin_addr));
+                    sendTo(clientSock, hello, strlen(hello));
                 }
+                continue;
             }
-            else{
-                /*
-                client_mutex.lock();
-                printf("Current clients:\n");
-                for(unsigned int i=0; i<clients->size(); i++){
-                    const char* nick=(clients->at(i).nick!="")? clients->at(i).nick.c_str() : "unnamed";
-                    printf("%d - %s;\n", clients->at(i).fd, nick);
-                }
-                client_mutex.unlock();
-                */
-                usleep(50000);
+
+            auto it = connections.find(fd);
+            if (it == connections.end()) continue;
+            connection &conn = it->second;
+            if (events[e].events & EPOLLOUT) flushOutput(fd);
+            if (!(events[e].events & (EPOLLIN | EPOLLHUP | EPOLLERR))) continue;
+            int readBytes = read(fd, buff, buff_size - 1);
+            if (readBytes == -1 && (errno == EAGAIN || errno == EWOULDBLOCK)) continue;
+            if (readBytes <= 0) {
+                // error lub zamknięcie połączenia przez klienta
+                epoll_ctl(epfd, EPOLL_CTL_DEL, fd, nullptr);
+                dropConnection(fd, conn, clients, rooms, client_mutex, room_locks, allocInst);
+                connections.erase(it);
+                closing.push_back(std::make_pair(fd, time(NULL)));
+                continue;
+            }
+            buff[readBytes] = '\0';
+            conn.inputBuffer += buff;
+
+            // przetwarzenie pełnych linii (komend) z bufora
+            size_t pos;
+            while ((pos = conn.inputBuffer.find('\n')) != std::string::npos) {
+                std::string line = conn.inputBuffer.substr(0, pos);
+                conn.inputBuffer.erase(0, pos + 1);
+
+                // Kompatybilność z klientami Windows
+                if (!line.empty() && line.back() == '\r')
+                    line.pop_back();
+
+                if (line.empty())
+                    continue;
+
+                handleLine(fd, conn, line, clients, rooms, client_mutex, room_locks, allocInst);
             }
         }
+
+        time_t now = time(NULL);
+        while (!closing.empty() && now - closing.front().second >= 1) {
+            close(closing.front().first);
+            closing.erase(closing.begin());
+        }
     }
 
     sleep(2);
@@ -1070,7 +1665,8 @@ int main(int argc, char** argv){
     }
     segment.destroy<clientVector>("clients");
     segment.destroy<roomVector>("rooms");
-    message_queue::remove(MQ_NAME);
+    for (auto &entry : closing) close(entry.first);
+    close(epfd);
     freeaddrinfo(resolved);
     shutdown(sock, SHUT_RDWR);
     close(sock);
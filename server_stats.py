@@ -0,0 +1,161 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+
+from client import AsyncConnection
+
+STATS_END = "End of stats."
+
+_HEADER_RE = re.compile(
+    r"Stats: uptime (?P<uptime>\d+) s, clients (?P<clients>\d+), rooms (?P<rooms>\d+) "
+    r"\((?P<in_progress>\d+) in progress\), players (?P<players>\d+), spectators (?P<spectators>\d+), "
+    r"game threads (?P<game_threads>\d+)\.$"
+)
+_QUEUES_RE = re.compile(
+    r"Queues: (?P<queued>\d+) queued, deepest (?P<deepest>\d+), high-water (?P<high_water>\d+), "
+    r"dropped (?P<dropped>\d+)\.$"
+)
+_MEMORY_RE = re.compile(
+    r"Memory: (?P<used>\d+) of (?P<size>\d+) bytes used, (?P<free>\d+) free; "
+    r"clients \d+/(?P<client_capacity>\d+), rooms \d+/(?P<room_capacity>\d+)\.$"
+)
+_HISTOGRAM_RE = re.compile(
+    r"(?P<what>Command|Queue wait) (?P<name>\w+): (?P<count>\d+) calls, avg (?P<avg>\d+) us, "
+    r"max (?P<max>\d+) us, buckets (?P<buckets>[\d ]+)$"
+)
+
+def _ints(m):
+    return {key: int(value) for key, value in m.groupdict().items()}
+
+def parse_stats(lines):
+    stats = {"server": {}, "queues": {}, "memory": {}, "commands": {}, "queue_wait": {}}
+    for line in lines:
+        m = _HISTOGRAM_RE.match(line)
+        if m:
+            section = stats["commands"] if m.group("what") == "Command" else stats["queue_wait"]
+            section[m.group("name")] = {
+                "count": int(m.group("count")),
+                "avg_us": int(m.group("avg")),
+                "max_us": int(m.group("max")),
+                "buckets": [int(b) for b in m.group("buckets").split()],
+            }
+            continue
+        for key, regex in (("server", _HEADER_RE), ("queues", _QUEUES_RE), ("memory", _MEMORY_RE)):
+            m = regex.match(line)
+            if m:
+                stats[key] = _ints(m)
+                break
+    return stats
+
+def bucket_percentile(buckets, p):
+    # upper bound in us of the bucket holding the p-th percentile; bucket i covers [2^(i-1), 2^i)
+    total = sum(buckets)
+    if not total:
+        return None
+    rank = p / 100 * total
+    seen = 0
+    for i, count in enumerate(buckets):
+        seen += count
+        if seen >= rank:
+            return 1 << i
+    return 1 << (len(buckets) - 1)
+
+async def _login(conn, nick):
+    conn.send_line(nick)
+    while True:
+        line = await asyncio.wait_for(conn.recv(), 5)
+        if line is None:
+            raise ConnectionError("server closed the connection")
+        if line == "Nickname set successfully.":
+            return
+        if line.startswith("Nickname unavailable") or line.startswith("Nickname must"):
+            raise ConnectionError(f"nickname {nick!r} rejected: {line}")
+
+async def fetch(conn):
+    conn.send_line("stats")
+    lines = []
+    while True:
+        line = await asyncio.wait_for(conn.recv(), 5)
+        if line is None:
+            raise ConnectionError("server closed the connection")
+        if line == STATS_END:
+            return parse_stats(lines)
+        if type(line) is str:
+            lines.append(line)
+
+def render(stats, previous, elapsed):
+    server, queues, memory = stats["server"], stats["queues"], stats["memory"]
+    out = [
+        f"uptime {server.get('uptime')} s | clients {server.get('clients')}/{memory.get('client_capacity')} | "
+        f"rooms {server.get('rooms')} ({server.get('in_progress')} in progress) | players {server.get('players')} | "
+        f"spectators {server.get('spectators')} | game threads {server.get('game_threads')}",
+        f"room queues: {queues.get('queued')} queued, deepest {queues.get('deepest')}, "
+        f"high-water {queues.get('high_water')}, dropped {queues.get('dropped')} | "
+        f"memory {memory.get('used', 0) / 2**20:.1f} of {memory.get('size', 0) / 2**20:.1f} MiB",
+        "",
+        f"{'command':<10}{'calls':>9}{'/s':>8}{'avg us':>9}{'p50<=':>9}{'p99<=':>9}{'max us':>9}"
+        f"{'wait avg':>10}{'wait p99<=':>12}",
+    ]
+    for name, command in stats["commands"].items():
+        rate = ""
+        if previous and elapsed:
+            before = previous["commands"].get(name, {}).get("count", 0)
+            rate = f"{(command['count'] - before) / elapsed:.1f}"
+        wait = stats["queue_wait"].get(name)
+        wait_avg = wait["avg_us"] if wait and wait["count"] else ""
+        wait_p99 = bucket_percentile(wait["buckets"], 99) if wait else None
+        out.append(
+            f"{name:<10}{command['count']:>9}{rate:>8}{command['avg_us']:>9}"
+            f"{bucket_percentile(command['buckets'], 50) or '':>9}{bucket_percentile(command['buckets'], 99) or '':>9}"
+            f"{command['max_us']:>9}{wait_avg:>10}{wait_p99 or '':>12}"
+        )
+    return "\n".join(out)
+
+async def watch(host, port, nick, interval, once, json_path):
+    conn = AsyncConnection(host, port)
+    await conn.open()
+    try:
+        await _login(conn, nick)
+        previous = None
+        previous_at = None
+        while True:
+            stats = await fetch(conn)
+            now = time.perf_counter()
+            text = render(stats, previous, now - previous_at if previous_at else None)
+            if json_path:
+                with open(json_path, "w") as f:
+                    json.dump(stats, f, indent=2)
+            if once:
+                print(text)
+                return
+            if sys.stdout.isatty():
+                print("\033[H\033[J", end="")
+            print(text, flush=True)
+            previous, previous_at = stats, now
+            await asyncio.sleep(interval)
+    finally:
+        await conn.aclose()
+
+def main():
+    parser = argparse.ArgumentParser(description="Live view of the Totem server 'stats' command")
+    parser.add_argument("host")
+    parser.add_argument("port", type=int)
+    parser.add_argument("--interval", type=float, default=2.0)
+    parser.add_argument("--nick", default=f"stats{os.getpid() % 100000}")
+    parser.add_argument("--once", action="store_true", help="print one snapshot and exit")
+    parser.add_argument("--json", help="write the latest snapshot to this file")
+    args = parser.parse_args()
+    try:
+        asyncio.run(watch(args.host, args.port, args.nick, args.interval, args.once, args.json))
+    except KeyboardInterrupt:
+        pass
+    except (OSError, ConnectionError, asyncio.TimeoutError) as e:
+        print(f"Cannot read stats from {args.host}:{args.port}: {e}")
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
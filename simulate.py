@@ -0,0 +1,272 @@
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+# rules as in gameRunner (server.cpp): 18 shapes x 4 colors, card i*4+j has shape i and color j
+SHAPES = 18
+COLORS = 4
+DECK = SHAPES * COLORS
+NO_GRAB = -1
+
+def shuffled_decks(rng, games):
+    return rng.permuted(np.tile(np.arange(DECK, dtype=np.int8), (games, 1)), axis=1)
+
+class Batch:
+    # a hand is a ring buffer the size of the deck (cards are played from head, collected cards go
+    # to the back), a table is a stack; both are one (games, players, DECK) array plus lengths
+    def __init__(self, players, decks, starts):
+        games = len(decks)
+        self.players = players
+        self.ids = np.arange(games)
+        self.hands = np.zeros((games, players, DECK), dtype=np.int8)
+        self.head = np.zeros((games, players), dtype=np.int64)
+        self.hand_len = np.zeros((games, players), dtype=np.int64)
+        self.table = np.zeros((games, players, DECK), dtype=np.int8)
+        self.table_len = np.zeros((games, players), dtype=np.int64)
+        # shape of the top card; empty tables get distinct negative values so they never form a duel
+        self.empty = -1 - np.arange(players)
+        self.top = np.tile(self.empty, (games, 1))
+        self.current = np.asarray(starts, dtype=np.int64) % players
+        self.turn = np.zeros(games, dtype=np.int64)
+        # round-robin deal: card i goes to player i % players
+        for p in range(players):
+            dealt = decks[:, p::players]
+            self.hands[:, p, :dealt.shape[1]] = dealt
+            self.hand_len[:, p] = dealt.shape[1]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def keep(self, mask):
+        for name in ("ids", "hands", "head", "hand_len", "table", "table_len", "top", "current", "turn"):
+            setattr(self, name, getattr(self, name)[mask])
+
+    def duels(self):
+        # players whose top card has the same shape as someone else's
+        top = self.top
+        duel = np.zeros(top.shape, dtype=bool)
+        for i in range(self.players):
+            for j in range(i + 1, self.players):
+                same = top[:, i] == top[:, j]
+                duel[:, i] |= same
+                duel[:, j] |= same
+        return duel
+
+    def draw(self):
+        # flat (game, player) indices - faster than indexing with three arrays
+        seat = np.arange(len(self)) * self.players + self.current
+        seat = seat[self.hand_len.ravel()[seat] > 0]
+        head = self.head.ravel()[seat]
+        card = self.hands.reshape(-1)[seat * DECK + head]
+        self.table.reshape(-1)[seat * DECK + self.table_len.ravel()[seat]] = card
+        self.top.ravel()[seat] = card // COLORS
+        self.table_len.ravel()[seat] += 1
+        self.head.ravel()[seat] = (head + 1) % DECK
+        self.hand_len.ravel()[seat] -= 1
+        self.turn += 1
+        self.current = (self.current + 1) % self.players
+
+    def grab(self, grabber):
+        # returns a mask of the games won by the grabber
+        won = np.zeros(len(self), dtype=bool)
+        games = np.flatnonzero(grabber != NO_GRAB)
+        if len(games) == 0:
+            return won
+        who = grabber[games]
+        tops = self.top[games]
+        opps = tops == tops[np.arange(len(games)), who][:, None]
+        opps[np.arange(len(games)), who] = False
+        count = opps.sum(axis=1)
+
+        mistake, fight = games[count == 0], games[count > 0]
+        self._take_all(mistake, grabber[mistake])
+        self._fight(fight, grabber[fight], opps[count > 0], count[count > 0])
+        won[fight] = self.hand_len[fight, grabber[fight]] == 0
+        return won
+
+    def _take_all(self, games, who):
+        # mistake: the grabber collects every table in order, starting from player 0
+        if len(games) == 0:
+            return
+        pos = np.arange(DECK)
+        g, src, k = np.nonzero(pos < self.table_len[games][:, :, None])
+        self._append(games[g], src, k, who[g])
+        self.table_len[games] = 0
+        self.top[games] = self.empty
+
+    def _fight(self, games, who, opps, count):
+        # duel won: the winner's cards are dealt round-robin to the losers, then each takes their own table
+        if len(games) == 0:
+            return
+        pos = np.arange(DECK)
+        order = np.argsort(~opps, axis=1, kind="stable")
+        g1, k1 = np.nonzero(pos < self.table_len[games, who][:, None])
+        dst1 = order[g1, k1 % count[g1]]
+        g2, src2, k2 = np.nonzero((pos < self.table_len[games][:, :, None]) & opps[:, :, None])
+        g = np.concatenate([g1, g2])
+        self._append(games[g], np.concatenate([who[g1], src2]), np.concatenate([k1, k2]),
+                     np.concatenate([dst1, src2]))
+        lost = np.nonzero(opps)
+        self.table_len[games[lost[0]], lost[1]] = 0
+        self.top[games[lost[0]], lost[1]] = self.empty[lost[1]]
+        self.table_len[games, who] = 0
+        self.top[games, who] = self.empty[who]
+
+    def _append(self, games, src, k, dst):
+        # moves table[games, src, k] to the back of the dst hands, keeping the input order
+        if len(games) == 0:
+            return
+        key = games * self.players + dst
+        order = np.argsort(key, kind="stable")
+        games, src, k, dst, key = games[order], src[order], k[order], dst[order], key[order]
+        first = np.r_[True, key[1:] != key[:-1]]
+        starts = np.flatnonzero(first)
+        sizes = np.diff(np.r_[starts, len(key)])
+        rank = np.arange(len(key)) - np.repeat(starts, sizes)
+        slot = (self.head[games, dst] + self.hand_len[games, dst] + rank) % DECK
+        self.hands[games, dst, slot] = self.table[games, src, k]
+        self.hand_len[games[starts], dst[starts]] += sizes
+
+class Simulator:
+    def __init__(self, players, policy, seed=None, max_turns=10000):
+        if not 2 <= players <= 8:
+            raise ValueError("players must be between 2 and 8")
+        self.players = players
+        self.policy = policy
+        self.rng = np.random.default_rng(seed)
+        self.max_turns = max_turns
+
+    def deal(self, games):
+        return shuffled_decks(self.rng, games), self.rng.integers(0, self.players, games)
+
+    def run(self, games, decks=None, starts=None):
+        # returns (turns to win, winner) per game; unfinished games have -1 in both
+        if decks is None:
+            decks, starts = self.deal(games)
+        elif starts is None:
+            starts = np.zeros(len(decks), dtype=np.int64)
+        batch = Batch(self.players, np.asarray(decks, dtype=np.int8), starts)
+        turns = np.full(len(batch), -1, dtype=np.int64)
+        winners = np.full(len(batch), -1, dtype=np.int64)
+        while len(batch) and batch.turn[0] < self.max_turns:
+            batch.draw()
+            grabber = np.asarray(self.policy(batch, self.rng), dtype=np.int64)
+            won = batch.grab(grabber)
+            if not won.any():
+                continue
+            turns[batch.ids[won]] = batch.turn[won]
+            winners[batch.ids[won]] = grabber[won]
+            # a finished game with no cards left never changes again; copying the state is expensive,
+            # so finished games are only dropped once they make up a quarter of the batch
+            batch.ids[won] = -1
+            batch.hand_len[won] = 0
+            batch.table_len[won] = 0
+            batch.top[won] = batch.empty
+            if (batch.ids == -1).sum() * 4 >= len(batch):
+                batch.keep(batch.ids != -1)
+        return turns, winners
+
+# policies get the batch after each draw and return the grabbing player per game, or NO_GRAB
+
+class NoGrab:
+    def __call__(self, batch, rng):
+        return np.full(len(batch), NO_GRAB)
+
+class Perfect:
+    # every duel is won by a random participant, nobody grabs outside a duel
+    def __call__(self, batch, rng):
+        return _pick(batch.duels(), rng)
+
+class Reflex:
+    # a duel is noticed with probability reaction; otherwise a random player grabs with
+    # probability mistake (a mistake unless they happen to be in a duel)
+    def __init__(self, reaction=0.8, mistake=0.01):
+        self.reaction = reaction
+        self.mistake = mistake
+
+    def __call__(self, batch, rng):
+        grabber = _pick(batch.duels(), rng)
+        grabber[rng.random(len(batch)) >= self.reaction] = NO_GRAB
+        rash = (grabber == NO_GRAB) & (rng.random(len(batch)) < self.mistake)
+        grabber[rash] = rng.integers(0, batch.players, rash.sum())
+        return grabber
+
+POLICIES = {"none": NoGrab, "perfect": Perfect, "reflex": Reflex}
+
+def _pick(mask, rng):
+    # a random player from each row of the mask, NO_GRAB for empty rows
+    weights = rng.random(mask.shape) * mask
+    grabber = weights.argmax(axis=1)
+    grabber[~mask.any(axis=1)] = NO_GRAB
+    return grabber
+
+def summarize(turns, winners, players):
+    done = turns >= 0
+    finished = turns[done]
+    result = {
+        "games": len(turns),
+        "finished": int(done.sum()),
+        "unfinished": int((~done).sum()),
+        "turns": {},
+        "histogram": {},
+        "wins_by_seat": np.bincount(winners[done], minlength=players).tolist(),
+    }
+    if len(finished):
+        result["turns"] = {
+            "mean": round(float(finished.mean()), 2),
+            "min": int(finished.min()),
+            "p50": int(np.percentile(finished, 50)),
+            "p90": int(np.percentile(finished, 90)),
+            "p99": int(np.percentile(finished, 99)),
+            "max": int(finished.max()),
+        }
+        width = max(1, int(np.ceil((finished.max() + 1) / 20)))
+        counts = np.bincount(finished // width)
+        result["histogram"] = {f"{i * width}-{(i + 1) * width - 1}": int(c) for i, c in enumerate(counts) if c}
+    return result
+
+def print_summary(result, elapsed):
+    print(f"Games: {result['games']} in {elapsed:.1f} s ({result['games'] / elapsed:.0f}/s), "
+          f"finished: {result['finished']}, unfinished: {result['unfinished']}")
+    if result["turns"]:
+        print("Turns to win: " + ", ".join(f"{k}={v}" for k, v in result["turns"].items()))
+        top = max(result["histogram"].values())
+        for bucket, count in result["histogram"].items():
+            print(f"{bucket:>12} {count:>9} {'#' * max(1, round(40 * count / top))}")
+    print("Wins by seat: " + " ".join(str(w) for w in result["wins_by_seat"]))
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline Totem match simulator")
+    parser.add_argument("-g", "--games", type=int, default=100000)
+    parser.add_argument("-p", "--players", type=int, default=4, choices=range(2, 9))
+    parser.add_argument("--policy", default="reflex", choices=sorted(POLICIES))
+    parser.add_argument("--reaction", type=float, default=0.8, help="reflex: chance a duel is noticed")
+    parser.add_argument("--mistake", type=float, default=0.01, help="reflex: chance of a rash grab per turn")
+    parser.add_argument("--batch", type=int, default=100000, help="games advanced together")
+    parser.add_argument("--max-turns", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the summary to this file")
+    args = parser.parse_args()
+    if args.policy == "reflex":
+        policy = Reflex(args.reaction, args.mistake)
+    else:
+        policy = POLICIES[args.policy]()
+    sim = Simulator(args.players, policy, args.seed, args.max_turns)
+    started = time.perf_counter()
+    turns, winners = [], []
+    for first in range(0, args.games, args.batch):
+        t, w = sim.run(min(args.batch, args.games - first))
+        turns.append(t)
+        winners.append(w)
+    elapsed = time.perf_counter() - started
+    result = summarize(np.concatenate(turns), np.concatenate(winners), args.players)
+    print_summary(result, elapsed)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == "__main__":
+    sys.exit(main())
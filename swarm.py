@@ -0,0 +1,357 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import deque
+
+from client import (
+    AsyncConnection, ProtocolDecoder, NickAccepted, RoomFrame, GameFrame,
+    FightWon, GrabMistake, GameWon, GameLost, Error, GameResync, PROTO_TEXT,
+)
+
+# commands that make up the load; refresh polling while waiting for a room is counted apart
+GAME_COMMANDS = ("draw", "grab", "create", "join", "start", "leave")
+
+class Stats:
+    def __init__(self):
+        self.commands = 0
+        self.polls = 0
+        self.failed = 0
+        self.stopped = 0
+        self.latencies = {"draw": [], "grab": []}
+        self.errors = {}
+        self.games_started = 0
+        self.games_finished = 0
+        self.disconnects = 0
+        self.resyncs = 0
+
+    def error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+def percentile(samples, p):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(p / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+class Group:
+    def __init__(self, index, size, room_base, groups):
+        self.index = index
+        self.size = size
+        self.room_base = room_base
+        self.groups = groups
+        self.round = 0
+        self.room_ready = asyncio.Event()
+        self.barrier = asyncio.Barrier(size)
+
+    @property
+    def room_id(self):
+        return self.room_base + self.round * self.groups + self.index
+
+    # a bot of the group died: its mates would wait for it forever
+    async def abort(self):
+        await self.barrier.abort()
+        self.room_ready.set()
+
+    def check(self):
+        if self.barrier.broken:
+            raise asyncio.BrokenBarrierError
+
+class Bot:
+    def __init__(self, swarm, group, seat):
+        self.swarm = swarm
+        self.group = group
+        self.seat = seat
+        self.rng = random.Random(swarm.seed * 100003 + group.index * 8 + seat)
+        self.conn = None
+        self.nickname = None
+        self.turn = None
+        self.game = None
+        self.decoder = ProtocolDecoder()
+        self.room = None
+        self.room_event = asyncio.Event()
+        self.game_over = asyncio.Event()
+        self.draw_sent = {}
+        # draws and grabs not answered yet, in send order: [kind, turn, sent]; the server answers
+        # a player's commands in order, so every reply belongs to the oldest entry it can answer
+        self.outstanding = deque()
+
+    @property
+    def stats(self):
+        return self.swarm.stats
+
+    def send(self, line):
+        self.conn.send_line(line)
+        if line.split(" ", 1)[0] in GAME_COMMANDS:
+            self.stats.commands += 1
+        elif line == "refresh":
+            self.stats.polls += 1
+
+    async def run(self):
+        self.conn = AsyncConnection(self.swarm.host, self.swarm.port, on_lines=self._on_lines)
+        await self.conn.open()
+        await self._pick_nick()
+        while True:
+            await self._enter_room()
+            await self._play()
+            self.send("leave")
+            await self.group.barrier.wait()
+            if self.seat == 0:
+                self.group.round += 1
+                self.group.room_ready.clear()
+            await self.group.barrier.wait()
+
+    async def _pick_nick(self):
+        self.nick_result = asyncio.get_running_loop().create_future()
+        attempt = 0
+        while True:
+            self.nickname = f"b{self.group.index}s{self.seat}" + (f"x{attempt}" if attempt else "")
+            self.send(self.nickname)
+            if await self.nick_result:
+                if self.swarm.protocol != PROTO_TEXT:
+                    self.send(f"protocol {self.swarm.protocol}")
+                return
+            attempt += 1
+            self.nick_result = asyncio.get_running_loop().create_future()
+
+    async def _enter_room(self):
+        self.turn = None
+        self.game = None
+        self.game_over.clear()
+        if self.seat == 0:
+            self.send(f"create {self.group.room_id}")
+            await self._wait_room(lambda room: self.nickname in room["players"])
+            self.group.room_ready.set()
+            await self._wait_room(lambda room: len(room["players"]) >= self.group.size)
+            self.send("start")
+            self.stats.games_started += 1
+        else:
+            await self.group.room_ready.wait()
+            self.group.check()
+            self.send(f"join {self.group.room_id}")
+
+    async def _wait_room(self, predicate):
+        while True:
+            self.group.check()
+            self.room_event.clear()
+            self.send("refresh")
+            try:
+                await asyncio.wait_for(self.room_event.wait(), 1.0)
+            except asyncio.TimeoutError:
+                continue
+            if self.room and self.room["id"] == self.group.room_id and predicate(self.room):
+                return
+            await asyncio.sleep(0.05)
+
+    async def _play(self):
+        grab_task = None
+        if self.swarm.grab_rate > 0:
+            grab_task = asyncio.get_running_loop().create_task(self._grabber())
+        try:
+            while not self.game_over.is_set():
+                self.group.check()
+                game = self.game
+                if game and game.turn is not None and game.current_player_nick == self.nickname \
+                        and game.turn not in self.draw_sent:
+                    await asyncio.sleep(self.rng.expovariate(self.swarm.draw_rate))
+                    if self.game is game:
+                        self.draw_sent[game.turn] = time.perf_counter()
+                        self.outstanding.append(["draw", game.turn, self.draw_sent[game.turn]])
+                        self.send(f"draw {game.turn}")
+                await self._wait_update()
+        finally:
+            if grab_task:
+                grab_task.cancel()
+            self.draw_sent.clear()
+            self.outstanding.clear()
+
+    async def _grabber(self):
+        while True:
+            await asyncio.sleep(self.rng.expovariate(self.swarm.grab_rate))
+            if self.turn is not None:
+                self.outstanding.append(["grab", self.turn, time.perf_counter()])
+                self.send(f"grab {self.turn}")
+
+    async def _wait_update(self):
+        self.update_event = asyncio.Event()
+        try:
+            await asyncio.wait_for(self.update_event.wait(), 1.0)
+        except asyncio.TimeoutError:
+            pass
+
+    def _on_lines(self, lines):
+        now = time.perf_counter()
+        for event in self.decoder.feed(lines):
+            kind = type(event)
+            if kind is GameFrame:
+                self._on_game(event.state, now)
+            elif kind is RoomFrame:
+                self.room = event.room
+                self.room_event.set()
+            elif kind is GameResync:
+                self.stats.resyncs += 1
+                self.send("refresh")
+            elif kind is NickAccepted:
+                if not self.nick_result.done():
+                    self.nick_result.set_result(True)
+            elif kind is FightWon or kind is GrabMistake:
+                grab = self._answered(lambda entry: entry[0] == "grab")
+                if grab:
+                    self.stats.latencies["grab"].append(now - grab[2])
+            elif kind is GameWon or kind is GameLost:
+                if kind is GameWon:
+                    self.stats.games_finished += 1
+                self.game_over.set()
+                self._wake()
+            elif kind is Error:
+                self.stats.error(event.kind)
+                if event.kind in ("nick_taken", "nick_length"):
+                    if not self.nick_result.done():
+                        self.nick_result.set_result(False)
+                elif event.kind == "not_your_turn":
+                    self._answered(lambda entry: entry[0] == "draw")
+                elif event.kind == "wrong_turn":
+                    # "Current turn is.N" answers the oldest command sent for another turn
+                    current = int(event.text.rsplit(".", 1)[1])
+                    stale = self._answered(lambda entry: entry[1] != current)
+                    if stale and stale[0] == "draw":
+                        self.draw_sent.pop(stale[1], None)
+
+    def _answered(self, match):
+        for i, entry in enumerate(self.outstanding):
+            if match(entry):
+                del self.outstanding[i]
+                return entry
+        return None
+
+    def _on_game(self, game, now):
+        if game is None or game.turn is None:
+            return
+        self.game = game
+        self.turn = game.turn
+        for turn in [t for t in self.draw_sent if t < game.turn]:
+            sent = self.draw_sent.pop(turn)
+            if turn + 1 == game.turn:
+                self.stats.latencies["draw"].append(now - sent)
+                self._answered(lambda entry: entry[0] == "draw" and entry[1] == turn)
+        self._wake()
+
+    def _wake(self):
+        event = getattr(self, "update_event", None)
+        if event:
+            event.set()
+
+class Swarm:
+    def __init__(self, host, port, bots, room_size, draw_rate, grab_rate, room_base, seed, protocol=PROTO_TEXT):
+        self.host = host
+        self.port = port
+        self.protocol = protocol
+        self.draw_rate = draw_rate
+        self.grab_rate = grab_rate
+        self.seed = seed
+        self.stats = Stats()
+        # every room is filled, so the load run is exactly the load requested
+        if bots < room_size or bots % room_size:
+            raise ValueError(f"--bots ({bots}) must be a multiple of --room-size ({room_size})")
+        groups = bots // room_size
+        self.groups = [Group(g, room_size, room_base, groups) for g in range(groups)]
+        self.bots = [Bot(self, group, seat) for group in self.groups for seat in range(room_size)]
+
+    async def run(self, duration):
+        tasks = {asyncio.get_running_loop().create_task(bot.run()): bot for bot in self.bots}
+        started = time.perf_counter()
+        pending = set(tasks)
+        while pending:
+            left = duration - (time.perf_counter() - started)
+            if left <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=left, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                error = task.exception()
+                if isinstance(error, asyncio.BrokenBarrierError):
+                    self.stats.stopped += 1
+                elif error is not None:
+                    self.stats.failed += 1
+                    self.stats.disconnects += 1
+                    await tasks[task].group.abort()
+        elapsed = time.perf_counter() - started
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for bot in self.bots:
+            if bot.conn:
+                await bot.conn.aclose()
+        return elapsed
+
+def report(stats, elapsed, bots):
+    result = {
+        "bots": bots,
+        "seconds": round(elapsed, 3),
+        "bots_failed": stats.failed,
+        "bots_stopped": stats.stopped,
+        "commands": stats.commands,
+        "commands_per_sec": round(stats.commands / elapsed, 1) if elapsed else 0.0,
+        "polls": stats.polls,
+        "games_started": stats.games_started,
+        "games_finished": stats.games_finished,
+        "disconnects": stats.disconnects,
+        "resyncs": stats.resyncs,
+        "errors": dict(sorted(stats.errors.items())),
+        "latency_ms": {},
+    }
+    for command, samples in stats.latencies.items():
+        result["latency_ms"][command] = {
+            "count": len(samples),
+            "p50": _ms(percentile(samples, 50)),
+            "p99": _ms(percentile(samples, 99)),
+            "p999": _ms(percentile(samples, 99.9)),
+        }
+    return result
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+def print_report(result):
+    print(f"Bots: {result['bots']} ({result['bots_failed']} failed, {result['bots_stopped']} stopped with "
+          f"their group), duration: {result['seconds']} s")
+    print(f"Commands: {result['commands']} ({result['commands_per_sec']}/s), refresh polls: {result['polls']}")
+    print(f"Games started: {result['games_started']}, finished: {result['games_finished']}, "
+          f"disconnects: {result['disconnects']}, resyncs: {result['resyncs']}")
+    for command, lat in result["latency_ms"].items():
+        print(f"{command:>5} latency (ms): n={lat['count']} p50={lat['p50']} p99={lat['p99']} p999={lat['p999']}")
+    if result["errors"]:
+        print("Errors:")
+        for kind, count in result["errors"].items():
+            print(f"  {kind}: {count}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Totem server load generator")
+    parser.add_argument("host")
+    parser.add_argument("port", type=int)
+    parser.add_argument("-n", "--bots", type=int, default=8)
+    parser.add_argument("--room-size", type=int, default=4, choices=range(2, 9))
+    parser.add_argument("--draw-rate", type=float, default=20.0, help="draws/s for the bot on turn")
+    parser.add_argument("--grab-rate", type=float, default=0.5, help="grabs/s per bot")
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--room-base", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--protocol", type=int, default=PROTO_TEXT, choices=(1, 2, 3))
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+    try:
+        swarm = Swarm(args.host, args.port, args.bots, args.room_size, args.draw_rate,
+                      args.grab_rate, args.room_base, args.seed, args.protocol)
+    except ValueError as e:
+        parser.error(str(e))
+    elapsed = asyncio.run(swarm.run(args.duration))
+    result = report(swarm.stats, elapsed, len(swarm.bots))
+    print_report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == "__main__":
+    sys.exit(main())
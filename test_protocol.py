@@ -0,0 +1,268 @@
+import pytest
+
+import client
+from client import (LineFramer, ProtocolDecoder, LobbyState, KeyedTreeview, LogModel, is_frame_line, FRAME_MARK,
+                    SessionRecorder, read_capture, REC_SESSION, REC_RECEIVED, REC_SENT, NickAccepted, ProtocolEnabled,
+                    LobbyFrame, LobbyUpdate, LobbyRemove, GameFrame, GameResync, GrabMistake, Error, Info,
+                    PROTO_DELTA)
+
+# byte streams recorded from ./server with two raw sockets (alice and bob)
+
+HELLO = (b'Connected to the "Totem" game server. Choose your nickname:\n'
+         b'Nickname set successfully.\n'
+         b'Protocol 3 enabled.\n')
+
+# alice subscribed, bob created room 7 and left it again
+LOBBY_PUSH = (b'Lobby update:\nRoom 7- players:\nbob\n0 spectators\nWaiting to start the match.\n'
+              b'Lobby removed: 7\n')
+
+# alice listed while bob sat in room 3, then bob left
+LOBBY_LIST = (b'Available rooms:\nRoom 3- players:\nbob\n0 spectators\nWaiting to start the match.\n'
+              b'End of rooms.\nLobby removed: 3\n')
+# the same from a server that does not end the list yet
+LOBBY_LIST_OPEN = LOBBY_LIST.replace(b'End of rooms.\n', b'')
+
+# some replies end with the NUL of the C string instead of a newline
+ERRORS = b"Invalid argument.\x00Not in a, room.\nRoom 99 doesn't exist.\n"
+
+# alice started room 8 with bob (roster + snapshot), then grabbed without a duel (delta, text, delta)
+START = (b'\x01R\x00\x0b\x02\x05alice\x03bob'
+         b'\x01S\x00\x14\x00\x00\x00\x01\x00\x00\x00\x00\x00\x02\x00\x00$\x00\xff\xff$\x00\xff\xff')
+GRAB = (b'\x01D\x00\x11\x00\x00\x00\x02\x00\x00\x00\x01\x01\x00\x00\x01\x00#\x01\x01\x07'
+        b'You made a mistake. Take all the cards :)\n'
+        b'\x01D\x00\x11\x00\x00\x00\x03\x00\x00\x00\x01\x01\x00\x00\x01\x00$\x00\xff\xff')
+
+def decode(chunks):
+    framer = LineFramer()
+    decoder = ProtocolDecoder()
+    events = []
+    for chunk in chunks:
+        events += decoder.feed(framer.feed(chunk))
+    assert not framer.buffer
+    return events
+
+def splits(data):
+    # every two-way split, plus one byte per read
+    yield "whole", [data]
+    for i in range(1, len(data)):
+        yield f"split@{i}", [data[:i], data[i:]]
+    yield "bytewise", [data[i:i + 1] for i in range(len(data))]
+
+def simple(events):
+    # GameState has no equality, compare what the GUI draws
+    out = []
+    for event in events:
+        if type(event) is GameFrame:
+            game = event.state
+            out.append(("game", game.version, game.turn, game.current_player_nick, game.spectators,
+                        [(p["nick"], p["hand"], p["table"], p["color"], p["shape"]) for p in game.players]))
+        elif type(event) is not LobbyFrame:
+            out.append(event)
+    return out
+
+def lobby_rooms(events):
+    lobby = LobbyState()
+    for event in events:
+        if type(event) is LobbyFrame:
+            lobby.rooms = list(event.rooms)
+        elif type(event) is LobbyUpdate:
+            lobby.apply_update(event.room)
+        elif type(event) is LobbyRemove:
+            lobby.apply_remove(event.room_id)
+    return lobby.rooms
+
+ROOM_7 = {"id": 7, "players": ["bob"], "spectators": 0, "state": "Waiting to start the match."}
+ROOM_3 = dict(ROOM_7, id=3)
+
+GAME_EVENTS = [
+    ("game", 1, 0, "alice", 0, [("alice", 36, 0, None, None), ("bob", 36, 0, None, None)]),
+    ("game", 2, 1, "bob", 0, [("alice", 35, 1, 1, 7), ("bob", 36, 0, None, None)]),
+    GrabMistake(),
+    ("game", 3, 1, "bob", 0, [("alice", 36, 0, None, None), ("bob", 36, 0, None, None)]),
+]
+
+def test_hello_text_lines():
+    assert decode([HELLO]) == [Info('Connected to the "Totem" game server. Choose your nickname:'),
+                               NickAccepted(), ProtocolEnabled(PROTO_DELTA)]
+
+@pytest.mark.parametrize("name,chunks", list(splits(ERRORS)))
+def test_nul_terminated_replies(name, chunks):
+    assert decode(chunks) == [Error("invalid_argument", "Invalid argument."),
+                              Error("not_in_room", "Not in a, room."),
+                              Error("room_missing", "Room 99 doesn't exist.")]
+
+@pytest.mark.parametrize("name,chunks", list(splits(LOBBY_PUSH)))
+def test_lobby_update_and_remove(name, chunks):
+    assert decode(chunks) == [LobbyUpdate(ROOM_7), LobbyRemove(7)]
+
+@pytest.mark.parametrize("name,chunks", [(f"ended-{name}", chunks) for name, chunks in splits(LOBBY_LIST)]
+                                        + [(f"open-{name}", chunks) for name, chunks in splits(LOBBY_LIST_OPEN)])
+def test_lobby_list_then_remove(name, chunks):
+    events = decode(chunks)
+    assert [type(e) for e in events if type(e) is not LobbyFrame] == [LobbyRemove]
+    frames = [e for e in events if type(e) is LobbyFrame]
+    # only the last frame, sent once the list has ended, claims to hold every room
+    assert [e.complete for e in frames] == [False] * (len(frames) - 1) + [True]
+    assert frames[-1].rooms == [ROOM_3]
+    assert events[-1] == LobbyRemove(3)
+    assert lobby_rooms(events) == []
+
+def test_long_lobby_list_in_small_reads():
+    rooms = [dict(ROOM_7, id=i, players=["bob", f"p{i}"]) for i in range(300)]
+    data = b"Available rooms:\n" + b"".join(
+        f"Room {i}- players:\nbob\np{i}\n0 spectators\nWaiting to start the match.\n".encode() for i in range(300))
+    data += b"End of rooms.\n"
+    events = decode([data[i:i + 512] for i in range(0, len(data), 512)])
+    assert all(type(e) is LobbyFrame for e in events)
+    assert len(events) > 2
+    assert [e.complete for e in events] == [False] * (len(events) - 1) + [True]
+    assert events[-1].rooms == rooms
+    # each partial frame is a prefix of the list, never a room too many
+    assert all(e.rooms == rooms[:len(e.rooms)] for e in events)
+
+def test_capture_round_trip(tmp_path, monkeypatch):
+    clock = iter(range(1000, 100000, 1000))
+    monkeypatch.setattr(client.time, "monotonic_ns", lambda: next(clock))
+    framer = LineFramer()
+    reads = [framer.feed(START), framer.feed(GRAB), framer.feed(ERRORS), framer.feed("Gracz żółw\n".encode())]
+    assert any(type(line) is bytes for line in reads[1]) and any(type(line) is str for line in reads[1])
+    path = tmp_path / "session.totem"
+    recorder = SessionRecorder(path)
+    recorder.session("127.0.0.1", 5000)
+    recorder.sent("alice")
+    for lines in reads:
+        recorder.received(lines)
+    recorder.received([])
+    recorder.sent("grab 1")
+    recorder.close()
+    # a second session appends to the same file
+    recorder = SessionRecorder(path)
+    recorder.session("localhost", 5001)
+    recorder.close()
+    expected = ([(REC_SESSION, "127.0.0.1:5000"), (REC_SENT, "alice")] + [(REC_RECEIVED, lines) for lines in reads]
+                + [(REC_RECEIVED, []), (REC_SENT, "grab 1"), (REC_SESSION, "localhost:5001")])
+    records = list(read_capture(path))
+    assert [(kind, data) for kind, ns, data in records] == expected
+    assert [ns for kind, ns, data in records] == [1000 * (i + 1) for i in range(len(expected))]
+    # frames come back as bytes (b"x" != "x"), so the decoder sees the same session
+    received = [data for kind, ns, data in records if kind == REC_RECEIVED]
+    decoder = ProtocolDecoder()
+    assert simple([e for lines in received[:2] for e in decoder.feed(lines)]) == GAME_EVENTS
+    # a record cut short by a crash is left out
+    path.write_bytes(path.read_bytes()[:-3])
+    assert [(kind, data) for kind, ns, data in read_capture(path)] == expected[:-1]
+
+def test_log_model_keeps_the_last_lines():
+    log = LogModel(max_lines=3)
+    for i in range(5):
+        log.append(f"line {i}", "server")
+    assert log.take_pending() == [("line 2", "server"), ("line 3", "server"), ("line 4", "server")]
+    assert log.take_pending() == []
+    log.append("line 5")
+    assert log.take_pending() == [("line 5", None)]
+    log.reload()
+    assert [text for text, tag in log.take_pending()] == ["line 3", "line 4", "line 5"]
+
+def test_log_model_hides_frames():
+    hide = [True]
+    log = LogModel(max_lines=4, widget_filter=lambda text, tag: not (hide[0] and is_frame_line(text, tag)))
+    log.append("[CLIENT -> SERVER] refresh", "client")
+    log.append("Turn 3", "server")
+    log.append("Player bob has 35 cards in hand and 1 cards on the table.", "server")
+    log.append("<binary frame D, 17 bytes>", "server")
+    log.append("[CLIENT -> SERVER] draw 3", "client")
+    log.append("Not your turn.", "server")
+    log.append("[SYSTEM] Game started, switching to game tab", "system")
+    assert log.take_pending() == [("[CLIENT -> SERVER] draw 3", "client"), ("Not your turn.", "server"),
+                                  ("[SYSTEM] Game started, switching to game tab", "system")]
+    # unticking the box reloads what the model still holds, frames included
+    hide[0] = False
+    log.reload()
+    assert [text for text, tag in log.take_pending()] == [
+        "<binary frame D, 17 bytes>", "[CLIENT -> SERVER] draw 3", "Not your turn.",
+        "[SYSTEM] Game started, switching to game tab"]
+
+class FakeTree:
+    # the ttk.Treeview calls KeyedTreeview makes; a deleted row loses its selection
+    def __init__(self):
+        self.items = []
+        self.values = {}
+        self.selected = set()
+        self.deleted = []
+
+    def insert(self, parent, index, iid, values):
+        self.items.insert(index, iid)
+        self.values[iid] = values
+
+    def delete(self, *iids):
+        self.deleted += iids
+        for iid in iids:
+            self.items.remove(iid)
+            self.selected.discard(iid)
+
+    def move(self, iid, parent, index):
+        self.items.remove(iid)
+        self.items.insert(index, iid)
+
+    def set(self, iid, column, value):
+        self.values[iid] = tuple(value if c == column else v for c, v in zip(COLUMNS, self.values[iid]))
+
+COLUMNS = ("id", "players", "spectators", "state")
+
+def room_rows(rooms):
+    return [(room["id"], (room["id"], ", ".join(room["players"]), room["spectators"], room["state"]))
+            for room in rooms]
+
+def lobby_list(rooms):
+    return b"Available rooms:\n" + b"".join(
+        f"Room {room['id']}- players:\n{chr(10).join(room['players'])}\n{room['spectators']} spectators\n"
+        f"{room['state']}\n".encode() for room in rooms) + b"End of rooms.\n"
+
+def test_lobby_rows_kept_while_a_long_list_comes_in():
+    rooms = [dict(ROOM_7, id=i, players=["bob", f"p{i}"]) for i in range(3000)]
+    tree = FakeTree()
+    rows = KeyedTreeview(tree, COLUMNS)
+    rows.update(room_rows(rooms))
+    tree.selected.add("1500")
+    # the next list drops room 10 and changes room 2000
+    rooms = [room for room in rooms if room["id"] != 10]
+    rooms[1999] = dict(rooms[1999], spectators=3)
+    data = lobby_list(rooms)
+    framer = LineFramer()
+    decoder = ProtocolDecoder()
+    frames = 0
+    for i in range(0, len(data), 4096):
+        for event in decoder.feed(framer.feed(data[i:i + 4096])):
+            rows.update(room_rows(event.rooms), event.complete)
+            frames += 1
+            if not event.complete:
+                assert tree.deleted == []
+                assert len(tree.items) == 3000
+    assert frames > 2
+    assert tree.deleted == ["10"]
+    assert tree.selected == {"1500"}
+    assert tree.items == [str(room["id"]) for room in rooms]
+    assert tree.values["2000"][2] == 3
+
+@pytest.mark.parametrize("name,chunks", list(splits(START + GRAB)))
+def test_frames_and_text_interleaved(name, chunks):
+    assert simple(decode(chunks)) == GAME_EVENTS
+
+def test_frame_mark_split_across_reads():
+    mark = START.index(FRAME_MARK, 1)
+    for cut in (mark, mark + 1, mark + 2, mark + 3):
+        assert simple(decode([START[:cut], START[cut:], GRAB])) == GAME_EVENTS
+
+def test_text_after_binary_mode_keeps_nul_terminators():
+    events = decode([START, ERRORS, LOBBY_PUSH])
+    assert simple(events)[1:] == [Error("invalid_argument", "Invalid argument."),
+                                  Error("not_in_room", "Not in a, room."),
+                                  Error("room_missing", "Room 99 doesn't exist."),
+                                  LobbyUpdate(ROOM_7), LobbyRemove(7)]
+
+def test_missed_delta_requests_one_resync():
+    second_delta = GRAB[GRAB.index(b"\n") + 1:]
+    events = decode([START, second_delta, second_delta])
+    assert simple(events)[1:] == [GameResync(3)]
+    # the snapshot sent in answer to refresh brings the state back
+    assert simple(decode([START, second_delta, START[START.index(FRAME_MARK, 1):]]))[-1] == GAME_EVENTS[0]
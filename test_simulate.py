@@ -0,0 +1,91 @@
+from collections import Counter, deque
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from simulate import COLORS, DECK, NO_GRAB, Reflex, Simulator, shuffled_decks
+
+class Reference:
+    # gameRunner's rules (server.cpp) one card at a time; a card is shape * COLORS + color
+    def __init__(self, players, deck, start):
+        self.hands = [deque(int(card) for card in deck[p::players]) for p in range(players)]
+        self.tables = [[] for _ in range(players)]
+        self.current = int(start) % players
+        self.turn = 0
+        self.winner = -1
+
+    def draw(self):
+        hand = self.hands[self.current]
+        if hand:
+            self.tables[self.current].append(hand.popleft())
+        self.turn += 1
+        self.current = (self.current + 1) % len(self.hands)
+
+    def grab(self, i):
+        opps = []
+        if self.tables[i]:
+            shape = self.tables[i][-1] // COLORS
+            opps = [j for j, table in enumerate(self.tables)
+                    if j != i and table and table[-1] // COLORS == shape]
+        if not opps:
+            for table in self.tables:
+                self.hands[i].extend(table)
+                table.clear()
+            return "mistake"
+        for k, card in enumerate(self.tables[i]):
+            self.hands[opps[k % len(opps)]].append(card)
+        for j in opps:
+            self.hands[j].extend(self.tables[j])
+            self.tables[j].clear()
+        self.tables[i].clear()
+        if self.hands[i]:
+            return "fight"
+        self.winner = i
+        return "won"
+
+    def state(self):
+        return [list(hand) for hand in self.hands], self.tables, self.current, self.turn
+
+def batch_state(batch, g):
+    players = range(batch.players)
+    hands = [[int(batch.hands[g, p, (batch.head[g, p] + k) % DECK]) for k in range(batch.hand_len[g, p])]
+             for p in players]
+    tables = [batch.table[g, p, :batch.table_len[g, p]].tolist() for p in players]
+    assert [int(batch.top[g, p]) for p in players] == [
+        table[-1] // COLORS if table else int(batch.empty[p]) for p, table in zip(players, tables)]
+    return hands, tables, int(batch.current[g]), int(batch.turn[g])
+
+class Checked:
+    # a policy that checks every game of the batch against the reference after each draw,
+    # then plays the same grab on the reference
+    def __init__(self, players, policy, decks, starts):
+        self.games = [Reference(players, deck, start) for deck, start in zip(decks, starts)]
+        self.policy = policy
+        self.outcomes = Counter()
+
+    def __call__(self, batch, rng):
+        grabber = np.asarray(self.policy(batch, rng))
+        for g, game in enumerate(batch.ids):
+            if game == -1:
+                continue
+            reference = self.games[game]
+            reference.draw()
+            assert batch_state(batch, g) == reference.state()
+            if grabber[g] != NO_GRAB:
+                self.outcomes[reference.grab(int(grabber[g]))] += 1
+        return grabber
+
+@pytest.mark.parametrize("players", [2, 3, 5])
+def test_batch_matches_server_rules(players):
+    # rash grabs are frequent enough for take-all mistakes to happen in every game
+    rng = np.random.default_rng(players)
+    decks = shuffled_decks(rng, 24)
+    starts = rng.integers(0, players, len(decks))
+    checked = Checked(players, Reflex(reaction=0.9, mistake=0.05), decks, starts)
+    turns, winners = Simulator(players, checked, seed=7, max_turns=3000).run(len(decks), decks, starts)
+    assert checked.outcomes["mistake"] > 0
+    assert checked.outcomes["fight"] > 0
+    assert checked.outcomes["won"] > 0
+    assert winners.tolist() == [game.winner for game in checked.games]
+    assert turns.tolist() == [game.turn if game.winner != -1 else -1 for game in checked.games]